@@ -1,12 +1,24 @@
 #!/bin/bash
 # Update jarchive.csv with new episodes
-# This script downloads new games, parses them, sorts, and appends to jarchive.csv
+# This script streams new games from j-archive.com through the parser into jarchive.csv
 
 set -e
 cd $(dirname "$0")/..
 
 echo "=== Starting jarchive update ==="
 
+# The year shards are the copy of the archive kept in git; jarchive.csv is
+# rebuilt from them for this run. Before the first run with shards, split the
+# existing jarchive.csv instead.
+if [ -f "$PWD/jarchive_shards/manifest.json" ] && [ ! -f "$PWD/jarchive.csv" ]; then
+    echo "=== Rebuilding jarchive.csv from the year shards ==="
+    python3 "$PWD/sharded_archive.py" --shard-dir "$PWD/jarchive_shards" verify
+    python3 "$PWD/sharded_archive.py" --shard-dir "$PWD/jarchive_shards" join "$PWD/jarchive.csv"
+elif [ ! -f "$PWD/jarchive_shards/manifest.json" ]; then
+    echo "=== Splitting jarchive.csv into year shards ==="
+    python3 "$PWD/sharded_archive.py" --shard-dir "$PWD/jarchive_shards" build "$PWD/jarchive.csv"
+fi
+
 # Read the last episode number
 LAST_EPISODE=$(cat "$PWD/last_episode.txt")
 START_EPISODE=$((LAST_EPISODE + 1))
@@ -14,94 +26,78 @@ START_EPISODE=$((LAST_EPISODE + 1))
 echo "Last episode in archive: $LAST_EPISODE"
 echo "Starting download from: $START_EPISODE"
 
-# Create temporary directory for new games
-TEMP_DIR="$PWD/temp_new_games"
-mkdir -p "$TEMP_DIR"
+# Keep the archive as it was for this run's delta file
+cp "$PWD/jarchive.csv" "$PWD/jarchive_prev_temp.csv"
 
-# Download new episodes
-echo "=== Downloading new episodes ==="
-python3 "$PWD/download_new_episodes.py" "$TEMP_DIR" "$START_EPISODE" 9999
+# Download, parse and append new episodes in one streaming pass; the new
+# clues are also kept in jarchive_new_temp.csv for the search index
+echo "=== Downloading, parsing and appending new episodes ==="
+python3 "$PWD/pipeline.py" "$START_EPISODE" auto --archive "$PWD/jarchive.csv" \
+    --last-episode "$PWD/last_episode.txt" --new-csv "$PWD/jarchive_new_temp.csv" \
+    --journal "$PWD/download_journal.jsonl" --metrics "$PWD/update_metrics.json"
 
-# Check if any files were downloaded
-NUM_FILES=$(ls -1 "$TEMP_DIR"/*.html 2>/dev/null | wc -l | tr -d ' ')
+# Get the count of new clues
+NEW_CLUES=$(tail -n +2 "$PWD/jarchive_new_temp.csv" | wc -l | tr -d ' ')
+echo "Appended $NEW_CLUES new clues"
 
-if [ "$NUM_FILES" -eq "0" ]; then
+if [ "$NEW_CLUES" -eq "0" ]; then
     echo "No new episodes found. Archive is up to date."
-    rm -rf "$TEMP_DIR"
+    rm -f "$PWD/jarchive_new_temp.csv" "$PWD/jarchive_prev_temp.csv"
     exit 0
 fi
 
-echo "Downloaded $NUM_FILES new game files"
+# Check the appended archive before anything is built from it; errors in this
+# run's games stop the update, older anomalies are only reported
+echo "=== Validating archive ==="
+python3 "$PWD/validate_archive.py" "$PWD/jarchive.csv" --report "$PWD/validation_report.json" \
+    --journal "$PWD/download_journal.jsonl" --since "$START_EPISODE"
 
-# Parse the new games
-echo "=== Parsing new games ==="
-python3 "$PWD/parse_and_create_csv.py" "$TEMP_DIR" "$PWD/jarchive_new_temp.csv"
+# Publish the rows this run added or changed for consumers that sync by delta
+echo "=== Publishing delta ==="
+python3 "$PWD/archive_delta.py" --deltas "$PWD/jarchive_deltas" publish "$PWD/jarchive_prev_temp.csv" "$PWD/jarchive.csv"
 
-# Get the count of new clues
-NEW_CLUES=$(tail -n +2 "$PWD/jarchive_new_temp.csv" | wc -l | tr -d ' ')
-echo "Parsed $NEW_CLUES new clues"
+# Refresh the columnar copy read by jeopardy.py when pyarrow is available
+if python3 -c "import pyarrow" 2>/dev/null; then
+    echo "=== Building columnar archive ==="
+    python3 "$PWD/columnar_archive.py" build "$PWD/jarchive.csv" "$PWD/jarchive.parquet"
+fi
 
-if [ "$NEW_CLUES" -eq "0" ]; then
-    echo "No valid clues found in new episodes."
-    rm -rf "$TEMP_DIR" "$PWD/jarchive_new_temp.csv"
-    exit 0
+# Keep an existing search index in step with the archive
+if [ -f "$PWD/jarchive_search.db" ]; then
+    echo "=== Updating search index ==="
+    python3 "$PWD/search_index.py" --index "$PWD/jarchive_search.db" update "$PWD/jarchive_new_temp.csv"
 fi
 
-# Append and sort
-echo "=== Merging and sorting ==="
-python3 << 'PYTHON_SCRIPT'
-import sys
-
-print("Reading existing jarchive.csv...")
-rows = []
-with open('jarchive.csv', 'r', encoding='utf-8') as f:
-    header = f.readline()
-    for line in f:
-        fields = [field.strip() for field in line.strip().split('||')]
-        if len(fields) >= 7:
-            rows.append(fields)
-
-existing_count = len(rows)
-print(f"Existing clues: {existing_count}")
-
-# Read new clues
-print("Reading new clues...")
-with open('jarchive_new_temp.csv', 'r', encoding='utf-8') as f:
-    header = f.readline()
-    for line in f:
-        fields = [field.strip() for field in line.strip().split('||')]
-        if len(fields) >= 7:
-            rows.append(fields)
-
-new_count = len(rows) - existing_count
-print(f"Added {new_count} new clues")
-
-# Sort by gid
-print("Sorting by game ID...")
-rows.sort(key=lambda x: int(x[0]) if x[0].isdigit() else 0)
-
-# Write sorted file
-print("Writing sorted jarchive.csv...")
-with open('jarchive.csv', 'w', encoding='utf-8') as f:
-    f.write("gid || airdate || rnd || category || value || text || answer\n")
-    for row in rows:
-        f.write(" || ".join(row) + "\n")
-
-# Get stats
-unique_gids = len(set(int(row[0]) for row in rows if row[0].isdigit()))
-max_gid = max(int(row[0]) for row in rows if row[0].isdigit())
-print(f"Total clues: {len(rows):,}")
-print(f"Unique games: {unique_gids}")
-print(f"Max game ID: {max_gid}")
-
-# Update last_episode.txt
-with open('last_episode.txt', 'w') as f:
-    f.write(str(max_gid))
-print(f"Updated last_episode.txt to {max_gid}")
-PYTHON_SCRIPT
+# Keep the year shards in step; only the shards of the new games' air years change
+echo "=== Updating year shards ==="
+python3 "$PWD/sharded_archive.py" --shard-dir "$PWD/jarchive_shards" update "$PWD/jarchive_new_temp.csv"
+
+# Re-index row offsets for the quiz's clue sampler when it is in use
+if [ -f "$PWD/jarchive_offsets.npy" ]; then
+    echo "=== Rebuilding clue offset index ==="
+    python3 "$PWD/clue_sampler.py" build "$PWD/jarchive.csv" --index "$PWD/jarchive_offsets.npy"
+fi
+
+# Add the new games to the aggregate statistics when they are kept
+if [ -f "$PWD/jarchive_stats.db" ]; then
+    echo "=== Updating statistics ==="
+    python3 "$PWD/stats_cube.py" --db "$PWD/jarchive_stats.db" update "$PWD/jarchive_new_temp.csv"
+fi
+
+# Extend the game index used by `jeopardy.py --game` with the appended games
+if [ -f "$PWD/jarchive_games.npz" ]; then
+    echo "=== Updating game index ==="
+    python3 "$PWD/game_index.py" update "$PWD/jarchive.csv" --index "$PWD/jarchive_games.npz"
+fi
+
+# Sign the new games' clues for near-duplicate detection when it is in use
+if [ -f "$PWD/jarchive_minhash.npz" ]; then
+    echo "=== Updating clue signatures ==="
+    python3 "$PWD/clue_dedup.py" --signatures "$PWD/jarchive_minhash.npz" update "$PWD/jarchive_new_temp.csv"
+fi
 
 # Clean up
 echo "=== Cleaning up ==="
-rm -rf "$TEMP_DIR" "$PWD/jarchive_new_temp.csv"
+rm -f "$PWD/jarchive_new_temp.csv" "$PWD/jarchive_prev_temp.csv"
 
 echo "=== Update complete! ==="
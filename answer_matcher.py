@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Precomputed bigram profiles for fast fuzzy answer matching
+
+`AnswerMatcher` sanitizes every distinct answer once and stores its adjacent
+character pair counts in CSR arrays (one row per answer, one column per
+distinct pair), plus the transposed posting lists. Scores are the same
+Dice coefficient as `jeopardy.compare_strings`, computed with NumPy:
+
+* `score(response, i)` against one answer,
+* `top_k(response)` against every answer in the corpus ("did you mean"),
+* `score_pairs(responses, answer_ids)` for bulk grading.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from jeopardy import sanitize
+
+def character_pairs(text):
+    """Return {pair: count} of adjacent upper-cased characters within each word."""
+    results = {}
+    for word in text.upper().split():
+        for i in range(len(word) - 1):
+            pair = word[i:i + 2]
+            results[pair] = results.get(pair, 0) + 1
+    return results
+
+def _dice(intersection, size1, size2):
+    total = size1 + size2
+    return np.divide(2.0 * intersection, total, out=np.zeros(np.shape(total)), where=total > 0)
+
+class AnswerMatcher:
+    """Bigram profiles of a fixed set of answers."""
+
+    def __init__(self, answers):
+        # Distinct answers only; repeats share one profile
+        self.answers = list(dict.fromkeys(answers))
+        self.ids = {answer: i for i, answer in enumerate(self.answers)}
+        self.vocab = {}
+
+        indptr = [0]
+        indices = []
+        counts = []
+        for answer in self.answers:
+            for pair, count in character_pairs(sanitize(answer)).items():
+                indices.append(self.vocab.setdefault(pair, len(self.vocab)))
+                counts.append(count)
+            indptr.append(len(indices))
+
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int32)
+        self.counts = np.array(counts, dtype=np.int32)
+        self._index()
+
+    def _index(self):
+        """Derive profile sizes and posting lists from the CSR arrays."""
+        rows = np.repeat(np.arange(len(self.answers), dtype=np.int32), np.diff(self.indptr))
+        self.sizes = np.bincount(rows, weights=self.counts, minlength=len(self.answers))
+
+        # Posting lists: for each pair, the answers containing it and how often
+        order = np.argsort(self.indices, kind='stable')
+        self.post_answers = rows[order]
+        self.post_counts = self.counts[order]
+        self.post_ptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=len(self.vocab)), out=self.post_ptr[1:])
+
+    def __len__(self):
+        return len(self.answers)
+
+    def profile(self, text):
+        """Return (pair ids, counts, size) of a sanitized string.
+
+        Pairs that no answer contains still count towards the size.
+        """
+        pairs = character_pairs(sanitize(text))
+        known = [(self.vocab[p], c) for p, c in pairs.items() if p in self.vocab]
+        ids = np.array([i for i, _ in known], dtype=np.int32)
+        counts = np.array([c for _, c in known], dtype=np.int32)
+        return ids, counts, sum(pairs.values())
+
+    def score(self, response, answer_id):
+        """Return the similarity of a response to one answer, 0.0 to 1.0."""
+        ids, counts, size = self.profile(response)
+        start, end = self.indptr[answer_id], self.indptr[answer_id + 1]
+        common, r_idx, a_idx = np.intersect1d(ids, self.indices[start:end],
+                                              assume_unique=True, return_indices=True)
+        intersection = np.minimum(counts[r_idx], self.counts[start:end][a_idx]).sum()
+        return float(_dice(intersection, size, self.sizes[answer_id]))
+
+    def scores(self, response):
+        """Return the similarity of a response to every answer, as an array."""
+        ids, counts, size = self.profile(response)
+        intersection = np.zeros(len(self.answers), dtype=np.int64)
+        for pair, count in zip(ids, counts):
+            start, end = self.post_ptr[pair], self.post_ptr[pair + 1]
+            # Each answer appears at most once per posting list
+            intersection[self.post_answers[start:end]] += np.minimum(self.post_counts[start:end], count)
+        return _dice(intersection, size, self.sizes)
+
+    def top_k(self, response, k=5):
+        """Return the k most similar answers as [(answer, score)], best first."""
+        scores = self.scores(response)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(self.answers[i], float(scores[i])) for i in best]
+
+    def score_pairs(self, responses, answer_ids):
+        """Score each response against its own answer; return an array of scores.
+
+        `answer_ids` are indices into `answers` (see `ids`), one per response.
+        """
+        answer_ids = np.asarray(answer_ids, dtype=np.int64)
+        n = len(responses)
+        vocab_size = len(self.vocab)
+
+        # Response side: (pair index * vocab size + pair id) keys and counts
+        r_keys, r_counts = [], []
+        r_sizes = np.zeros(n)
+        for i, response in enumerate(responses):
+            ids, counts, size = self.profile(response)
+            r_keys.append(i * vocab_size + ids.astype(np.int64))
+            r_counts.append(counts)
+            r_sizes[i] = size
+        r_keys = np.concatenate(r_keys) if n else np.zeros(0, dtype=np.int64)
+        r_counts = np.concatenate(r_counts) if n else np.zeros(0, dtype=np.int32)
+
+        # Answer side: gather each answer's CSR row without a Python loop
+        starts = self.indptr[answer_ids]
+        lengths = self.indptr[answer_ids + 1] - starts
+        owner = np.repeat(np.arange(n, dtype=np.int64), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + offsets
+        a_keys = owner * vocab_size + self.indices[positions]
+        a_counts = self.counts[positions]
+
+        common, r_idx, a_idx = np.intersect1d(r_keys, a_keys, assume_unique=True, return_indices=True)
+        intersection = np.bincount(common // max(vocab_size, 1),
+                                   weights=np.minimum(r_counts[r_idx], a_counts[a_idx]), minlength=n)
+        return _dice(intersection, r_sizes, self.sizes[answer_ids])
+
+    def save(self, path):
+        """Write the profiles to a .npz file."""
+        encoded = [answer.encode('utf-8') for answer in self.answers]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        vocab = np.array(sorted(self.vocab, key=self.vocab.get), dtype='<U2')
+        np.savez(path, answers=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+                 answer_offsets=offsets, vocab=vocab, indptr=self.indptr,
+                 indices=self.indices, counts=self.counts)
+
+    @classmethod
+    def load(cls, path):
+        """Read profiles written by `save` without re-sanitizing any answer."""
+        data = np.load(path)
+        blob = data['answers'].tobytes()
+        offsets = data['answer_offsets']
+        matcher = cls.__new__(cls)
+        matcher.answers = [blob[offsets[i]:offsets[i + 1]].decode('utf-8')
+                           for i in range(len(offsets) - 1)]
+        matcher.ids = {answer: i for i, answer in enumerate(matcher.answers)}
+        matcher.vocab = {pair: i for i, pair in enumerate(data['vocab'].tolist())}
+        matcher.indptr = data['indptr']
+        matcher.indices = data['indices']
+        matcher.counts = data['counts']
+        matcher._index()
+        return matcher
+
+if __name__ == "__main__":
+    from jeopardy import read_jarchive
+
+    parser = argparse.ArgumentParser(description="Build answer profiles or look up similar answers.")
+    parser.add_argument("command", choices=("build", "match"))
+    parser.add_argument("response", nargs="?", help="response to match (for 'match')")
+    parser.add_argument("-p", "--profiles", default="jarchive_answers.npz", help="the profile file")
+    parser.add_argument("-k", type=int, default=5, help="number of matches to show")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "build":
+        df = read_jarchive()
+        matcher = AnswerMatcher(df.answer.astype(str).str.strip())
+        matcher.save(args.profiles)
+        print(f"Profiled {len(matcher):,} distinct answers in {time.perf_counter() - start:.1f}s",
+              file=sys.stderr)
+    else:
+        if not args.response:
+            parser.error("a response is required")
+        matcher = AnswerMatcher.load(args.profiles)
+        loaded = time.perf_counter()
+        for answer, score in matcher.top_k(args.response, args.k):
+            print(f"{score:.3f}  {answer}")
+        print(f"Loaded in {loaded - start:.2f}s, matched in {(time.perf_counter() - loaded) * 1000:.1f} ms",
+              file=sys.stderr)
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Delta files of jarchive.csv: publish what each update changed, apply it elsewhere
+
+Each weekly update publishes one delta to jarchive_deltas/: a gzipped JSON
+file with the rows the update added, changed or removed, game by game, and
+an entry in manifest.json with its sequence number, game ID range, row
+counts and the sha256 of the archive before and after it and of the delta
+file itself. A consumer brings its copy of the archive up to date by
+applying only the deltas published since it last synced, instead of
+downloading the whole archive again.
+
+A game in a delta either lists its row changes, with clues keyed by (round,
+category, position) as in `merge_archive.merge_game`:
+
+    {"gid": 9001, "removed": [[rnd, category, position], ...],
+     "changed": [[position, fields], ...], "added": [fields, ...]}
+
+which are applied to the game's rows in place, changed clues keeping their
+place, added ones going last; or, when that would not give the new rows in
+their order (and for added or removed games), holds all of them:
+
+    {"gid": 9002, "rows": [fields, ...]}
+
+with an empty list for a game that was removed.
+
+Applying a delta checks that the copy matches the archive it was made from
+and, once applied, the archive it led to, so a copy that is ahead, behind or
+edited locally is never silently mixed with a delta. The sync state (last
+delta applied and the archive's sha256) is kept next to the copy in
+`<archive>.sync.json`; a copy without one is placed by its sha256.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+
+from archive_format import parse_line
+from merge_archive import HEADER, clue_key, format_row, iter_games, open_for_append, read_rows, row_gid
+
+DEFAULT_DELTA_DIR = "jarchive_deltas"
+MANIFEST = "manifest.json"
+
+def delta_file(seq):
+    return f"delta_{seq:06}.json.gz"
+
+def file_sha256(path, prefix=None):
+    """Return the sha256 of a file, and of its first `prefix` bytes if given."""
+    digest = hashlib.sha256()
+    prefix_digest = None
+    with open(path, 'rb') as f:
+        if prefix is not None:
+            remaining = prefix
+            while remaining > 0:
+                block = f.read(min(1 << 20, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                remaining -= len(block)
+            prefix_digest = digest.hexdigest()
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest(), prefix_digest
+
+def read_manifest(delta_dir):
+    """Return the manifest entries of a delta directory, oldest first."""
+    try:
+        with open(os.path.join(delta_dir, MANIFEST), 'r', encoding='utf-8') as f:
+            return json.load(f)["deltas"]
+    except FileNotFoundError:
+        return []
+
+def write_manifest(delta_dir, deltas):
+    path = os.path.join(delta_dir, MANIFEST)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"format": 1, "deltas": deltas}, f, indent=1)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+def _keyed(rows):
+    """Return the rows of a game as {(rnd, category, position): fields}, in order."""
+    counts = {}
+    return {clue_key(fields, counts)[1:]: fields for fields in rows}
+
+def apply_game(old_rows, change):
+    """Return the rows of a game after applying its change from a delta."""
+    if "rows" in change:
+        return change["rows"]
+    rows = _keyed(old_rows)
+    for key in change.get("removed", ()):
+        del rows[tuple(key)]
+    for position, fields in change.get("changed", ()):
+        rows[(fields[2], fields[3], position)] = fields
+    return list(rows.values()) + change.get("added", [])
+
+def diff_game(gid, old_rows, new_rows):
+    """Return the change that turns the old rows of a game into the new ones."""
+    if not old_rows or not new_rows:
+        return {"gid": gid, "rows": new_rows}
+    old, new = _keyed(old_rows), _keyed(new_rows)
+    change = {"gid": gid,
+              "removed": [list(key) for key in old if key not in new],
+              "changed": [[key[2], fields] for key, fields in new.items() if key in old and old[key] != fields],
+              "added": [fields for key, fields in new.items() if key not in old]}
+    if apply_game(old_rows, change) != new_rows:
+        return {"gid": gid, "rows": new_rows}
+    return {name: value for name, value in change.items() if value != []}
+
+def _games_from(path, offset):
+    """Return (gid, rows) for the games of an archive file from byte `offset` on."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        lines = f.read().decode('utf-8').split("\n")
+    return list(iter_games(fields for fields in map(parse_line, lines) if fields is not None))
+
+def _last_gid(path):
+    """Return the game ID of the last row of an archive file, None if it has none."""
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(size - (1 << 16), 0))
+        lines = f.read().decode('utf-8', errors='replace').split("\n")
+    for line in reversed(lines):
+        fields = parse_line(line)
+        if fields is not None:
+            return row_gid(fields)
+    return None
+
+def diff_archives(old_path, new_path):
+    """Return the game changes between two archives, both in game ID order.
+
+    When the new archive is the old one with games appended, which is what a
+    weekly update normally does, only the appended bytes are read. Returns
+    the sha256 of both archives, the changes and {gid: number of old rows}
+    of the games changed or removed.
+    """
+    old_size = os.path.getsize(old_path)
+    old_sha256, _ = file_sha256(old_path)
+    new_sha256, prefix_sha256 = file_sha256(new_path, old_size)
+    old_last = _last_gid(old_path)
+    if prefix_sha256 == old_sha256:
+        games = _games_from(new_path, old_size)
+        if not games or old_last is None or games[0][0] > old_last:
+            return old_sha256, new_sha256, [{"gid": gid, "rows": rows} for gid, rows in games], {}
+
+    changes = []
+    old_counts = {}
+    old_games = iter_games(read_rows(old_path))
+    old_gid, old_rows = next(old_games, (None, None))
+    for gid, rows in iter_games(read_rows(new_path)):
+        while old_gid is not None and old_gid < gid:
+            changes.append({"gid": old_gid, "rows": []})
+            old_counts[old_gid] = len(old_rows)
+            old_gid, old_rows = next(old_games, (None, None))
+        if old_gid == gid:
+            if old_rows != rows:
+                changes.append(diff_game(gid, old_rows, rows))
+                old_counts[gid] = len(old_rows)
+            old_gid, old_rows = next(old_games, (None, None))
+        else:
+            changes.append({"gid": gid, "rows": rows})
+    while old_gid is not None:
+        changes.append({"gid": old_gid, "rows": []})
+        old_counts[old_gid] = len(old_rows)
+        old_gid, old_rows = next(old_games, (None, None))
+    return old_sha256, new_sha256, changes, old_counts
+
+def summarize(changes, old_counts):
+    """Return the game and row counts of a list of game changes."""
+    counts = dict.fromkeys(("games_added", "games_changed", "games_removed",
+                            "rows_added", "rows_changed", "rows_removed"), 0)
+    for change in changes:
+        if "rows" not in change:
+            counts["games_changed"] += 1
+            counts["rows_added"] += len(change.get("added", ()))
+            counts["rows_changed"] += len(change.get("changed", ()))
+            counts["rows_removed"] += len(change.get("removed", ()))
+        elif change["rows"]:
+            # A whole game, new or rewritten; the rows of a rewritten one all count as replaced
+            counts["games_changed" if change["gid"] in old_counts else "games_added"] += 1
+            counts["rows_added"] += len(change["rows"])
+            counts["rows_removed"] += old_counts.get(change["gid"], 0)
+        else:
+            counts["games_removed"] += 1
+            counts["rows_removed"] += old_counts[change["gid"]]
+    return counts
+
+def publish(old_path, new_path, delta_dir=DEFAULT_DELTA_DIR):
+    """Write the delta from one archive to the next; return its manifest entry, None if they match."""
+    old_sha256, new_sha256, changes, old_counts = diff_archives(old_path, new_path)
+    if not changes:
+        return None
+    deltas = read_manifest(delta_dir)
+    if deltas and deltas[-1]["sha256"] != old_sha256:
+        print(f"{old_path} is not the archive the last delta led to; the deltas start again from it",
+              file=sys.stderr)
+    seq = deltas[-1]["seq"] + 1 if deltas else 1
+
+    os.makedirs(delta_dir, exist_ok=True)
+    path = os.path.join(delta_dir, delta_file(seq))
+    with gzip.open(path + ".tmp", 'wt', encoding='utf-8') as f:
+        json.dump({"format": 1, "seq": seq, "base_sha256": old_sha256, "sha256": new_sha256,
+                   "games": changes}, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+    entry = {"seq": seq, "file": delta_file(seq), "created": round(time.time()),
+             "min_gid": min(change["gid"] for change in changes),
+             "max_gid": max(change["gid"] for change in changes),
+             **summarize(changes, old_counts), "base_sha256": old_sha256, "sha256": new_sha256,
+             "file_sha256": file_sha256(path)[0], "bytes": os.path.getsize(path)}
+    write_manifest(delta_dir, deltas + [entry])
+    return entry
+
+def load_delta(delta_dir, entry):
+    """Return the game changes of a delta, checking the file against its manifest entry."""
+    path = os.path.join(delta_dir, entry["file"])
+    if file_sha256(path)[0] != entry["file_sha256"]:
+        raise ValueError(f"{path} does not match its sha256 in the manifest")
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        delta = json.load(f)
+    return {change["gid"]: change for change in delta["games"]}
+
+def _state_path(archive_path):
+    return archive_path + ".sync.json"
+
+def sync_position(archive_path, deltas, state_path=None):
+    """Return the sequence number of the last delta applied to an archive copy.
+
+    0 means the copy is the archive the first delta was made from. Raises
+    ValueError if the copy is not an archive any delta starts from or led to.
+    """
+    sha256, _ = file_sha256(archive_path)
+    try:
+        with open(state_path or _state_path(archive_path), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state["sha256"] == sha256:
+            return state["seq"]
+    except (IOError, ValueError, KeyError):
+        pass
+    for entry in reversed(deltas):
+        if entry["sha256"] == sha256:
+            return entry["seq"]
+        if entry["base_sha256"] == sha256:
+            return entry["seq"] - 1
+    raise ValueError(f"{archive_path} is not an archive the deltas start from or lead to; "
+                     "download the full archive again")
+
+def _rewrite(archive_path, changes):
+    """Stream the archive into a temporary file with the game changes applied; return its path."""
+    tmp_path = archive_path + ".tmp"
+    pending = sorted(changes)
+    next_change = 0
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        out.write(HEADER)
+        for gid, rows in iter_games(read_rows(archive_path)):
+            while next_change < len(pending) and pending[next_change] < gid:
+                out.writelines(map(format_row, apply_game([], changes[pending[next_change]])))
+                next_change += 1
+            if next_change < len(pending) and pending[next_change] == gid:
+                rows = apply_game(rows, changes[gid])
+                next_change += 1
+            out.writelines(map(format_row, rows))
+        for gid in pending[next_change:]:
+            out.writelines(map(format_row, apply_game([], changes[gid])))
+    return tmp_path
+
+def apply_delta(archive_path, changes, sha256):
+    """Apply the game changes of one delta to an archive copy.
+
+    New games past the end of the copy are appended; anything else streams
+    the copy into a new file. The result must have the sha256 the delta led
+    to, otherwise the copy is left as it was and ValueError is raised.
+    """
+    last_gid = _last_gid(archive_path)
+    if all("rows" in change for change in changes.values()) and \
+            (last_gid is None or min(changes) > last_gid):
+        size = os.path.getsize(archive_path)
+        with open_for_append(archive_path) as out:
+            for gid in sorted(changes):
+                out.writelines(map(format_row, changes[gid]["rows"]))
+        if file_sha256(archive_path)[0] != sha256:
+            with open(archive_path, 'r+b') as f:
+                f.truncate(size)
+            raise ValueError(f"{archive_path} does not match the delta's archive once applied")
+        return
+    tmp_path = _rewrite(archive_path, changes)
+    if file_sha256(tmp_path)[0] != sha256:
+        os.remove(tmp_path)
+        raise ValueError(f"{archive_path} does not match the delta's archive once applied")
+    os.replace(tmp_path, archive_path)
+
+def apply(archive_path, delta_dir=DEFAULT_DELTA_DIR, new_csv_path=None, state_path=None):
+    """Apply the deltas published since an archive copy last synced.
+
+    With `new_csv_path`, the new rows of every game added or changed are
+    also written there, in the form the `update` commands of the derived
+    indexes read. Returns the manifest entries applied.
+    """
+    deltas = read_manifest(delta_dir)
+    position = sync_position(archive_path, deltas, state_path)
+    pending = [entry for entry in deltas if entry["seq"] > position]
+    touched = {}
+    for entry in pending:
+        changes = load_delta(delta_dir, entry)
+        apply_delta(archive_path, changes, entry["sha256"])
+        for gid, change in changes.items():
+            touched[gid] = change
+        with open(state_path or _state_path(archive_path), 'w', encoding='utf-8') as f:
+            json.dump({"seq": entry["seq"], "sha256": entry["sha256"], "synced": round(time.time())}, f)
+        print(f"Applied delta {entry['seq']}: games {entry['min_gid']}-{entry['max_gid']}, "
+              f"{entry['rows_added']:,} rows added, {entry['rows_changed']:,} changed, "
+              f"{entry['rows_removed']:,} removed", file=sys.stderr)
+
+    if new_csv_path is not None:
+        # Whole games are taken from the deltas; games with row changes are read back from the archive
+        games = {gid: change.get("rows") for gid, change in touched.items() if change.get("rows") != []}
+        read_back = {gid for gid, rows in games.items() if rows is None}
+        if read_back:
+            for gid, rows in iter_games(read_rows(archive_path)):
+                if gid > max(read_back):
+                    break
+                if gid in read_back:
+                    games[gid] = rows
+        with open(new_csv_path, 'w', encoding='utf-8') as out:
+            out.write(HEADER)
+            for gid in sorted(games):
+                out.writelines(map(format_row, games[gid]))
+    return pending
+
+def print_manifest(deltas):
+    print(f"{'seq':>5} {'games':>11} {'+rows':>7} {'~rows':>6} {'-rows':>6} {'bytes':>9}  created")
+    for entry in deltas:
+        print(f"{entry['seq']:>5} {entry['min_gid']:>5}-{entry['max_gid']:<5} {entry['rows_added']:>7,} "
+              f"{entry['rows_changed']:>6,} {entry['rows_removed']:>6,} {entry['bytes']:>9,}  "
+              f"{time.strftime('%Y-%m-%d', time.gmtime(entry['created']))}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish or apply delta files of the archive.")
+    parser.add_argument("-d", "--deltas", default=DEFAULT_DELTA_DIR, help="delta directory (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish_cmd = commands.add_parser("publish", help="write the delta between the archive before and after an update")
+    publish_cmd.add_argument("old", help="the archive before the update")
+    publish_cmd.add_argument("new", nargs="?", default="jarchive.csv", help="the archive after it")
+    apply_cmd = commands.add_parser("apply", help="bring an archive copy up to date")
+    apply_cmd.add_argument("archive", nargs="?", default="jarchive.csv")
+    apply_cmd.add_argument("--new-csv", help="also write the rows of the games added or changed to this file")
+    apply_cmd.add_argument("--state", help="sync state file (default: <archive>.sync.json)")
+    commands.add_parser("list", help="list the published deltas")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "publish":
+        entry = publish(args.old, args.new, args.deltas)
+        if entry is None:
+            print(f"{args.new} is unchanged; no delta written", file=sys.stderr)
+        else:
+            print(f"Wrote {entry['file']}: games {entry['min_gid']}-{entry['max_gid']}, "
+                  f"{entry['rows_added']:,} rows added, {entry['rows_changed']:,} changed, "
+                  f"{entry['rows_removed']:,} removed, {entry['bytes']:,} bytes in "
+                  f"{time.perf_counter() - start:.1f}s", file=sys.stderr)
+    elif args.command == "apply":
+        try:
+            applied = apply(args.archive, args.deltas, args.new_csv, args.state)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        if not applied:
+            print(f"{args.archive} is up to date", file=sys.stderr)
+        elif any(entry["rows_changed"] or entry["rows_removed"] for entry in applied):
+            print("Rows were changed or removed: rebuild derived indexes that only add games "
+                  "(statistics, clue signatures)", file=sys.stderr)
+        print(f"Applied {len(applied)} deltas in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    else:
+        print_manifest(read_manifest(args.deltas))
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reader and writer for the || separated archive format of jarchive.csv
+
+A row is seven fields joined by " || " on one line, after a header line:
+
+    gid || airdate || rnd || category || value || text || answer
+
+Fields are written stripped, with line breaks turned into spaces, and every
+"|" inside a field written as "\\|" (a backslash that would otherwise be
+read as part of an escape is doubled), so a bare "||" only ever separates
+fields. Reading reverses that; any other backslash is kept as it is, so
+files written before escaping existed read back unchanged.
+
+The reader maps the file and hands out rows in batches: each batch is
+decoded in one call and split on newlines and separators by str.split,
+rather than line by line through a regex. Rows without exactly seven fields
+or with a non-numeric game ID are skipped and counted (or raise
+`ArchiveFormatError` with `strict`, or are passed on as `MalformedRow` lines
+with `keep_malformed`, for rewrites that must not lose them).
+"""
+
+import argparse
+import mmap
+import re
+import sys
+import time
+from itertools import repeat
+
+COLUMNS = ("gid", "airdate", "rnd", "category", "value", "text", "answer")
+SEPARATOR = " || "
+HEADER = SEPARATOR.join(COLUMNS) + "\n"
+# Clues whose text or answer is one of these were not shown on air
+UNPLAYABLE_TEXT = ('=', '?')
+UNPLAYABLE_ANSWER = ('=',)
+# Bytes of the file decoded per batch
+BATCH_BYTES = 1 << 22
+
+# A backslash followed by a backslash, a pipe or the end of the field
+ESCAPED_BACKSLASH_RE = re.compile(r"\\(?=[\\|]|$)")
+UNESCAPE_RE = re.compile(r"\\([\\|])")
+
+class ArchiveFormatError(ValueError):
+    """A row of an archive file that does not have the expected fields."""
+
+    def __init__(self, path, line_number, line):
+        super().__init__(f"{path}:{line_number}: expected {len(COLUMNS)} fields and a numeric game ID: "
+                         f"{line[:80]!r}")
+        self.path = path
+        self.line_number = line_number
+
+def escape(value):
+    """Return a value as an archive field."""
+    field = str(value).replace("\r", " ").replace("\n", " ").strip()
+    if "\\" in field:
+        field = ESCAPED_BACKSLASH_RE.sub(r"\\\\", field)
+    if "|" in field:
+        field = field.replace("|", "\\|")
+    return field
+
+def has_escapes(text):
+    return "\\\\" in text or "\\|" in text
+
+def unescape(field):
+    return UNESCAPE_RE.sub(r"\1", field) if has_escapes(field) else field
+
+def normalize(values):
+    """Return values as the fields reading their written row gives back."""
+    return [str(value).replace("\r", " ").replace("\n", " ").strip() for value in values]
+
+def parse_line(line):
+    """Return the seven fields of one row, or None if it is not a valid row."""
+    fields = line.split("||")
+    if len(fields) != 7:
+        return None
+    fields = [field.strip() for field in fields]
+    if has_escapes(line):
+        fields = [unescape(field) for field in fields]
+    return fields if fields[0].isdigit() else None
+
+def parse_value(value):
+    """Return a clue value as an int, 0 if it has no preset value."""
+    value = value.replace(',', '').replace('$', '')
+    return int(value) if value.isdigit() else 0
+
+def join_fields(values):
+    """Return the row of an archive file holding `values`, without the line break."""
+    return SEPARATOR.join(escape(value) for value in values)
+
+def format_row(values):
+    return join_fields(values) + "\n"
+
+class MalformedRow(str):
+    """A line of an archive file that is not a valid row, kept as it was read."""
+
+class Reader:
+    """Batches of rows of an archive file, read through a memory map.
+
+    `skipped` counts the malformed rows passed over (or, with
+    `keep_malformed`, passed on as `MalformedRow`) so far (the header line
+    is not counted) and `bad_lines` holds the first line numbers of them.
+    """
+
+    def __init__(self, path, strict=False, batch_bytes=BATCH_BYTES, keep_malformed=False):
+        self.path = path
+        self.strict = strict
+        self.keep_malformed = keep_malformed
+        self.batch_bytes = batch_bytes
+        self.skipped = 0
+        self.bad_lines = []
+
+    def _texts(self):
+        """Yield the text of the file in pieces that end on a line break."""
+        with open(self.path, 'rb') as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                return
+            with mm:
+                start, size = 0, len(mm)
+                while start < size:
+                    end = mm.find(b"\n", min(start + self.batch_bytes, size - 1))
+                    end = size if end < 0 else end + 1
+                    yield mm[start:end].decode('utf-8')
+                    start = end
+
+    def _parse_lines(self, lines, first_line):
+        """Yield the valid rows of `lines`, the first being line `first_line` of the file."""
+        for line_number, line in enumerate(lines, first_line):
+            fields = parse_line(line)
+            if fields is not None:
+                yield fields
+                continue
+            if line_number == 1 and line.replace(" ", "") == HEADER.replace(" ", "").strip():
+                continue
+            if not line.strip():
+                continue
+            if self.strict:
+                raise ArchiveFormatError(self.path, line_number, line)
+            self.skipped += 1
+            if len(self.bad_lines) < 100:
+                self.bad_lines.append(line_number)
+            if self.keep_malformed:
+                yield MalformedRow(line)
+
+    def _lines(self):
+        """Yield (lines, number of the first line) for each piece of the file."""
+        line_number = 1
+        for text in self._texts():
+            lines = text.split("\n")
+            if lines[-1] == "":
+                lines.pop()
+            yield lines, line_number
+            line_number += len(lines)
+
+    def batches(self):
+        """Yield lists of rows, each row a list of seven string fields."""
+        for lines, first_line in self._lines():
+            rows = list(self._parse_lines(lines, first_line))
+            if rows:
+                yield rows
+
+    def column_batches(self):
+        """Yield each batch as a tuple of seven column lists.
+
+        When every line of a batch has exactly six " || " separators and no
+        stray whitespace, the whole batch is split at once and sliced into
+        columns; otherwise its lines are parsed one by one.
+        """
+        for lines, first_line in self._lines():
+            if first_line == 1 and lines and not lines[0][:1].isdigit():
+                if lines[0].replace(" ", "") == HEADER.replace(" ", "").strip():
+                    lines, first_line = lines[1:], 2
+            text = "\n".join(lines)
+            count = len(lines)
+            if (count and text.count(SEPARATOR) == 6 * count
+                    and list(map(str.count, lines, repeat("||"))).count(6) == count
+                    and "\r" not in text and "\t" not in text):
+                # One field per line; a space next to a line break is a field to strip
+                text = text.replace(SEPARATOR, "\n")
+                if " \n" not in text and "\n " not in text and text[0] != " " and text[-1] != " ":
+                    fields = text.split("\n")
+                    columns = tuple(fields[i::7] for i in range(7))
+                    if all(map(str.isdigit, columns[0])):
+                        if "\\" in text and has_escapes(text):
+                            columns = tuple(list(map(unescape, column)) for column in columns)
+                        yield columns
+                        continue
+            rows = list(self._parse_lines(lines, first_line))
+            if rows:
+                yield tuple(map(list, zip(*rows)))
+
+    def __iter__(self):
+        """Yield the rows one at a time, without holding a batch of them."""
+        for lines, first_line in self._lines():
+            yield from self._parse_lines(lines, first_line)
+
+def read_rows(path, strict=False, keep_malformed=False):
+    """Yield the fields of each valid row of an archive file.
+
+    Malformed rows are skipped, or with `keep_malformed` yielded as
+    `MalformedRow` lines, and reported on stderr once the file is read.
+    """
+    reader = Reader(path, strict, keep_malformed=keep_malformed)
+    yield from reader
+    if reader.skipped:
+        action = "Kept" if keep_malformed else "Skipped"
+        print(f"{action} {reader.skipped:,} malformed rows in {path}", file=sys.stderr)
+
+def read_columns(path, strict=False):
+    """Return the seven columns of an archive file as lists of strings."""
+    columns = tuple([] for _ in COLUMNS)
+    for batch in Reader(path, strict).column_batches():
+        for column, values in zip(columns, batch):
+            column.extend(values)
+    return dict(zip(COLUMNS, columns))
+
+def _pandas_rows(path):
+    import pandas as pd
+    return len(pd.read_csv(path, sep=r'\|\|', engine='python'))
+
+def benchmark(path, repeat=3):
+    """Compare the reader with pandas' Python-engine parse of the same file."""
+    cases = (("archive_format.Reader", lambda: sum(len(rows) for rows in Reader(path).batches())),
+             ("archive_format.read_columns", lambda: len(read_columns(path)["gid"])),
+             ("pandas sep='\\|\\|' python engine", lambda: _pandas_rows(path)))
+    for label, run in cases:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = run()
+            timings.append(time.perf_counter() - start)
+        print(f"{label:34} best of {repeat}: {min(timings):.2f}s, {rows:,} rows, "
+              f"{rows / min(timings):,.0f} rows/sec")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check or benchmark reading a || separated archive file.")
+    parser.add_argument("command", choices=("check", "bench"))
+    parser.add_argument("archive", nargs="?", default="jarchive.csv")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="benchmark repetitions")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        reader = Reader(args.archive)
+        rows = sum(len(batch) for batch in reader.batches())
+        print(f"{args.archive}: {rows:,} valid rows, {reader.skipped:,} malformed")
+        if reader.bad_lines:
+            print(f"Malformed lines: {reader.bad_lines[:20]}{'...' if reader.skipped > 20 else ''}")
+        sys.exit(1 if reader.skipped else 0)
+    benchmark(args.archive, args.repeat)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Asyncio download engine for J! Archive game pages
+
+Requests go through a small HTTP/1.1 client that keeps connections alive and
+reuses them across games, a single token-bucket rate limiter shared by every
+request, and a fixed number of concurrent workers. Server errors (5xx),
+timeouts and dropped connections are retried with exponential backoff.
+"""
+
+import asyncio
+import os
+import ssl
+import time
+from urllib.parse import urljoin, urlsplit
+
+import metrics
+
+USER_AGENT = "jarchive-downloader"
+MAX_REDIRECTS = 5
+
+class HTTPResponse:
+    """Status, lower-cased headers and body of a completed request."""
+
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second with bursts up to `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in FIFO order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ConnectionPool:
+    """Minimal HTTP/1.1 client that keeps idle connections open for reuse."""
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.idle = {}
+        self.connections_opened = 0
+        self.requests_sent = 0
+
+    async def request(self, url, headers=None, method="GET"):
+        """Send a request, following redirects, and return an HTTPResponse."""
+        for _ in range(MAX_REDIRECTS + 1):
+            response = await asyncio.wait_for(
+                self._request_once(url, headers or {}, method), self.timeout)
+            location = response.headers.get("location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                continue
+            return response
+        raise IOError(f"Too many redirects for {url}")
+
+    async def close(self):
+        for conns in self.idle.values():
+            for _, writer in conns:
+                writer.close()
+        self.idle.clear()
+
+    async def _request_once(self, url, headers, method):
+        parts = urlsplit(url)
+        secure = parts.scheme == "https"
+        port = parts.port or (443 if secure else 80)
+        key = (parts.hostname, port, secure)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {parts.netloc}",
+                 f"User-Agent: {USER_AGENT}", "Connection: keep-alive"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        # An idle connection may have been closed by the server in the
+        # meantime; if a reused one fails, retry once on a fresh connection.
+        for reused in (True, False):
+            conn = self._checkout(key) if reused else None
+            if reused and conn is None:
+                continue
+            if conn is None:
+                conn = await self._connect(parts.hostname, port, secure)
+            reader, writer = conn
+            try:
+                writer.write(request)
+                await writer.drain()
+                self.requests_sent += 1
+                status, resp_headers, keep_alive = await self._read_head(reader)
+                body, delimited = await self._read_body(reader, method, status, resp_headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive and delimited:
+                self.idle.setdefault(key, []).append(conn)
+            else:
+                writer.close()
+            return HTTPResponse(url, status, resp_headers, body)
+
+    def _checkout(self, key):
+        conns = self.idle.get(key)
+        while conns:
+            reader, writer = conns.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    async def _connect(self, host, port, secure):
+        context = ssl.create_default_context() if secure else None
+        conn = await asyncio.open_connection(host, port, ssl=context)
+        self.connections_opened += 1
+        return conn
+
+    async def _read_head(self, reader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        version, status = status_line.split(None, 2)[:2]
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" and (version != "HTTP/1.0" or connection == "keep-alive")
+        return int(status), headers, keep_alive
+
+    async def _read_body(self, reader, method, status, headers):
+        """Return the body and whether its end was delimited by the framing.
+
+        A body that runs until the server closes the connection leaves the
+        connection unusable for another request.
+        """
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            return b"", True
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip(), 16)
+                if size == 0:
+                    # Skip any trailer headers
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks), True
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"])), True
+        return await reader.read(), False
+
+class AsyncDownloader:
+    """Download game pages concurrently under one shared politeness budget."""
+
+    def __init__(self, url_template, rate=1.0, concurrency=4, retries=3,
+                 backoff=2.0, timeout=30, error_msg=b"ERROR: No game", store=None, journal=None):
+        self.url_template = url_template
+        self.rate = rate
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.error_msg = error_msg
+        # Optional GameStore that receives the pages instead of output_dir
+        self.store = store
+        # Optional DownloadJournal that records every attempt
+        self.journal = journal
+
+    async def fetch(self, game_id, headers=None):
+        """Fetch one game page, retrying 5xx responses and network errors.
+
+        Returns the final HTTPResponse (which may still be a 5xx), or None if
+        the last attempt failed without a response.
+        """
+        url = self.url_template.format(game_id=game_id)
+        response = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                metrics.count("download_retries_total")
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            waited = time.perf_counter()
+            await self.limiter.acquire()
+            start = time.perf_counter()
+            metrics.observe("rate_limit_wait_seconds", start - waited)
+            try:
+                response = await self.pool.request(url, headers)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                print(f"Error downloading game {game_id} (attempt {attempt + 1}): {e!r}")
+                metrics.count("download_responses_total", status="error")
+                response = None
+                continue
+            metrics.observe("download_request_seconds", time.perf_counter() - start)
+            metrics.count("download_responses_total", status=response.status)
+            metrics.count("download_bytes_total", len(response.body))
+            if response.status >= 500:
+                print(f"HTTP {response.status} for game {game_id} (attempt {attempt + 1})")
+                continue
+            return response
+        return response
+
+    async def download_and_save(self, game_id, output_dir):
+        """Download and save one game; return "exists", "saved", "missing" or "failed"."""
+        start = time.perf_counter()
+        outcome, response = await self._download_and_save(game_id, output_dir)
+        if self.journal is not None and outcome != "exists":
+            self.journal.record(game_id, outcome, response and response.status,
+                                len(response.body) if response else 0, time.perf_counter() - start)
+        return outcome
+
+    async def _download_and_save(self, game_id, output_dir):
+        if self.store is not None:
+            filepath = None
+            if game_id in self.store:
+                return "exists", None
+        else:
+            filepath = os.path.join(output_dir, f"{game_id}.html")
+            if os.path.exists(filepath):
+                return "exists", None
+
+        response = await self.fetch(game_id)
+        if response is None:
+            return "failed", None
+        if response.status != 200:
+            print(f"Invalid response for game {game_id}: HTTP {response.status}")
+            return "failed", response
+        if self.error_msg in response.body:
+            print(f"Game {game_id} does not exist")
+            return "missing", response
+
+        try:
+            if self.store is not None:
+                # A store may block (a full pipeline queue, disk writes), so
+                # keep it off the event loop and let the other requests run
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.store.put, game_id, response.body)
+            else:
+                with open(filepath, 'wb') as f:
+                    f.write(response.body)
+        except IOError as e:
+            print(f"Error saving game {game_id}: {e}")
+            return "failed", response
+        print(f"Downloaded game {game_id}")
+        return "saved", response
+
+    async def run(self, game_ids, output_dir, on_result=None):
+        """Download `game_ids` into `output_dir`; return {game_id: outcome}."""
+        self.limiter = TokenBucket(self.rate)
+        self.pool = ConnectionPool(self.timeout)
+        results = {}
+        pending = iter(game_ids)
+
+        async def worker():
+            for game_id in pending:
+                try:
+                    outcome = await self.download_and_save(game_id, output_dir)
+                except Exception as e:
+                    print(f"Exception for game {game_id}: {e!r}")
+                    outcome = "failed"
+                results[game_id] = outcome
+                if on_result is not None:
+                    on_result(game_id, outcome)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            await self.pool.close()
+        return results
+
+    def download(self, game_ids, output_dir, on_result=None):
+        """Blocking wrapper around `run`."""
+        return asyncio.run(self.run(game_ids, output_dir, on_result))
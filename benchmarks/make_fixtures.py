@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Write the game page fixtures used by the benchmarks
+
+The pages follow the markup of j-archive.com game pages (round tables,
+clue_value / clue_value_daily_double cells, answers inside the onmouseover
+toggle() snippet) with generated clue text, so the benchmarks run offline
+and the files are free to redistribute. Each fixture covers one shape the
+parsers have to handle:
+
+* 1.html     - 1984 values, one Daily Double per round
+* 173.html   - 1997, unrevealed (missing) clues at the bottom of the board
+* 4680.html  - 2004, Final Jeopardy plus a tiebreaker clue
+* 6100.html  - 2011, no Final Jeopardy round
+* 9302.html  - 2025, doubled values and a missing first clue
+* 5117.html  - 2006, the markup real clues carry: media links, line breaks,
+  underlines, numeric character references, double-escaped entities and
+  nested tags in responses, category comments
+
+With `--record GID ...` the script instead saves those games from
+j-archive.com into fixtures/recorded, so the parsers and the engine
+comparison can also run against recorded pages:
+
+    python benchmarks/make_fixtures.py --record 1 4680 9302
+    python parse_and_create_csv.py --compare-engines benchmarks/fixtures/recorded
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from urllib.error import URLError
+from urllib.request import urlopen
+
+GAME_URL = 'http://j-archive.com/showgame.php?game_id=%s'
+ERROR_MSG = b"ERROR: No game"
+SECONDS_BETWEEN_REQUESTS = 5
+
+ANSWERS = ("Reagan", "&lt;i&gt;Hamlet&lt;/i&gt;", "Men\\'s room", "AT&amp;amp;T", "(Mount) Everest",
+           "the Nile", "Marie Curie", "&lt;i&gt;Moby-Dick&lt;/i&gt;", "photosynthesis", "Ohio")
+FINAL_ANSWER = "Men\\'s Final &amp;amp; more"
+# Clue texts and responses in the shapes found on recorded pages
+MARKUP_TEXTS = (
+    '<a href="http://www.j-archive.com/media/2006-01-02_J_5.jpg" target="_blank">Sarah of the '
+    'Clue Crew</a> reports from the Louvre, where this painting hangs',
+    'In 1859 Darwin wrote, &quot;There is grandeur in this view of life&quot;<br /><br />'
+    '(<i>Fill in the blank</i>)',
+    'This <u>un</u>official anthem begins &#8220;O beautiful for spacious skies&#8221;',
+    'Pok&#233;mon &amp; Beyonc\u00e9: a 2 &lt; 3 &gt; 1 puzzle for the ages&nbsp;&mdash; really',
+    '<a href="http://www.j-archive.com/media/2006-01-02_DJ_7.wmv">(Alex reads from the '
+    '<i>Times</i>.)</a> It\'s the &quot;Gray Lady&quot;',
+)
+MARKUP_ANSWERS = ("&lt;i&gt;The Sun Also Rises&lt;/i&gt;", "Ren&amp;eacute; Descartes",
+                  "(Jean-Jacques) Rousseau", "the &lt;i&gt;Rite&lt;/i&gt; of Spring",
+                  "Rock &amp;amp; Roll (Hall of Fame)", "&lt;i&gt;Don Quixote&lt;/i&gt; (de la Mancha)",
+                  "O\\'Hare", "5 &amp;lt; 6")
+
+def toggle(clue_id, answer, escaped=False):
+    """Return the onmouseover toggle() call holding a clue's correct response."""
+    q = '\\&quot;' if escaped else '&quot;'
+    inner = (f'&lt;em class={q}correct_response{q}&gt;{answer}&lt;/em&gt;&lt;br /&gt;&lt;br /&gt;'
+             f'&lt;table width={q}100%{q}&gt;&lt;tr&gt;&lt;td class={q}right{q}&gt;Ken&lt;/td&gt;'
+             f'&lt;/tr&gt;&lt;/table&gt;')
+    return f"toggle('{clue_id}', '{clue_id}_stuck', '{inner}')"
+
+def board(rnd, base, rng, missing, daily_doubles, markup=False):
+    """Return the HTML of a 6x5 round; `missing` and `daily_doubles` are (row, column) sets."""
+    prefix = "J" if rnd == 1 else "DJ"
+    answers = MARKUP_ANSWERS if markup else ANSWERS
+    comments = '(Alex: Each response contains a &quot;Q&quot; &amp; a <i>U</i>.)' if markup else ''
+    html = [f'<div id="{"jeopardy_round" if rnd == 1 else "double_jeopardy_round"}">'
+            f'<table class="round"><tr>']
+    for col in range(6):
+        html.append(f'<td class="category"><table><tr><td class="category_name">CAT {rnd}-{col} '
+                    f'&amp; <i>Co</i></td></tr><tr><td class="category_comments">{comments}</td></tr>'
+                    f'</table></td>')
+    html.append('</tr>')
+    for row in range(5):
+        html.append('<tr>')
+        for col in range(6):
+            clue_id = f'clue_{prefix}_{col + 1}_{row + 1}'
+            if (row, col) in missing:
+                html.append('<td class="clue">\n</td>')
+                continue
+            value = base * (row + 1)
+            if (row, col) in daily_doubles:
+                value_td = f'<td class="clue_value_daily_double">DD: ${value * 3:,}</td>'
+            else:
+                value_td = f'<td class="clue_value">${value:,}</td>'
+            text = rng.choice(MARKUP_TEXTS) if markup else \
+                f'Clue {rnd} {row} {col} about <b>things</b> &amp; stuff'
+            html.append(
+                f'<td class="clue"><table><tr><td><div onmouseover="{toggle(clue_id, rng.choice(answers))}" '
+                f'onmouseout="toggle(\'{clue_id}\', \'{clue_id}_stuck\', \'x\')"><table class="clue_header">'
+                f'<tr>{value_td}<td class="clue_order_number">{row * 6 + col + 1}</td></tr></table></div>'
+                f'</td></tr><tr><td id="{clue_id}" class="clue_text">{text}</td></tr></table></td>')
+        html.append('</tr>')
+    html.append('</table></div>')
+    return ''.join(html)
+
+def game(gid, airdate, seed, base, missing=(), final=True, tiebreaker=False, markup=False):
+    rng = random.Random(seed)
+    html = ['<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"><html><head>'
+            '<meta http-equiv="Content-Type" content="text/html; charset=utf-8"/>'
+            f'<title>J! Archive - Show #{gid}, aired {airdate}</title></head><body><div id="content">']
+    html.append(board(1, base, rng, set(missing), {(2, 1)}, markup))
+    html.append(board(2, 2 * base, rng, set(missing), {(2, 3), (4, 0)}, markup))
+    if final:
+        html.append(f'<div id="final_jeopardy_round"><table class="final_round"><tr><td class="category">'
+                    f'<div onmouseover="{toggle("clue_FJ", FINAL_ANSWER, escaped=True)}"><table><tr>'
+                    f'<td class="category_name">FINAL CAT</td></tr></table></div></td></tr><tr>'
+                    f'<td id="clue_FJ" class="clue_text">Final clue text</td></tr></table>')
+        if tiebreaker:
+            html.append(f'<table class="final_round"><tr><td class="category"><div onmouseover='
+                        f'"{toggle("clue_TB", "Tiebreak")}"><table><tr><td class="category_name">'
+                        f'TIEBREAKER</td></tr></table></div></td></tr><tr><td id="clue_TB" '
+                        f'class="clue_text">Tiebreak clue</td></tr></table>')
+        html.append('</div>')
+    html.append('</div></body></html>')
+    return gid, ''.join(html)
+
+def fixtures():
+    yield game(1, '1984-09-10', 1, 100)
+    yield game(173, '1997-01-05', 2, 100, missing=[(4, 0), (4, 1), (3, 5)])
+    yield game(4680, '2004-12-31', 3, 200, tiebreaker=True)
+    yield game(6100, '2011-03-01', 4, 200, final=False)
+    yield game(9302, '2025-10-31', 5, 200, missing=[(0, 0)])
+    yield game(5117, '2006-01-02', 6, 200, markup=True)
+
+def write_fixtures(output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    for gid, html in fixtures():
+        with open(os.path.join(output_dir, f"{gid}.html"), 'w', encoding='utf-8') as f:
+            f.write(html)
+
+def record_fixtures(gids, output_dir):
+    """Save the given games from j-archive.com; return the number saved."""
+    os.makedirs(output_dir, exist_ok=True)
+    saved = 0
+    for i, gid in enumerate(gids):
+        if i:
+            time.sleep(SECONDS_BETWEEN_REQUESTS)
+        url = GAME_URL % gid
+        try:
+            with urlopen(url, timeout=30) as response:
+                page = response.read()
+        except (URLError, OSError) as e:
+            print(f"Could not download {url}: {e}", file=sys.stderr)
+            continue
+        if ERROR_MSG in page:
+            print(f"No game {gid} on j-archive.com", file=sys.stderr)
+            continue
+        with open(os.path.join(output_dir, f"{gid}.html"), 'wb') as f:
+            f.write(page)
+        saved += 1
+    return saved
+
+if __name__ == "__main__":
+    fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+    parser = argparse.ArgumentParser(description="Write the benchmark game page fixtures.")
+    parser.add_argument("output_dir", nargs="?",
+                        help="where to write the pages (default: fixtures, or fixtures/recorded with --record)")
+    parser.add_argument("--record", type=int, nargs="+", metavar="GID",
+                        help="save these games from j-archive.com instead of generating pages")
+    args = parser.parse_args()
+    if args.record:
+        saved = record_fixtures(args.record, args.output_dir or os.path.join(fixtures_dir, "recorded"))
+        print(f"Recorded {saved} of {len(args.record)} games", file=sys.stderr)
+        sys.exit(0 if saved == len(args.record) else 1)
+    write_fixtures(args.output_dir or fixtures_dir)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks of the parser, answer matching, loader and merge hot paths
+
+Everything runs against the game page fixtures in benchmarks/fixtures (see
+make_fixtures.py), or the recorded pages named by `--fixtures`, and archives
+built from them in a temporary directory:
+
+* parse_game / parse_round per fixture, for each parser engine,
+* whole-corpus parsing across engines and worker counts (games/sec, clues/sec),
+* sanitize + compare_strings on answer pairs,
+* jeopardy.read_jarchive from the CSV, year shards and (when pyarrow is installed) Parquet,
+  and clue_sampler draws through the offset index,
+* merge_archive append and two-way merge.
+
+Corpus, loader and merge cases run in a fresh process each, so their peak
+RSS is their own. Results are written as JSON; `--baseline` compares a run
+with an earlier results file.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas  # jeopardy imports it lazily; imported here so load timings leave it out
+from bs4 import BeautifulSoup
+from lxml import etree
+
+import clue_sampler
+import columnar_archive
+import merge_archive
+import parse_and_create_csv as pac
+import sharded_archive
+from jeopardy import compare_strings, read_jarchive, sanitize
+
+FIXTURES_DIR = os.path.join(ROOT, "benchmarks", "fixtures")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+def fixture_files():
+    return pac.find_game_files(FIXTURES_DIR)
+
+def peak_rss_mb():
+    """Peak RSS of this process and its children, in MB.
+
+    ru_maxrss survives fork and exec on Linux, so a spawned process would
+    report its parent's peak; the VmHWM of /proc is reset by exec.
+    """
+    self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open("/proc/self/status") as f:
+            self_peak = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+    except (OSError, StopIteration):
+        pass
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_peak, children_peak) / 1024
+
+def best_time(func, number, repeat):
+    """Return the best per-call time of `func` in seconds."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+def _child(queue, func, args):
+    # The imports alone account for much of the peak, so report the growth too
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    result = func(*args)
+    result["seconds"] = time.perf_counter() - start
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    result["rss_growth_mb"] = round(result["peak_rss_mb"] - baseline, 1)
+    queue.put(result)
+
+def isolated(func, *args):
+    """Run `func(*args)` in a fresh process; return its result dict with time and memory."""
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(queue, func, args))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def make_corpus(directory, games):
+    """Copy the fixtures under consecutive game IDs until there are `games` pages."""
+    os.makedirs(directory, exist_ok=True)
+    files = fixture_files()
+    for gid in range(1, games + 1):
+        shutil.copyfile(files[(gid - 1) % len(files)], os.path.join(directory, f"{gid}.html"))
+    return directory
+
+def make_archive(path, games):
+    """Write a jarchive.csv of `games` games by repeating the parsed fixtures."""
+    parsed = [pac.parse_game(filepath, "lxml") for filepath in fixture_files()]
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write(merge_archive.HEADER)
+        for gid in range(1, games + 1):
+            for clue in parsed[(gid - 1) % len(parsed)]:
+                out.write(pac.format_clue([gid] + clue[1:]) + "\n")
+    return path
+
+# Cases run in a child process
+
+def _parse_corpus(corpus_dir, engine, workers):
+    files = pac.find_game_files(corpus_dir)
+    clues = sum(len(c) for c in pac.iter_parsed_games(files, workers, engine))
+    return {"games": len(files), "clues": clues}
+
+def _load_archive(csv_path, columnar_path, shard_dir=None):
+    df = read_jarchive(csv_path, columnar_path, shard_dir)
+    return {"rows": len(df)}
+
+def _sample_clues(index_path, csv_path, draws):
+    start = time.perf_counter()
+    sampler = clue_sampler.ClueSampler(index_path, csv_path, seed=0)
+    opened = time.perf_counter() - start
+    # One at a time as the quiz draws them, then as one batch
+    for _ in range(draws):
+        sampler.sample()
+    sampler.sample(draws)
+    return {"draws": 2 * draws, "open_seconds": opened}
+
+def _append(archive_path, new_csv):
+    return {"rows": merge_archive.append_games(archive_path, merge_archive.load_new_games(new_csv))}
+
+def _merge(archive_path, new_csv):
+    total, games, replaced, _ = merge_archive.merge_games(archive_path, merge_archive.load_new_games(new_csv))
+    return {"rows": total, "games": games, "replaced": replaced}
+
+# Benchmarks
+
+def bench_functions(repeat):
+    """Per-call timings of the parse functions on each fixture."""
+    results = []
+    for filepath in fixture_files():
+        gid = pac.game_id(filepath)
+        with open(filepath, 'rb') as f:
+            page = f.read()
+        clues = len(pac.parse_page(page, gid))
+        for engine in pac.ENGINES:
+            seconds = best_time(lambda: pac.parse_page(page, gid, engine), 5, repeat)
+            results.append({"name": "parse_game", "engine": engine, "fixture": gid,
+                            "seconds": seconds, "clues": clues, "clues_per_sec": clues / seconds})
+
+        bsoup = BeautifulSoup(page.decode('utf-8'), "lxml")
+        root = etree.HTML(page.decode('utf-8'))
+        for rnd in (1, 2):
+            seconds = best_time(lambda: pac.parse_round(bsoup, rnd, gid, ""), 5, repeat)
+            results.append({"name": "parse_round", "engine": "bs4", "fixture": gid, "round": rnd,
+                            "seconds": seconds})
+            seconds = best_time(lambda: pac.parse_round_lxml(root, rnd, gid, ""), 5, repeat)
+            results.append({"name": "parse_round", "engine": "lxml", "fixture": gid, "round": rnd,
+                            "seconds": seconds})
+    return results
+
+def bench_corpus(work_dir, games, worker_counts):
+    corpus = make_corpus(os.path.join(work_dir, "corpus"), games)
+    results = []
+    for engine in pac.ENGINES:
+        for workers in worker_counts:
+            result = isolated(_parse_corpus, corpus, engine, workers)
+            result.update(name="parse_corpus", engine=engine, workers=workers,
+                          games_per_sec=result["games"] / result["seconds"],
+                          clues_per_sec=result["clues"] / result["seconds"])
+            results.append(result)
+    return results
+
+def bench_matching(pairs, repeat):
+    clues = [clue for filepath in fixture_files() for clue in pac.parse_game(filepath, "lxml")]
+    rng = random.Random(0)
+    samples = [(rng.choice(clues)[6], rng.choice(clues)[6]) for _ in range(pairs)]
+
+    def run():
+        for response, answer in samples:
+            compare_strings(sanitize(response), sanitize(answer))
+
+    seconds = best_time(run, 1, repeat)
+    return [{"name": "compare_strings", "pairs": pairs, "seconds": seconds,
+             "pairs_per_sec": pairs / seconds}]
+
+def bench_loader(work_dir, archive_games):
+    csv_path = make_archive(os.path.join(work_dir, "jarchive.csv"), archive_games)
+    results = []
+    result = isolated(_load_archive, csv_path, None)
+    result.update(name="read_jarchive", source="csv", rows_per_sec=result["rows"] / result["seconds"])
+    results.append(result)
+    if columnar_archive.available():
+        columnar_path = os.path.join(work_dir, "jarchive.parquet")
+        columnar_archive.build(csv_path, columnar_path)
+        result = isolated(_load_archive, csv_path, columnar_path)
+        result.update(name="read_jarchive", source="parquet", rows_per_sec=result["rows"] / result["seconds"])
+        results.append(result)
+    index_path = os.path.join(work_dir, "jarchive_offsets.npy")
+    clue_sampler.build(csv_path, index_path)
+    result = isolated(_sample_clues, index_path, csv_path, 1000)
+    result.update(name="clue_sampler", draws_per_sec=result["draws"] / result["seconds"])
+    results.append(result)
+    shard_dir = os.path.join(work_dir, "shards")
+    sharded_archive.build(csv_path, shard_dir)
+    result = isolated(_load_archive, csv_path, None, shard_dir)
+    result.update(name="read_jarchive", source="shards", rows_per_sec=result["rows"] / result["seconds"])
+    results.append(result)
+    return results
+
+def bench_merge(work_dir, archive_games, new_games):
+    base = make_archive(os.path.join(work_dir, "base.csv"), archive_games)
+    # New games past the end of the archive (append) and a block that overlaps it (merge)
+    new_path = os.path.join(work_dir, "new.csv")
+    make_archive(new_path, archive_games + new_games)
+    with open(new_path, encoding='utf-8') as f:
+        lines = f.readlines()
+    tail = [line for line in lines[1:] if int(line.split('||')[0]) > archive_games]
+    overlap = [line for line in lines[1:] if archive_games - new_games < int(line.split('||')[0]) <= archive_games]
+
+    results = []
+    for mode, rows, func in (("append", tail, _append), ("merge", overlap, _merge)):
+        archive = os.path.join(work_dir, f"{mode}.csv")
+        shutil.copyfile(base, archive)
+        with open(new_path, 'w', encoding='utf-8') as f:
+            f.write(merge_archive.HEADER)
+            f.writelines(rows)
+        result = isolated(func, archive, new_path)
+        result.update(name="merge", mode=mode, new_games=new_games, archive_games=archive_games,
+                      rows_per_sec=result["rows"] / result["seconds"])
+        results.append(result)
+    return results
+
+def case_key(result):
+    """Identify a case across runs by its name and parameters."""
+    return json.dumps({k: v for k, v in result.items()
+                       if isinstance(v, (str, int)) and k in ("name", "engine", "fixture", "round",
+                                                               "workers", "source", "mode")},
+                      sort_keys=True)
+
+def compare(results, settings, baseline_path):
+    with open(baseline_path) as f:
+        report = json.load(f)
+    baseline = {case_key(r): r for r in report["results"]}
+    print(f"Compared with {baseline_path} (time ratio, < 1.0 is faster):", file=sys.stderr)
+    if report.get("settings") != settings:
+        print(f"  warning: settings differ ({report.get('settings')} vs {settings})", file=sys.stderr)
+    for result in results:
+        old = baseline.get(case_key(result))
+        if old:
+            ratio = result["seconds"] / old["seconds"]
+            flag = "  REGRESSION" if ratio > 1.1 else ""
+            print(f"  {ratio:5.2f}  {describe(result)}{flag}", file=sys.stderr)
+
+def describe(result):
+    params = ", ".join(f"{k}={result[k]}" for k in ("engine", "fixture", "round", "workers", "source", "mode")
+                       if k in result)
+    return f"{result['name']}({params})"
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks and write JSON results.")
+    parser.add_argument("-o", "--output", help="results file (default: benchmarks/results/<time>.json)")
+    parser.add_argument("-b", "--baseline", help="earlier results file to compare with")
+    parser.add_argument("-g", "--games", type=int, default=500, help="games in the parse corpus")
+    parser.add_argument("-a", "--archive-games", type=int, default=2000,
+                        help="games in the loader and merge archives")
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1],
+                        help="worker counts for corpus parsing")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="repetitions of timed functions")
+    parser.add_argument("-f", "--fixtures", default=FIXTURES_DIR,
+                        help="game pages to run against, e.g. benchmarks/fixtures/recorded "
+                        "(default: benchmarks/fixtures)")
+    parser.add_argument("--only", nargs="+", choices=("functions", "corpus", "matching", "loader", "merge"),
+                        help="run only these groups")
+    args = parser.parse_args()
+    FIXTURES_DIR = args.fixtures
+    if not fixture_files():
+        parser.error(f"no <gid>.html pages in {FIXTURES_DIR}")
+
+    groups = args.only or ("functions", "corpus", "matching", "loader", "merge")
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for group in groups:
+            start = time.perf_counter()
+            if group == "functions":
+                group_results = bench_functions(args.repeat)
+            elif group == "corpus":
+                group_results = bench_corpus(work_dir, args.games, sorted(set(args.workers)))
+            elif group == "matching":
+                group_results = bench_matching(10000, args.repeat)
+            elif group == "loader":
+                group_results = bench_loader(work_dir, args.archive_games)
+            else:
+                group_results = bench_merge(work_dir, args.archive_games, 50)
+            for result in group_results:
+                rate = ", ".join(f"{result[k]:,.0f} {k.replace('_per_sec', '')}/s" for k in result
+                                 if k.endswith("_per_sec"))
+                if "peak_rss_mb" in result:
+                    rate += f", peak {result['peak_rss_mb']:.0f} MB (+{result['rss_growth_mb']:.0f} MB)"
+                print(f"{describe(result):50} {result['seconds'] * 1000:10.2f} ms  {rate}", file=sys.stderr)
+            print(f"[{group} done in {time.perf_counter() - start:.1f}s]", file=sys.stderr)
+            results.extend(group_results)
+
+    settings = {"fixtures": os.path.relpath(FIXTURES_DIR, ROOT), "games": args.games, "archive_games": args.archive_games, "repeat": args.repeat}
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": settings,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"Wrote {len(results)} results to {output}", file=sys.stderr)
+
+    if args.baseline:
+        compare(results, settings, args.baseline)
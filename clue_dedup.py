@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Near-duplicate clues found with MinHash signatures and locality-sensitive hashing
+
+Each playable clue is reduced to a document, its sanitized text and answer
+(`jeopardy.sanitize`), and the document to a set of shingles: the adjacent
+character pairs within words that `jeopardy.compare_strings` counts, plus
+adjacent word pairs. A MinHash signature of NUM_PERM 16-bit values estimates
+the Jaccard similarity of two shingle sets as the fraction of values they
+share, so clues are compared by signature instead of pairwise.
+
+Signatures are computed in parallel over chunks of clues, once per distinct
+document, and kept in jarchive_minhash.npz with the game ID and document of
+every clue; `update` only signs the clues of new games. Clustering splits
+the signatures into bands, groups the documents whose band is identical and
+joins each to the first document of its group when their estimated
+similarity reaches the threshold. Identical documents are one cluster.
+"""
+
+import argparse
+import concurrent.futures as futures
+import hashlib
+import json
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from archive_format import UNPLAYABLE_ANSWER, UNPLAYABLE_TEXT, Reader
+from jeopardy import sanitize
+
+DEFAULT_SIGNATURES = "jarchive_minhash.npz"
+NUM_PERM = 64
+SEED = 1984
+# Estimated Jaccard similarity of two clues' shingles to count as duplicates
+THRESHOLD = 0.7
+# Clues per parallel task
+CHUNK_ROWS = 20000
+# Signature value of a document without shingles
+EMPTY = 0xFFFF
+
+def document(text, answer):
+    """Return the text compared for a clue: its sanitized text and answer."""
+    return " ".join(f"{sanitize(text)} {sanitize(answer)}".split())
+
+def document_key(doc):
+    """Return a 64-bit key identifying a document."""
+    return int.from_bytes(hashlib.blake2b(doc.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def _permutations(num_perm=NUM_PERM, seed=SEED):
+    """Return the multipliers and increments of the multiply-shift hash functions."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+    return a, b
+
+def shingles(docs):
+    """Return (document number, shingle) arrays of a list of documents."""
+    # Character pairs within words; documents are joined by line breaks and words by spaces
+    points = np.frombuffer("\n".join(docs).encode('utf-32-le'), dtype='<u4').astype(np.uint64)
+    owner = np.cumsum(points == 10)
+    breaks = (points == 10) | (points == 32)
+    inside = ~(breaks[:-1] | breaks[1:])
+    pair_owner = owner[:-1][inside]
+    pair_values = (points[:-1][inside] << np.uint64(21)) | points[1:][inside]
+
+    # Word pairs, marked by the top bit so they never equal a character pair
+    word_ids = {}
+    words = [[word_ids.get(word) or word_ids.setdefault(word, zlib.crc32(word.encode('utf-8')))
+              for word in doc.split(" ")] if doc else [] for doc in docs]
+    word_owner = np.repeat(np.arange(len(docs)), [len(w) for w in words])
+    ids = np.fromiter((i for w in words for i in w), np.uint64, len(word_owner))
+    same = word_owner[:-1] == word_owner[1:]
+    word_values = (ids[:-1][same] << np.uint64(32)) | ids[1:][same] | np.uint64(1 << 63)
+
+    return (np.concatenate([pair_owner, word_owner[:-1][same]]).astype(np.int64),
+            np.concatenate([pair_values, word_values]))
+
+def minhash(docs, num_perm=NUM_PERM, seed=SEED):
+    """Return the (len(docs), num_perm) uint16 signatures of a list of documents.
+
+    Each value is the top 16 bits of the smallest hash of the document's
+    shingles under one hash function; documents without shingles get EMPTY
+    throughout.
+    """
+    signatures = np.full((len(docs), num_perm), EMPTY, dtype=np.uint16)
+    owner, values = shingles(docs)
+    if not len(values):
+        return signatures
+    order = np.argsort(owner, kind='stable')
+    owner, values = owner[order], values[order]
+    starts = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+    signed = owner[starts]
+    a, b = _permutations(num_perm, seed)
+    hashes = np.empty_like(values)
+    for i in range(num_perm):
+        np.multiply(values, a[i], out=hashes)
+        hashes += b[i]
+        signatures[signed, i] = np.minimum.reduceat(hashes, starts) >> np.uint64(48)
+    return signatures
+
+def _sign_chunk(pairs):
+    """Return (document keys, signatures) of a list of (text, answer) pairs."""
+    docs = [document(text, answer) for text, answer in pairs]
+    keys = np.fromiter(map(document_key, docs), np.uint64, len(docs))
+    return keys, minhash(docs)
+
+def sign(texts, answers, workers=None):
+    """Return the document keys and signatures of clues, in parallel chunks."""
+    pairs = list(zip(texts, answers))
+    chunks = [pairs[i:i + CHUNK_ROWS] for i in range(0, len(pairs), CHUNK_ROWS)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers <= 1:
+        results = [_sign_chunk(chunk) for chunk in chunks]
+    else:
+        with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_sign_chunk, chunks))
+    if not results:
+        return np.zeros(0, np.uint64), np.zeros((0, NUM_PERM), np.uint16)
+    return np.concatenate([keys for keys, _ in results]), np.concatenate([sigs for _, sigs in results])
+
+def read_playable(csv_path):
+    """Return the gid, text and answer columns of the playable clues of an archive file."""
+    gids, texts, answers = [], [], []
+    for batch in Reader(csv_path).column_batches():
+        for gid, text, answer in zip(batch[0], batch[5], batch[6]):
+            if text not in UNPLAYABLE_TEXT and answer not in UNPLAYABLE_ANSWER:
+                gids.append(int(gid))
+                texts.append(text)
+                answers.append(answer)
+    return np.array(gids, dtype=np.int32), texts, answers
+
+class Signatures:
+    """The clues of an archive (game ID and document number, in archive order)
+    and one signature per distinct document."""
+
+    def __init__(self, gid=None, doc=None, doc_keys=None, signature=None):
+        self.gid = np.zeros(0, np.int32) if gid is None else gid
+        self.doc = np.zeros(0, np.int32) if doc is None else doc
+        self.doc_keys = np.zeros(0, np.uint64) if doc_keys is None else doc_keys
+        self.signature = np.zeros((0, NUM_PERM), np.uint16) if signature is None else signature
+
+    def __len__(self):
+        return len(self.gid)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        if data['signature'].shape[1] != NUM_PERM or int(data['seed']) != SEED:
+            raise ValueError(f"{path} was built with other MinHash parameters; rebuild it")
+        return cls(data['gid'], data['doc'], data['doc_keys'], data['signature'])
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, gid=self.gid, doc=self.doc, doc_keys=self.doc_keys,
+                     signature=self.signature, seed=SEED)
+        os.replace(tmp_path, path)
+
+    def add(self, gids, keys, signatures):
+        """Append clues; documents already signed reuse their signature."""
+        found = np.zeros(len(keys), dtype=bool)
+        doc = np.empty(len(keys), dtype=np.int32)
+        if len(self.doc_keys):
+            order = np.argsort(self.doc_keys)
+            pos = np.minimum(np.searchsorted(self.doc_keys, keys, sorter=order), len(order) - 1)
+            found = self.doc_keys[order[pos]] == keys
+            doc[found] = order[pos[found]]
+        fresh_keys, first, inverse = np.unique(keys[~found], return_index=True, return_inverse=True)
+        doc[~found] = len(self.doc_keys) + inverse
+        self.doc_keys = np.concatenate([self.doc_keys, fresh_keys])
+        self.signature = np.concatenate([self.signature, signatures[~found][first]])
+        self.gid = np.concatenate([self.gid, np.asarray(gids, dtype=np.int32)])
+        self.doc = np.concatenate([self.doc, doc])
+        return len(fresh_keys)
+
+    def remove_games(self, gids):
+        """Drop the clues of games (their documents stay signed for reuse)."""
+        keep = ~np.isin(self.gid, list(gids))
+        self.gid, self.doc = self.gid[keep], self.doc[keep]
+
+    def clusters(self, threshold=THRESHOLD):
+        """Return the cluster number of every clue, -1 for clues without a duplicate."""
+        labels = cluster_documents(self.signature, threshold, np.unique(self.doc))
+        # Clusters of one document are duplicates only if more than one clue has it
+        clue_labels = labels[self.doc]
+        sizes = np.bincount(clue_labels[clue_labels >= 0], minlength=len(labels))
+        clue_labels[(clue_labels >= 0) & (sizes[np.maximum(clue_labels, 0)] < 2)] = -1
+        _, clue_labels[clue_labels >= 0] = np.unique(clue_labels[clue_labels >= 0], return_inverse=True)
+        return clue_labels
+
+    def document_clusters(self, threshold=THRESHOLD):
+        """Return {document key: cluster number} of the clues that have duplicates."""
+        labels = self.clusters(threshold)
+        duplicated = labels >= 0
+        return dict(zip(self.doc_keys[self.doc[duplicated]].tolist(), labels[duplicated].tolist()))
+
+def lsh_bands(threshold, num_perm=NUM_PERM):
+    """Return (bands, rows per band) with the highest LSH threshold (1/bands)^(1/rows)
+    at or below `threshold`, so that pairs above it are almost always candidates."""
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if num_perm % rows == 0 and (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+def cluster_documents(signature, threshold=THRESHOLD, docs=None):
+    """Return a label per document: equal labels are near-duplicates.
+
+    Only `docs` (default: all) are clustered; the others and documents
+    without shingles get -1.
+    """
+    labels = np.full(len(signature), -1, dtype=np.int64)
+    docs = np.arange(len(signature)) if docs is None else np.asarray(docs)
+    docs = docs[~(signature[docs] == EMPTY).all(axis=1)]
+    sig = signature[docs]
+    bands, rows = lsh_bands(threshold, sig.shape[1])
+
+    edges = []
+    for band in range(bands):
+        key = np.zeros(len(docs), dtype=np.uint64)
+        for column in range(band * rows, (band + 1) * rows):
+            key = key * np.uint64(0x100000001B3) ^ sig[:, column]
+        order = np.argsort(key, kind='stable')
+        ordered = key[order]
+        first = np.r_[True, ordered[1:] != ordered[:-1]]
+        group_start = np.maximum.accumulate(np.where(first, np.arange(len(ordered)), 0))
+        members, reps = order[~first], order[group_start[~first]]
+        similar = (sig[members] == sig[reps]).mean(axis=1) >= threshold
+        edges.append((members[similar], reps[similar]))
+
+    # Connected components by label propagation with pointer jumping
+    component = np.arange(len(docs))
+    if edges:
+        left = np.concatenate([e[0] for e in edges])
+        right = np.concatenate([e[1] for e in edges])
+        while True:
+            low = np.minimum(component[left], component[right])
+            previous = component.copy()
+            np.minimum.at(component, left, low)
+            np.minimum.at(component, right, low)
+            component = component[component]
+            if np.array_equal(component, previous):
+                break
+    labels[docs] = component
+    return labels
+
+def build(csv_path, path=DEFAULT_SIGNATURES, workers=None):
+    """Sign every playable clue of an archive; return the Signatures."""
+    gids, texts, answers = read_playable(csv_path)
+    keys, signatures = sign(texts, answers, workers)
+    state = Signatures()
+    state.add(gids, keys, signatures)
+    state.save(path)
+    return state
+
+def update(path, new_csv_path, workers=None):
+    """Add the clues of newly parsed games, replacing earlier copies of those games.
+
+    Returns the number of clues added and of documents signed.
+    """
+    state = Signatures.load(path)
+    gids, texts, answers = read_playable(new_csv_path)
+    keys, signatures = sign(texts, answers, workers)
+    state.remove_games(set(gids.tolist()))
+    signed = state.add(gids, keys, signatures)
+    state.save(path)
+    return len(gids), signed
+
+def iter_clusters(csv_path, state, threshold=THRESHOLD):
+    """Yield the clusters of near-duplicates, largest first, as lists of archive rows."""
+    labels = state.clusters(threshold)
+    # The n-th playable clue of a game in the archive is the n-th clue of that game in `state`
+    order = np.argsort(state.gid, kind='stable')
+    ordinal = np.empty(len(order), dtype=np.int64)
+    first = np.r_[True, state.gid[order][1:] != state.gid[order][:-1]]
+    ordinal[order] = np.arange(len(order)) - np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))
+    wanted = {(gid, n): label for gid, n, label in
+              zip(state.gid.tolist(), ordinal.tolist(), labels.tolist()) if label >= 0}
+
+    members = {}
+    seen = {}
+    for fields in Reader(csv_path):
+        if fields[5] in UNPLAYABLE_TEXT or fields[6] in UNPLAYABLE_ANSWER:
+            continue
+        gid = int(fields[0])
+        n = seen[gid] = seen.get(gid, -1) + 1
+        label = wanted.get((gid, n))
+        if label is not None:
+            members.setdefault(label, []).append(fields)
+    yield from sorted(members.values(), key=len, reverse=True)
+
+def report(csv_path, state, threshold=THRESHOLD, top=20, jsonl_path=None):
+    """Print a summary and the largest clusters; optionally write every cluster as JSON lines."""
+    clusters = 0
+    clues = 0
+    out = open(jsonl_path, 'w', encoding='utf-8') if jsonl_path else None
+    try:
+        for cluster in iter_clusters(csv_path, state, threshold):
+            if clusters < top:
+                print(f"--- {len(cluster)} clues")
+                for gid, airdate, rnd, category, value, text, answer in cluster:
+                    print(f"{gid:>5} {airdate} r{rnd} {category} ${value}: {text} -- {answer}")
+            if out is not None:
+                out.write(json.dumps({"cluster": clusters, "clues": [dict(zip(("gid", "airdate", "rnd", "category",
+                                                                               "value", "text", "answer"), fields))
+                                                                     for fields in cluster]}) + "\n")
+            clusters += 1
+            clues += len(cluster)
+    finally:
+        if out is not None:
+            out.close()
+    print(f"{len(state):,} clues, {len(np.unique(state.doc)):,} distinct; {clusters:,} clusters hold "
+          f"{clues:,} clues, {clues - clusters:,} of them repeats (threshold {threshold})", file=sys.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find near-duplicate clues with MinHash and LSH.")
+    parser.add_argument("-s", "--signatures", default=DEFAULT_SIGNATURES,
+                        help="signature file (default: %(default)s)")
+    parser.add_argument("-w", "--workers", type=int, help="signing processes (default: one per CPU)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_cmd = commands.add_parser("build", help="sign every playable clue of the archive")
+    build_cmd.add_argument("archive", nargs="?", default="jarchive.csv")
+    update_cmd = commands.add_parser("update", help="sign the clues of newly parsed games")
+    update_cmd.add_argument("new_csv")
+    report_cmd = commands.add_parser("report", help="list clusters of near-duplicate clues")
+    report_cmd.add_argument("archive", nargs="?", default="jarchive.csv")
+    report_cmd.add_argument("-t", "--threshold", type=float, default=THRESHOLD,
+                            help="estimated Jaccard similarity of duplicates (default: %(default)s)")
+    report_cmd.add_argument("-n", "--top", type=int, default=20, help="clusters to print")
+    report_cmd.add_argument("--jsonl", help="write every cluster to this file as JSON lines")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "build":
+        state = build(args.archive, args.signatures, args.workers)
+        print(f"Signed {len(state):,} clues ({len(state.doc_keys):,} distinct) in "
+              f"{time.perf_counter() - start:.1f}s", file=sys.stderr)
+    elif args.command == "update":
+        added, signed = update(args.signatures, args.new_csv, args.workers)
+        print(f"Added {added:,} clues, signed {signed:,} new documents in {time.perf_counter() - start:.1f}s",
+              file=sys.stderr)
+    else:
+        report(args.archive, Signatures.load(args.signatures), args.threshold, args.top, args.jsonl)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Random clues read straight from jarchive.csv through a row offset index
+
+The index is a NumPy record array with one fixed-size record per row of the
+archive: the byte offset of the row plus its game ID, air year, round, value,
+category number and whether it is playable. It is opened memory-mapped, so
+opening it takes milliseconds and only the pages a query touches are read.
+Filters on round, value, category or year are vectorised over the index and
+each drawn clue is read by seeking to its row, so the archive is never
+loaded as a whole.
+
+Category names live in a side file, one per line, read only when a category
+filter is used; the index metadata (archive size and modification time)
+says whether the index still matches the archive.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import resource
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from archive_format import BATCH_BYTES, UNPLAYABLE_ANSWER, UNPLAYABLE_TEXT, join_fields, parse_line, parse_value
+
+DEFAULT_INDEX = "jarchive_offsets.npy"
+INDEX_DTYPE = np.dtype([('offset', '<i8'), ('gid', '<i4'), ('value', '<i4'), ('category', '<i4'),
+                        ('year', '<i2'), ('rnd', '<i1'), ('playable', '?')])
+
+def _meta_path(index_path):
+    return os.path.splitext(index_path)[0] + ".json"
+
+def _categories_path(index_path):
+    return os.path.splitext(index_path)[0] + ".categories"
+
+def _archive_stamp(archive_path):
+    stat = os.stat(archive_path)
+    return {"archive_size": stat.st_size, "archive_mtime_ns": stat.st_mtime_ns}
+
+def build(archive_path, index_path=DEFAULT_INDEX):
+    """Index every valid row of the archive; return the number of rows."""
+    columns = {name: array(code) for name, code in
+               (('offset', 'q'), ('gid', 'i'), ('value', 'i'), ('category', 'i'),
+                ('year', 'h'), ('rnd', 'b'), ('playable', 'b'))}
+    categories = {}
+    stamp = _archive_stamp(archive_path)
+    with open(archive_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start, size = 0, len(mm)
+        while start < size:
+            end = mm.find(b"\n", min(start + BATCH_BYTES, size - 1))
+            end = size if end < 0 else end + 1
+            offset = start
+            for line in mm[start:end].split(b"\n"):
+                fields = parse_line(line.decode('utf-8'))
+                if fields is not None:
+                    gid, airdate, rnd, category, value, text, answer = fields
+                    columns['offset'].append(offset)
+                    columns['gid'].append(int(gid))
+                    columns['value'].append(parse_value(value))
+                    columns['category'].append(categories.setdefault(category, len(categories)))
+                    columns['year'].append(int(airdate[:4]) if airdate[:4].isdigit() else 0)
+                    columns['rnd'].append(int(rnd) if rnd.isdigit() else 0)
+                    columns['playable'].append(text not in UNPLAYABLE_TEXT and answer not in UNPLAYABLE_ANSWER)
+                offset += len(line) + 1
+            start = end
+
+    index = np.empty(len(columns['offset']), dtype=INDEX_DTYPE)
+    for name, values in columns.items():
+        index[name] = np.frombuffer(values, dtype=values.typecode) if values else []
+
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, index)
+    with open(_categories_path(index_path), 'w', encoding='utf-8') as f:
+        f.writelines(name + "\n" for name in categories)
+    with open(_meta_path(index_path), 'w', encoding='utf-8') as f:
+        json.dump({"format": 1, "rows": len(index), "categories": len(categories), **stamp}, f)
+    os.replace(tmp_path, index_path)
+    return len(index)
+
+def is_fresh(index_path, archive_path):
+    """Return True if the index exists and was built from the archive as it is now."""
+    try:
+        with open(_meta_path(index_path), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return os.path.exists(index_path) and all(meta.get(key) == value
+                                                  for key, value in _archive_stamp(archive_path).items())
+    except (IOError, ValueError):
+        return False
+
+class ClueSampler:
+    """Uniform random clues, optionally filtered, read through the offset index."""
+
+    def __init__(self, index_path=DEFAULT_INDEX, archive_path="jarchive.csv", seed=None):
+        self.index_path = index_path
+        self.index = np.load(index_path, mmap_mode='r')
+        self.rng = np.random.default_rng(seed)
+        self._file = open(archive_path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._categories = None
+        self._selected = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def categories(self):
+        if self._categories is None:
+            with open(_categories_path(self.index_path), 'r', encoding='utf-8') as f:
+                self._categories = f.read().split("\n")[:-1]
+        return self._categories
+
+    def select(self, rnd=None, value=None, category=None, years=None, playable=True):
+        """Return the row numbers of the clues matching every given filter.
+
+        `category` matches any category name containing it, ignoring case;
+        `years` is a collection of air years. The last selection is cached.
+        """
+        key = (rnd, value, category, tuple(sorted(years)) if years is not None else None, playable)
+        if self._selected is not None and self._selected[0] == key:
+            return self._selected[1]
+
+        mask = np.ones(len(self.index), dtype=bool)
+        if playable:
+            mask &= self.index['playable']
+        if rnd is not None:
+            mask &= self.index['rnd'] == rnd
+        if value is not None:
+            mask &= self.index['value'] == value
+        if category is not None:
+            wanted = category.lower()
+            ids = [i for i, name in enumerate(self.categories()) if wanted in name.lower()]
+            mask &= np.isin(self.index['category'], ids)
+        if years is not None:
+            mask &= np.isin(self.index['year'], list(years))
+        rows = np.flatnonzero(mask)
+        self._selected = (key, rows)
+        return rows
+
+    def read(self, row):
+        """Return the fields of one indexed row, read from the archive."""
+        record = self.index[row]
+        offset = int(record['offset'])
+        end = self._mm.find(b"\n", offset)
+        fields = parse_line(self._mm[offset:end if end >= 0 else len(self._mm)].decode('utf-8'))
+        if fields is None or int(fields[0]) != record['gid']:
+            raise ValueError(f"{self.index_path} does not match the archive; rebuild it")
+        return fields
+
+    def _draw(self, k, playable=True):
+        """Return `k` distinct random row numbers, rejecting unplayable rows one at a time.
+
+        Only the index pages of the drawn rows are read. Returns None once
+        more than a quarter of the index has been rejected, as when few or no
+        rows are playable; `select` is cheaper then.
+        """
+        picks, seen = [], set()
+        while len(picks) < k:
+            if len(seen) - len(picks) > len(self.index) // 4:
+                return None
+            for row in self.rng.integers(len(self.index), size=k - len(picks)):
+                if row not in seen:
+                    seen.add(row)
+                    if not playable or self.index['playable'][row]:
+                        picks.append(row)
+        return np.array(picks, dtype=np.int64)
+
+    def sample(self, k=1, **filters):
+        """Return up to `k` distinct random clues matching `filters` (see `select`)."""
+        picks = None
+        if all(filters.get(name) is None for name in ('rnd', 'value', 'category', 'years')) \
+                and k < len(self.index) // 4:
+            picks = self._draw(k, filters.get('playable', True))
+        if picks is None:
+            rows = self.select(**filters)
+            picks = self.rng.choice(rows, size=min(k, len(rows)), replace=False)
+        # Read in file order, which keeps the reads sequential for large batches
+        fields = {row: self.read(row) for row in np.sort(picks)}
+        return [fields[row] for row in picks]
+
+    def questions(self, **filters):
+        """Yield the clues matching `filters` in a random order, without repeats."""
+        for row in self.rng.permutation(self.select(**filters)):
+            yield self.read(row)
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+def benchmark(index_path, archive_path, batch=10000):
+    """Report open time, filter and draw latency and resident memory."""
+    start = time.perf_counter()
+    sampler = ClueSampler(index_path, archive_path)
+    print(f"Opened index of {len(sampler):,} rows in {(time.perf_counter() - start) * 1e3:.2f} ms")
+
+    latencies = []
+    for _ in range(1000):
+        start = time.perf_counter()
+        sampler.sample()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"Single uniform draws: mean {sum(latencies) / len(latencies) * 1e6:.0f} us, "
+          f"p99 {latencies[989] * 1e6:.0f} us")
+
+    for filters in ({"rnd": 2}, {"value": 1000}, {"category": "potent potables"}, {"years": {2004}}):
+        start = time.perf_counter()
+        rows = sampler.select(**filters)
+        select_time = time.perf_counter() - start
+        start = time.perf_counter()
+        sampler.sample(10, **filters)
+        print(f"Filter {filters}: {len(rows):,} clues selected in {select_time * 1e3:.1f} ms, "
+              f"10 drawn in {(time.perf_counter() - start) * 1e3:.2f} ms")
+
+    start = time.perf_counter()
+    clues = sampler.sample(batch)
+    print(f"Batch of {len(clues):,} clues drawn in {(time.perf_counter() - start) * 1e3:.0f} ms")
+    print(f"Peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    sampler.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or benchmark the clue offset index.")
+    parser.add_argument("command", choices=("build", "sample", "bench"))
+    parser.add_argument("archive", nargs="?", default="jarchive.csv")
+    parser.add_argument("-i", "--index", default=DEFAULT_INDEX, help="index file (default: %(default)s)")
+    parser.add_argument("-n", type=int, default=5, help="clues to draw with `sample`")
+    parser.add_argument("--round", type=int, choices=(1, 2, 3), dest="rnd")
+    parser.add_argument("--value", type=int)
+    parser.add_argument("--category", help="part of the category name, ignoring case")
+    parser.add_argument("--year", type=int, action="append", dest="years")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        rows = build(args.archive, args.index)
+        print(f"Indexed {rows:,} rows of {args.archive} in {time.perf_counter() - start:.1f}s "
+              f"({os.path.getsize(args.index) / 1e6:.1f} MB)", file=sys.stderr)
+    elif not is_fresh(args.index, args.archive):
+        print(f"{args.index} is missing or older than {args.archive}; run `build` first", file=sys.stderr)
+        sys.exit(1)
+    elif args.command == "sample":
+        with ClueSampler(args.index, args.archive) as sampler:
+            for fields in sampler.sample(args.n, rnd=args.rnd, value=args.value,
+                                         category=args.category, years=args.years):
+                print(join_fields(fields))
+    else:
+        benchmark(args.index, args.archive)
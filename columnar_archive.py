@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Build and load a typed columnar (Parquet) copy of jarchive.csv
+
+gid, rnd and value are stored as integers, airdate as a date and category as
+a dictionary-encoded column, so loading skips the regex-separated CSV parse.
+A value of 0 means the clue has no preset value (Final Jeopardy, or a value
+missing from the page).
+
+Requires pyarrow; callers fall back to the CSV when it is not installed.
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from archive_format import parse_value, read_columns
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+def available():
+    """Return True if pyarrow is installed."""
+    return pa is not None
+
+def build(csv_path, out_path):
+    """Convert a || separated archive CSV to Parquet; return the row count."""
+    if not available():
+        raise ImportError("pyarrow is required to build the columnar archive")
+
+    columns = read_columns(csv_path)
+    columns['gid'] = [int(gid) for gid in columns['gid']]
+    columns['rnd'] = [int(rnd) if rnd.isdigit() else 0 for rnd in columns['rnd']]
+    columns['value'] = [parse_value(value) for value in columns['value']]
+
+    # Malformed airdates become nulls rather than failing the whole build
+    airdates = pc.strptime(pa.array(columns['airdate']), format='%Y-%m-%d',
+                           unit='s', error_is_null=True)
+    table = pa.table({
+        'gid': pa.array(columns['gid'], pa.int32()),
+        'airdate': airdates.cast(pa.date32()),
+        'rnd': pa.array(columns['rnd'], pa.int8()),
+        'category': pa.array(columns['category'], pa.string()).dictionary_encode(),
+        'value': pa.array(columns['value'], pa.int32()),
+        'text': pa.array(columns['text'], pa.string()),
+        'answer': pa.array(columns['answer'], pa.string()),
+    })
+
+    tmp_path = out_path + '.tmp'
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, out_path)
+    return table.num_rows
+
+def load(path, filters=None):
+    """Load the Parquet archive as a DataFrame with a categorical category column.
+
+    `filters` are pyarrow row filters, applied before conversion to pandas.
+    """
+    if not available():
+        raise ImportError("pyarrow is required to load the columnar archive")
+    return pq.read_table(path, filters=filters).to_pandas(date_as_object=False)
+
+def is_fresh(columnar_path, csv_path):
+    """Return True if the columnar file exists and is not older than the CSV."""
+    if not os.path.exists(columnar_path):
+        return False
+    return not os.path.exists(csv_path) or \
+        os.path.getmtime(columnar_path) >= os.path.getmtime(csv_path)
+
+def _measure(csv_path, columnar_path, queue):
+    from jeopardy import read_jarchive
+    start = time.perf_counter()
+    df = read_jarchive(csv_path, columnar_path)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(df)))
+
+def benchmark(csv_path, columnar_path, repeat=3):
+    """Time `jeopardy.read_jarchive` from the CSV and the Parquet file.
+
+    Each load runs in a fresh process so peak RSS is measured per load.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    for label, path in (("csv", None), ("parquet", columnar_path)):
+        timings = []
+        for _ in range(repeat):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_measure, args=(csv_path, path, queue))
+            proc.start()
+            timings.append(queue.get())
+            proc.join()
+        best = min(timings)
+        print(f"{label:8} best of {repeat}: {best[0]:.2f}s, peak RSS {best[1] / 1024:.0f} MB, "
+              f"{best[2]:,} rows")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or benchmark the columnar archive.")
+    parser.add_argument("command", choices=("build", "bench"))
+    parser.add_argument("csv", nargs="?", default="jarchive.csv", help="the || separated archive")
+    parser.add_argument("parquet", nargs="?", default="jarchive.parquet", help="the columnar archive")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="benchmark repetitions")
+    args = parser.parse_args()
+
+    if not available():
+        print("pyarrow is not installed; skipping columnar archive", file=sys.stderr)
+        sys.exit(1)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        rows = build(args.csv, args.parquet)
+        print(f"Wrote {rows:,} rows to {args.parquet} ({os.path.getsize(args.parquet) / 1e6:.1f} MB) "
+              f"in {time.perf_counter() - start:.1f}s")
+    else:
+        benchmark(args.csv, args.parquet, args.repeat)
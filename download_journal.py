@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Durable journal of game page downloads
+
+Every download attempt appends one JSON line with the game ID, outcome
+("saved", "missing" or "failed"), attempt count, HTTP status, bytes, time
+taken and when the game may be tried again; the last line of a game wins.
+The file is small and plain text, so it can be committed next to
+last_episode.txt and survive between runs.
+
+* failed games are retried on later runs with exponential backoff,
+* known untranscribed games are rechecked on their own slower schedule,
+* everything else is left to the caller (a saved page is found on disk or in
+  the store, and games past the last episode are always requested).
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+DEFAULT_JOURNAL = "download_journal.jsonl"
+# Delay before the first retry of a failed game; doubles with each failure
+RETRY_BACKOFF = 3600
+MAX_RETRY_DELAY = 7 * 24 * 3600
+# How often a known untranscribed game is requested again
+MISSING_RECHECK = 28 * 24 * 3600
+
+class DownloadJournal:
+    """Latest download state of each game, backed by an append-only JSONL file."""
+
+    def __init__(self, path=DEFAULT_JOURNAL, known_missing=()):
+        self.path = path
+        self.known_missing = set(known_missing)
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    self.entries[entry["gid"]] = entry
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, gid):
+        return self.entries.get(gid)
+
+    def record(self, gid, status, http_status=None, nbytes=0, elapsed=0.0):
+        """Record one download attempt and schedule the next one if needed."""
+        now = time.time()
+        with self.lock:
+            previous = self.entries.get(gid, {})
+            failures = previous.get("failures", 0) + 1 if status == "failed" else 0
+            if status == "failed":
+                next_attempt = now + min(RETRY_BACKOFF * 2 ** (failures - 1), MAX_RETRY_DELAY)
+            elif status == "missing" and gid in self.known_missing:
+                next_attempt = now + MISSING_RECHECK
+            else:
+                next_attempt = None
+            entry = {"gid": gid, "status": status, "attempts": previous.get("attempts", 0) + 1,
+                     "failures": failures, "http_status": http_status, "bytes": nbytes,
+                     "elapsed": round(elapsed, 3), "time": round(now, 3),
+                     "next_attempt": next_attempt and round(next_attempt, 3)}
+            self.entries[gid] = entry
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+        return entry
+
+    def is_due(self, gid, now=None):
+        """True unless the game is waiting out a retry or recheck delay."""
+        entry = self.entries.get(gid)
+        if entry is None or entry["next_attempt"] is None:
+            return True
+        return entry["next_attempt"] <= (now or time.time())
+
+    def pending(self, game_ids):
+        """Return the IDs of `game_ids` that may be requested now."""
+        now = time.time()
+        return [gid for gid in game_ids if self.is_due(gid, now)]
+
+    def failed(self):
+        """Return the IDs whose last attempt failed."""
+        return sorted(gid for gid, entry in self.entries.items() if entry["status"] == "failed")
+
+    def due_retries(self, before=None):
+        """Return failed IDs (below `before`, if given) whose backoff has passed."""
+        return [gid for gid in self.pending(self.failed()) if before is None or gid < before]
+
+    def due_rechecks(self):
+        """Return the known missing IDs whose recheck is due.
+
+        A game saved since it was listed as missing is no longer rechecked.
+        """
+        saved = {gid for gid, entry in self.entries.items() if entry["status"] == "saved"}
+        return self.pending(sorted(self.known_missing - saved))
+
+    def summary(self):
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+    def compact(self):
+        """Rewrite the file with only the latest line of each game."""
+        with self.lock:
+            self._file.close()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for gid in sorted(self.entries):
+                    f.write(json.dumps(self.entries[gid]) + "\n")
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        self._file.close()
+
+def print_summary(journal):
+    counts = journal.summary()
+    failed = journal.failed()
+    print(f"Journal {journal.path}: {len(journal.entries)} games, "
+          + ", ".join(f"{counts[status]} {status}" for status in sorted(counts)))
+    if failed:
+        print(f"Failed game IDs: {failed[:10]}{'...' if len(failed) > 10 else ''} "
+              f"({len(journal.due_retries())} due for retry)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or compact the download journal.")
+    parser.add_argument("command", choices=("show", "failed", "compact"))
+    parser.add_argument("journal", nargs="?", default=DEFAULT_JOURNAL)
+    parser.add_argument("gid", type=int, nargs="?", help="show one game's latest entry")
+    args = parser.parse_args()
+
+    with DownloadJournal(args.journal) as journal:
+        if args.command == "show":
+            if args.gid is not None:
+                print(json.dumps(journal.get(args.gid)))
+            else:
+                print_summary(journal)
+        elif args.command == "failed":
+            for gid in journal.failed():
+                entry = journal.get(gid)
+                print(f"{gid}\tattempts={entry['attempts']}\thttp={entry['http_status']}\t"
+                      f"next={time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['next_attempt']))}")
+        else:
+            before = os.path.getsize(args.journal)
+            journal.compact()
+            print(f"Compacted {args.journal}: {before:,} -> {os.path.getsize(args.journal):,} bytes",
+                  file=sys.stderr)
@@ -4,6 +4,7 @@
 Download new Jeopardy episodes and create a CSV that can be appended to jarchive_2023.csv
 """
 
+import argparse
 import os
 import sys
 import time
@@ -11,60 +12,183 @@ from urllib.request import urlopen
 from urllib.error import HTTPError
 import concurrent.futures as futures
 
+import metrics
+from async_download import AsyncDownloader
+from download_journal import DEFAULT_JOURNAL, DownloadJournal, print_summary
+from game_store import GameStore
+
+GAME_URL = 'http://j-archive.com/showgame.php?game_id={game_id}'
 SECONDS_BETWEEN_REQUESTS = 2  # Reduced from 5 to speed up
 ERROR_MSG = b"ERROR: No game"
 NUM_THREADS = 10  # Balanced threading
 
+# Defaults for the async engine: one global budget of requests per second
+# shared by all connections, instead of a sleep inside every thread
+REQUESTS_PER_SECOND = 1.0
+MAX_CONCURRENCY = 4
+MAX_RETRIES = 3
+
+# Game IDs that exist on j-archive.com but have not been transcribed yet
+KNOWN_MISSING_GAMES = {9161, 9165, 9172, 9181}
+# Longest run of absent IDs tail discovery will step over
+MAX_GAP = 5
+
 def download_page(game_id):
-    """Download a single game page."""
-    url = f'http://j-archive.com/showgame.php?game_id={game_id}'
+    """Download a single game page; return (HTTP status, page or None)."""
+    url = GAME_URL.format(game_id=game_id)
+    start = time.perf_counter()
+    status = html = None
     try:
         response = urlopen(url)
+        status = response.code
         if response.code == 200:
-            return response.read()
+            html = response.read()
+            metrics.count("download_bytes_total", len(html))
         else:
             print(f"Invalid response for game {game_id}")
-            return None
     except HTTPError as e:
         print(f"HTTP error for game {game_id}: {e}")
-        return None
+        status = e.code
     except Exception as e:
         print(f"Error downloading game {game_id}: {e}")
-        return None
+    metrics.observe("download_request_seconds", time.perf_counter() - start)
+    metrics.count("download_responses_total", status=status or "error")
+    return status, html
+
+def is_downloaded(game_id, output_dir, store=None):
+    if store is not None:
+        return game_id in store
+    return os.path.exists(os.path.join(output_dir, f"{game_id}.html"))
+
+def download_and_save(game_id, output_dir, store=None, journal=None):
+    """Download and save a game (into `store` if given), return True if successful.
+
+    With a `DownloadJournal`, every request is recorded in it.
+    """
+    return fetch_game(game_id, output_dir, store, journal) in ("exists", "saved")
 
-def download_and_save(game_id, output_dir):
-    """Download and save a game, return True if successful."""
+def fetch_game(game_id, output_dir, store=None, journal=None):
+    """Download and save a game; return "exists", "saved", "missing" or "failed"."""
     filepath = os.path.join(output_dir, f"{game_id}.html")
     
     # Skip if already downloaded
-    if os.path.exists(filepath):
-        return True
+    if is_downloaded(game_id, output_dir, store):
+        return "exists"
     
-    html = download_page(game_id)
+    start = time.perf_counter()
+    status, html = download_page(game_id)
+    
+    def record(outcome):
+        if journal is not None:
+            journal.record(game_id, outcome, status, len(html) if html else 0,
+                           time.perf_counter() - start)
     
     if html is None:
-        return False
+        record("failed")
+        return "failed"
     
     if ERROR_MSG in html:
         print(f"Game {game_id} does not exist (reached end)")
-        return False
+        record("missing")
+        return "missing"
     
     # Save the file
     try:
-        with open(filepath, 'wb') as f:
-            f.write(html)
+        if store is not None:
+            store.put(game_id, html)
+        else:
+            with open(filepath, 'wb') as f:
+                f.write(html)
         print(f"Downloaded game {game_id}")
+        record("saved")
         time.sleep(SECONDS_BETWEEN_REQUESTS)
-        return True
+        metrics.count("download_sleep_seconds_total", SECONDS_BETWEEN_REQUESTS)
+        return "saved"
     except IOError as e:
         print(f"Error saving game {game_id}: {e}")
-        return False
+        record("failed")
+        return "failed"
+
+def discover_latest_game(last_known, output_dir, max_gap=MAX_GAP, store=None, journal=None,
+                         retries=MAX_RETRIES):
+    """Find the newest game ID on the site after `last_known`.
 
-def download_range(start_id, end_id, output_dir):
-    """Download a range of games."""
+    Probes `last_known + 1, + 2, + 4, ...` until a probe fails, then binary
+    searches between the last hit and the miss. A probe of ID `n` succeeds if
+    any of `n .. n + max_gap - 1` exists, so short runs of untranscribed games
+    do not end the search early. Pages found while probing are saved to
+    `output_dir` (or `store`) so they are not requested again. A probe that
+    fails (network, HTTP or disk error) rather than finding the "no game"
+    page is retried `retries` times; if it still fails an IOError is raised,
+    since an outage would otherwise end the search early.
+
+    Returns the newest game ID (`last_known` if there is nothing new) and the
+    set of IDs that were seen not to exist.
+    """
     os.makedirs(output_dir, exist_ok=True)
+    seen = {}
+    
+    def exists(game_id):
+        if game_id not in seen:
+            if game_id in KNOWN_MISSING_GAMES:
+                seen[game_id] = "missing"
+            else:
+                outcome = fetch_game(game_id, output_dir, store, journal)
+                for attempt in range(retries):
+                    if outcome != "failed":
+                        break
+                    time.sleep(SECONDS_BETWEEN_REQUESTS * 2 ** attempt)
+                    outcome = fetch_game(game_id, output_dir, store, journal)
+                if outcome == "failed":
+                    raise IOError(f"cannot tell whether game {game_id} exists")
+                seen[game_id] = outcome
+        return seen[game_id] != "missing"
     
-    total = end_id - start_id + 1
+    def probe(game_id):
+        return any(exists(gid) for gid in range(game_id, game_id + max_gap))
+    
+    low, step = last_known, 1
+    while probe(low + step):
+        low += step
+        step *= 2
+    high = low + step
+    
+    while high - low > 1:
+        mid = (low + high) // 2
+        if probe(mid):
+            low = mid
+        else:
+            high = mid
+    
+    # probe(low) hit and probe(low + 1) missed, so `low` itself exists
+    latest = low
+    absent = {gid for gid, outcome in seen.items() if outcome == "missing" and gid <= latest}
+    print(f"Discovered newest game {latest} after probing {len(seen)} game IDs")
+    return latest, absent
+
+def scheduled_ids(game_ids, start_id, journal=None):
+    """Return the IDs to request: `game_ids` plus any journal retries and rechecks."""
+    if journal is None:
+        return list(game_ids)
+    retries = journal.due_retries(before=start_id)
+    rechecks = [gid for gid in journal.due_rechecks() if gid < start_id]
+    if retries or rechecks:
+        print(f"Retrying {len(retries)} failed and rechecking {len(rechecks)} missing games "
+              f"from earlier runs")
+    return sorted(set(retries) | set(rechecks)) + journal.pending(game_ids)
+
+def download_range(start_id, end_id, output_dir, game_ids=None, store=None, journal=None):
+    """Download a range of games, or just `game_ids` from it if given.
+
+    With a `DownloadJournal`, games waiting out a retry delay are skipped and
+    failed games from earlier runs whose delay has passed are retried.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    
+    if game_ids is None:
+        game_ids = range(start_id, end_id + 1)
+    game_ids = scheduled_ids(game_ids, start_id, journal)
+    total = len(game_ids)
     completed = 0
     failed = []
     
@@ -76,8 +200,8 @@ def download_range(start_id, end_id, output_dir):
     with futures.ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
         # Submit all jobs
         future_to_id = {
-            executor.submit(download_and_save, gid, output_dir): gid 
-            for gid in range(start_id, end_id + 1)
+            executor.submit(download_and_save, gid, output_dir, store, journal): gid 
+            for gid in game_ids
         }
         
         # Process as they complete
@@ -105,14 +229,102 @@ def download_range(start_id, end_id, output_dir):
     
     return completed, failed
 
-if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python download_new_episodes.py <output_dir> <start_id> <end_id>")
-        print("Example: python download_new_episodes.py new_games_2024 7291 9425")
-        sys.exit(1)
+def download_range_async(start_id, end_id, output_dir, rate=REQUESTS_PER_SECOND,
+                         concurrency=MAX_CONCURRENCY, retries=MAX_RETRIES, url_template=GAME_URL,
+                         game_ids=None, store=None, journal=None):
+    """Download a range of games with the asyncio engine."""
+    os.makedirs(output_dir, exist_ok=True)
+    
+    if game_ids is None:
+        game_ids = range(start_id, end_id + 1)
+    game_ids = scheduled_ids(game_ids, start_id, journal)
+    total = len(game_ids)
+    completed = 0
+    
+    print(f"Downloading games {start_id} to {end_id} ({total} total)")
+    print(f"Using async engine: {concurrency} connections, {rate} requests/sec, {retries} retries")
+    print(f"Estimated time: ~{total / (rate * 60):.1f} minutes")
+    print("-" * 60)
+    
+    def on_result(game_id, outcome):
+        nonlocal completed
+        if outcome in ("saved", "exists"):
+            completed += 1
+            if completed % 50 == 0:
+                print(f"Progress: {completed}/{total} completed ({completed/total*100:.1f}%)")
+    
+    downloader = AsyncDownloader(url_template, rate=rate, concurrency=concurrency,
+                                 retries=retries, error_msg=ERROR_MSG, store=store,
+                                 journal=journal)
+    results = downloader.download(game_ids, output_dir, on_result)
+    failed = sorted(gid for gid, outcome in results.items() if outcome in ("missing", "failed"))
+    
+    print("-" * 60)
+    print(f"Download complete!")
+    print(f"Successfully downloaded: {completed}")
+    print(f"Failed: {len(failed)}")
+    if failed:
+        print(f"Failed game IDs: {failed[:10]}{'...' if len(failed) > 10 else ''}")
     
-    output_dir = sys.argv[1]
-    start_id = int(sys.argv[2])
-    end_id = int(sys.argv[3])
+    return completed, failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download J! Archive game pages.",
+        epilog="Example: python download_new_episodes.py new_games_2024 7291 9425")
+    parser.add_argument("output_dir", help="directory to save <gid>.html files into")
+    parser.add_argument("start_id", type=int, help="first game ID to download")
+    parser.add_argument("end_id", help="last game ID to download, or 'auto' to discover "
+                                       "the newest game on the site")
+    parser.add_argument("--engine", choices=("threads", "async"), default="threads",
+                        help="download engine (default: threads)")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND,
+                        help="async engine: requests per second across all connections")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY,
+                        help="async engine: maximum concurrent requests")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES,
+                        help="async engine: retries for 5xx responses and timeouts; "
+                             "discovery: retries of a failed probe")
+    parser.add_argument("--url-template", default=GAME_URL,
+                        help="game URL with a {game_id} placeholder (e.g. a local test server)")
+    parser.add_argument("--store", metavar="PATH",
+                        help="save the pages into this compressed game store instead of output_dir")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL, metavar="<file>",
+                        help="download journal used to resume and retry (default: %(default)s)")
+    parser.add_argument("--no-journal", action="store_true", help="do not read or write a journal")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
     
-    download_range(start_id, end_id, output_dir)
+    GAME_URL = args.url_template
+    store = GameStore(args.store) if args.store else None
+    journal = None if args.no_journal else DownloadJournal(args.journal, KNOWN_MISSING_GAMES)
+    with metrics.instrumented(args):
+        game_ids = None
+        if args.end_id == "auto":
+            with metrics.span("discover"):
+                try:
+                    end_id, absent = discover_latest_game(args.start_id - 1, args.output_dir, store=store,
+                                                          journal=journal, retries=args.retries)
+                except IOError as e:
+                    sys.exit(f"Discovery failed: {e}")
+            if end_id < args.start_id:
+                print("No new games found")
+                if journal is None or not (journal.due_retries(args.start_id) or journal.due_rechecks()):
+                    sys.exit(0)
+                end_id = args.start_id - 1
+            game_ids = [gid for gid in range(args.start_id, end_id + 1) if gid not in absent]
+        else:
+            end_id = int(args.end_id)
+        
+        with metrics.span("download", engine=args.engine):
+            if args.engine == "async":
+                download_range_async(args.start_id, end_id, args.output_dir, args.rate,
+                                     args.concurrency, args.retries, args.url_template, game_ids, store,
+                                     journal)
+            else:
+                download_range(args.start_id, end_id, args.output_dir, game_ids, store, journal)
+    if store is not None:
+        store.close()
+    if journal is not None:
+        print_summary(journal)
+        journal.close()
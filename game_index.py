@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Game index of jarchive.csv: where each game's rows are and how its board is laid out
+
+The archive keeps every game's rows together, in game ID order. The index
+holds one record per game (game ID, airdate, byte offset and length of its
+rows) and one per category of each round (round, board column and the row
+numbers of its clues within the game, stored CSR-style in `category_rows`,
+with the board row of each clue in `category_cells`), so a game is loaded
+with a single read of its own bytes and its board is rebuilt without
+parsing anything else.
+
+The parser writes each round row by row across the categories but leaves
+out clues that were never revealed, so the layout is worked out when a game
+is indexed. A category's clues are in top-to-bottom order; each is placed
+on the board row whose value (on the standard value ladder of its round)
+matches, leaving blank cells where clues are missing. The columns are then
+ordered so that, on every board row, clues come in the order they were
+written.
+
+The metadata file records the archive size, modification time and a sha256
+of the bytes indexed, so an update can tell an appended archive (index just
+the new games) from a rewritten one (index it again).
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import random
+import sys
+import time
+from array import array
+
+import numpy as np
+
+from archive_format import BATCH_BYTES, parse_line, parse_value
+
+DEFAULT_INDEX = "jarchive_games.npz"
+# Bumped when the index layout changes, so older indexes are rebuilt
+FORMAT = 2
+BOARD_ROWS = 5
+# Board values of rounds 1 and 2, top to bottom: since 2001 and before
+LADDERS = {1: ((200, 400, 600, 800, 1000), (100, 200, 300, 400, 500)),
+           2: ((400, 800, 1200, 1600, 2000), (200, 400, 600, 800, 1000))}
+GAME_DTYPE = np.dtype([('gid', '<i4'), ('airdate', '<i4'), ('offset', '<i8'), ('length', '<i4'),
+                       ('rows', '<i2'), ('first_category', '<i4'), ('categories', '<i2')])
+CATEGORY_DTYPE = np.dtype([('rnd', '<i1'), ('column', '<i1'), ('rows_start', '<i4'), ('rows_count', '<i2')])
+
+def _meta_path(index_path):
+    return os.path.splitext(index_path)[0] + ".json"
+
+def _prefix_sha256(path, size):
+    """Return the sha256 of the first `size` bytes of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        remaining = size
+        while remaining > 0:
+            block = f.read(min(1 << 20, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+def _airdate_number(airdate):
+    """Return an airdate as YYYYMMDD, 0 if it is not a date."""
+    digits = airdate.replace("-", "")
+    return int(digits) if len(airdate) == 10 and len(digits) == 8 and digits.isdigit() else 0
+
+def _board_rows(values, ladder):
+    """Return increasing board rows for a category's values, matching the ladder where possible.
+
+    Values that are not on the ladder (Daily Double wagers) may sit on any
+    row; without a ladder, or with more clues than rows, clues fill the
+    rows from the top.
+    """
+    if not ladder or len(values) > len(ladder):
+        return list(range(len(values)))
+    best, best_matches = None, -1
+    for rows in itertools.combinations(range(len(ladder)), len(values)):
+        matches = sum(ladder[row] == value for row, value in zip(rows, values))
+        if matches > best_matches:
+            best, best_matches = list(rows), matches
+    return best
+
+def layout_round(rnd, clues):
+    """Lay out the clues of one round on the board.
+
+    `clues` are (category, value) in archive order. Returns, in column
+    order, (category, [(index into `clues`, board row), ...]) per category.
+    """
+    categories = {}
+    for i, (category, value) in enumerate(clues):
+        categories.setdefault(category, []).append((i, parse_value(value)))
+    values = [parse_value(value) for _, value in clues]
+    ladder = max(LADDERS.get(rnd, ()), key=lambda ladder: sum(value in ladder for value in values),
+                 default=None)
+    cells = {category: list(zip([i for i, _ in items], _board_rows([v for _, v in items], ladder)))
+             for category, items in categories.items()}
+
+    # A category goes left of another if on some board row its clue was written first
+    by_row = {}
+    for category, items in cells.items():
+        for i, row in items:
+            by_row.setdefault(row, []).append((i, category))
+    right_of = {category: set() for category in categories}
+    for written in by_row.values():
+        written.sort()
+        for n, (_, left) in enumerate(written):
+            right_of[left].update(right for _, right in written[n + 1:])
+    order = []
+    waiting = list(categories)
+    while waiting:
+        # The first written of the categories with nothing left of them (or
+        # of all of them, if the rows contradict each other)
+        ready = [c for c in waiting if not any(c in right_of[o] for o in waiting if o != c)] or waiting
+        order.append(ready[0])
+        waiting.remove(ready[0])
+    return [(category, cells[category]) for category in order]
+
+def _scan(archive_path, start, first_category, first_row):
+    """Index the games of an archive from byte `start` on.
+
+    Returns (games, categories, category rows, category cells) as lists of
+    columns, with category numbers and row starts continuing from
+    `first_category` and `first_row`.
+    """
+    games = {name: array(code) for name, code in
+             (('gid', 'i'), ('airdate', 'i'), ('offset', 'q'), ('length', 'i'), ('rows', 'h'),
+              ('first_category', 'i'), ('categories', 'h'))}
+    categories = {name: array(code) for name, code in
+                  (('rnd', 'b'), ('column', 'b'), ('rows_start', 'i'), ('rows_count', 'h'))}
+    category_rows = array('h')
+    category_cells = array('b')
+    # (round, category, value) of each row of the open game
+    clues = []
+
+    def finish_game(end):
+        """Close the open game at byte `end`: record it and the rows of its categories."""
+        games['length'].append(end - games['offset'][-1])
+        rounds = {}
+        for row, (rnd, category, value) in enumerate(clues):
+            rounds.setdefault(rnd, []).append((row, category, value))
+        count = 0
+        for rnd, round_clues in sorted(rounds.items()):
+            layout = layout_round(rnd, [(category, value) for _, category, value in round_clues])
+            for column, (_, cells) in enumerate(layout):
+                categories['rnd'].append(rnd)
+                categories['column'].append(column)
+                categories['rows_start'].append(first_row + len(category_rows))
+                categories['rows_count'].append(len(cells))
+                category_rows.extend(round_clues[i][0] for i, _ in cells)
+                category_cells.extend(board_row for _, board_row in cells)
+            count += len(layout)
+        games['categories'].append(count)
+        clues.clear()
+
+    with open(archive_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        gid = None
+        offset = end_of_game = start
+        while offset < size:
+            end = mm.find(b"\n", min(offset + BATCH_BYTES, size - 1))
+            end = size if end < 0 else end + 1
+            for line in mm[offset:end].split(b"\n"):
+                fields = parse_line(line.decode('utf-8'))
+                if fields is not None:
+                    if int(fields[0]) != gid:
+                        if gid is not None:
+                            finish_game(end_of_game)
+                        gid = int(fields[0])
+                        games['gid'].append(gid)
+                        games['airdate'].append(_airdate_number(fields[1]))
+                        games['offset'].append(offset)
+                        games['rows'].append(0)
+                        games['first_category'].append(first_category + len(categories['rnd']))
+                    rnd = int(fields[2]) if fields[2].isdigit() else 0
+                    clues.append((rnd, fields[3], fields[4]))
+                    games['rows'][-1] += 1
+                    end_of_game = offset + len(line) + 1
+                offset += len(line) + 1
+            offset = end
+        if gid is not None:
+            finish_game(min(end_of_game, size))
+    return games, categories, category_rows, category_cells
+
+def _to_arrays(columns, dtype):
+    records = np.empty(len(next(iter(columns.values()))), dtype=dtype)
+    for name, values in columns.items():
+        records[name] = np.frombuffer(values, dtype=values.typecode) if values else []
+    return records
+
+def _save(index_path, archive_path, games, categories, category_rows, category_cells):
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, games=games, categories=categories, category_rows=category_rows,
+                 category_cells=category_cells)
+    stat = os.stat(archive_path)
+    with open(_meta_path(index_path), 'w', encoding='utf-8') as f:
+        json.dump({"format": FORMAT, "games": len(games), "archive_size": stat.st_size,
+                   "archive_mtime_ns": stat.st_mtime_ns,
+                   "archive_sha256": _prefix_sha256(archive_path, stat.st_size)}, f)
+    os.replace(tmp_path, index_path)
+
+def _numpy(values, dtype):
+    return np.frombuffer(values, dtype=dtype) if values else np.zeros(0, dtype)
+
+def build(archive_path, index_path=DEFAULT_INDEX):
+    """Index every game of an archive; return the number of games."""
+    games, categories, category_rows, category_cells = _scan(archive_path, 0, 0, 0)
+    games = _to_arrays(games, GAME_DTYPE)
+    if np.any(np.diff(games['gid']) <= 0):
+        raise ValueError(f"{archive_path} is not in game ID order with each game's rows together")
+    _save(index_path, archive_path, games, _to_arrays(categories, CATEGORY_DTYPE),
+          _numpy(category_rows, np.int16), _numpy(category_cells, np.int8))
+    return len(games)
+
+def is_fresh(index_path, archive_path):
+    """Return True if the index exists and was built from the archive as it is now."""
+    try:
+        with open(_meta_path(index_path), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        stat = os.stat(archive_path)
+        return os.path.exists(index_path) and meta.get("format") == FORMAT and \
+            meta["archive_size"] == stat.st_size and meta["archive_mtime_ns"] == stat.st_mtime_ns
+    except (IOError, ValueError, KeyError):
+        return False
+
+def update(archive_path, index_path=DEFAULT_INDEX):
+    """Bring the index up to date with the archive; return the number of games indexed.
+
+    Games appended after the indexed bytes are added to the index; if those
+    bytes changed, the archive is not in game ID order or the index has an
+    older format, it is rebuilt.
+    """
+    if is_fresh(index_path, archive_path):
+        return 0
+    try:
+        with open(_meta_path(index_path), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("format") != FORMAT:
+            return build(archive_path, index_path)
+        data = np.load(index_path)
+        old_games, old_categories = data['games'], data['categories']
+        old_rows, old_cells = data['category_rows'], data['category_cells']
+    except (IOError, ValueError, KeyError):
+        return build(archive_path, index_path)
+    size = meta["archive_size"]
+    if os.path.getsize(archive_path) < size or _prefix_sha256(archive_path, size) != meta["archive_sha256"]:
+        return build(archive_path, index_path)
+
+    games, categories, category_rows, category_cells = _scan(archive_path, size, len(old_categories),
+                                                             len(old_rows))
+    games = _to_arrays(games, GAME_DTYPE)
+    gids = np.concatenate([old_games['gid'][-1:], games['gid']])
+    if np.any(np.diff(gids) <= 0):
+        return build(archive_path, index_path)
+    _save(index_path, archive_path, np.concatenate([old_games, games]),
+          np.concatenate([old_categories, _to_arrays(categories, CATEGORY_DTYPE)]),
+          np.concatenate([old_rows, _numpy(category_rows, np.int16)]),
+          np.concatenate([old_cells, _numpy(category_cells, np.int8)]))
+    return len(games)
+
+class GameIndex:
+    """Games of the archive by game ID, each loaded with one read."""
+
+    def __init__(self, index_path=DEFAULT_INDEX, archive_path="jarchive.csv"):
+        data = np.load(index_path)
+        self.games = data['games']
+        self.categories = data['categories']
+        self.category_rows = data['category_rows']
+        self.category_cells = data['category_cells']
+        self.archive_path = archive_path
+
+    def __len__(self):
+        return len(self.games)
+
+    def __contains__(self, gid):
+        i = np.searchsorted(self.games['gid'], gid)
+        return i < len(self.games) and self.games['gid'][i] == gid
+
+    def _game(self, gid):
+        i = np.searchsorted(self.games['gid'], gid)
+        if i == len(self.games) or self.games['gid'][i] != gid:
+            raise KeyError(f"game {gid} is not in the archive")
+        return self.games[i]
+
+    def gids(self, airdate=None):
+        """Return the game IDs, or those of games that aired on `airdate` (YYYY-MM-DD)."""
+        if airdate is None:
+            return self.games['gid']
+        return self.games['gid'][self.games['airdate'] == _airdate_number(airdate)]
+
+    def airdate(self, gid):
+        """Return the airdate of a game as YYYY-MM-DD, None if it has none."""
+        airdate = int(self._game(gid)['airdate'])
+        return f"{airdate // 10000:04}-{airdate // 100 % 100:02}-{airdate % 100:02}" if airdate else None
+
+    def random_gid(self, rng=random):
+        return int(self.games['gid'][rng.randrange(len(self.games))])
+
+    def rows(self, gid):
+        """Return the fields of every row of a game, in archive order."""
+        game = self._game(gid)
+        offset, length = int(game['offset']), int(game['length'])
+        with open(self.archive_path, 'rb') as f:
+            # With the byte before it, to check that the range starts and ends on a line break
+            f.seek(max(offset - 1, 0))
+            data = f.read(length + min(offset, 1))
+            at_end = not f.read(1)
+        lines = data.decode('utf-8').split("\n")
+        if offset:
+            if lines[0]:
+                raise ValueError(f"{self.archive_path} does not match the game index; update it")
+            lines = lines[1:]
+        rows = [fields for fields in map(parse_line, lines) if fields is not None]
+        if not (data.endswith(b"\n") or at_end) or len(rows) != game['rows'] or \
+                parse_line(lines[0]) is None or int(rows[0][0]) != gid:
+            raise ValueError(f"{self.archive_path} does not match the game index; update it")
+        return rows
+
+    def board(self, gid):
+        """Return {round: [(category, [row fields, top to bottom]), ...] in column order}.
+
+        The cells of rounds 1 and 2 have at least BOARD_ROWS rows; a clue that
+        is missing from the archive is None.
+        """
+        game = self._game(gid)
+        rows = self.rows(gid)
+        board = {}
+        first = int(game['first_category'])
+        for category in self.categories[first:first + int(game['categories'])]:
+            start = int(category['rows_start'])
+            end = start + int(category['rows_count'])
+            placed = dict(zip(self.category_cells[start:end].tolist(),
+                              (rows[i] for i in self.category_rows[start:end])))
+            board.setdefault(int(category['rnd']), []).append(
+                (next(iter(placed.values()))[3], placed))
+        for rnd, columns in board.items():
+            height = max(max(placed) + 1 for _, placed in columns)
+            if rnd in LADDERS:
+                height = max(height, BOARD_ROWS)
+            board[rnd] = [(category, [placed.get(row) for row in range(height)])
+                          for category, placed in columns]
+        return board
+
+def print_board(board):
+    for rnd, columns in sorted(board.items()):
+        print(f"Round {rnd}:")
+        for category, clues in columns:
+            print(f"  {category} ({sum(clue is not None for clue in clues)} clues)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, update or query the game index of the archive.")
+    parser.add_argument("command", choices=("build", "update", "show"))
+    parser.add_argument("archive", nargs="?", default="jarchive.csv")
+    parser.add_argument("-i", "--index", default=DEFAULT_INDEX, help="index file (default: %(default)s)")
+    parser.add_argument("-g", "--gid", type=int, help="game to show (default: a random one)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "build":
+        games = build(args.archive, args.index)
+        print(f"Indexed {games:,} games of {args.archive} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    elif args.command == "update":
+        games = update(args.archive, args.index)
+        print(f"Indexed {games:,} games in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    else:
+        if not is_fresh(args.index, args.archive):
+            print(f"{args.index} is missing or older than {args.archive}; run `update` first", file=sys.stderr)
+            sys.exit(1)
+        index = GameIndex(args.index, args.archive)
+        opened = time.perf_counter()
+        gid = args.gid if args.gid is not None else index.random_gid()
+        board = index.board(gid)
+        loaded = time.perf_counter()
+        print(f"Game {gid}, aired {index.airdate(gid)}")
+        print_board(board)
+        print(f"Opened index in {(opened - start) * 1e3:.1f} ms, loaded board in {(loaded - opened) * 1e3:.2f} ms",
+              file=sys.stderr)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compressed, content-addressed store of raw game pages
+
+A store is two files next to each other:
+
+* `<name>.pack` - zlib-compressed page bodies, appended one after another.
+  Identical pages are stored once (keyed by their sha256).
+* `<name>.idx` - fixed-size records of (gid, offset, compressed length,
+  raw length, sha256). Records are only ever appended; the last record for
+  a gid wins.
+
+Reads go through an mmap of the pack file, so random access by gid only
+decompresses the requested page.
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from glob import glob
+
+RECORD = struct.Struct("<IQII32s")
+COMPRESSION_LEVEL = 6
+
+class GameStore:
+    """Append-only pack of compressed game pages with a gid index."""
+
+    def __init__(self, path):
+        # Accept either the bare store name or one of its files
+        root, ext = os.path.splitext(path)
+        self.path = root if ext in (".pack", ".idx") else path
+        self.pack_path = self.path + ".pack"
+        self.idx_path = self.path + ".idx"
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(self.pack_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open(self):
+        self.entries = {}
+        self.blobs = {}
+        self._map = None
+        self._map_size = 0
+        self._pack = open(self.pack_path, "ab+")
+        self._idx = open(self.idx_path, "ab+")
+        self._idx.seek(0)
+        data = self._idx.read()
+        # Ignore a partially written trailing record
+        usable = len(data) - len(data) % RECORD.size
+        for gid, offset, length, raw_length, digest in RECORD.iter_unpack(data[:usable]):
+            self.entries[gid] = (offset, length, raw_length, digest)
+            self.blobs[digest] = (offset, length, raw_length)
+
+    def __contains__(self, gid):
+        return gid in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def gids(self):
+        """Return the stored game IDs in ascending order."""
+        return sorted(self.entries)
+
+    def digest(self, gid):
+        """Return the sha256 hex digest of a stored page."""
+        return self.entries[gid][3].hex()
+
+    def put(self, gid, html):
+        """Store a page; return False if the gid already had identical content."""
+        digest = hashlib.sha256(html).digest()
+        with self.lock:
+            entry = self.entries.get(gid)
+            if entry is not None and entry[3] == digest:
+                return False
+            blob = self.blobs.get(digest)
+            if blob is None:
+                data = zlib.compress(html, COMPRESSION_LEVEL)
+                self._pack.seek(0, os.SEEK_END)
+                offset = self._pack.tell()
+                self._pack.write(data)
+                self._pack.flush()
+                blob = (offset, len(data), len(html))
+                self.blobs[digest] = blob
+            # The index record is written after its data, so a crash never
+            # leaves the index pointing at a missing page
+            self._idx.write(RECORD.pack(gid, *blob, digest))
+            self._idx.flush()
+            self.entries[gid] = blob + (digest,)
+            return True
+
+    def get(self, gid):
+        """Return the decompressed page of a game; raises KeyError if absent."""
+        offset, length, raw_length, digest = self.entries[gid]
+        with self.lock:
+            if offset + length > self._map_size:
+                self._remap()
+            data = self._map[offset:offset + length]
+        return zlib.decompress(data, bufsize=raw_length)
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+        self._pack.flush()
+        self._map_size = os.path.getsize(self.pack_path)
+        self._map = mmap.mmap(self._pack.fileno(), self._map_size, access=mmap.ACCESS_READ)
+
+    def stats(self):
+        pack_size = os.path.getsize(self.pack_path)
+        raw_size = sum(entry[2] for entry in self.entries.values())
+        return {"games": len(self.entries), "blobs": len(self.blobs),
+                "pack_bytes": pack_size, "raw_bytes": raw_size}
+
+    def compact(self):
+        """Rewrite the pack and index keeping only the current page of each gid.
+
+        Returns the number of bytes reclaimed.
+        """
+        before = os.path.getsize(self.pack_path)
+        tmp = GameStore(self.path + ".compact")
+        for gid in self.gids():
+            tmp.put(gid, self.get(gid))
+        tmp.close()
+        self.close()
+        os.replace(tmp.pack_path, self.pack_path)
+        os.replace(tmp.idx_path, self.idx_path)
+        self._open()
+        return before - os.path.getsize(self.pack_path)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._map_size = 0
+        self._pack.close()
+        self._idx.close()
+
+def import_directory(store, input_dir):
+    """Add every `<gid>.html` file of a directory to the store; return how many changed."""
+    added = 0
+    for filepath in glob(os.path.join(input_dir, "*.html")):
+        gid = int(os.path.basename(filepath).replace('.html', ''))
+        with open(filepath, 'rb') as f:
+            added += store.put(gid, f.read())
+    return added
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage a compressed game page store.")
+    parser.add_argument("store", help="the store name (without .pack/.idx)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_cmd = commands.add_parser("import", help="add the <gid>.html files of a directory")
+    import_cmd.add_argument("input_dir")
+    get_cmd = commands.add_parser("get", help="write one game's page to stdout")
+    get_cmd.add_argument("gid", type=int)
+    export_cmd = commands.add_parser("export", help="write every page to <dir>/<gid>.html")
+    export_cmd.add_argument("output_dir")
+    commands.add_parser("stats", help="show the number of games and sizes")
+    commands.add_parser("compact", help="drop superseded pages from the pack")
+    args = parser.parse_args()
+
+    with GameStore(args.store) as store:
+        if args.command == "import":
+            print(f"Stored {import_directory(store, args.input_dir)} new or changed games",
+                  file=sys.stderr)
+        elif args.command == "get":
+            sys.stdout.buffer.write(store.get(args.gid))
+        elif args.command == "export":
+            os.makedirs(args.output_dir, exist_ok=True)
+            for gid in store.gids():
+                with open(os.path.join(args.output_dir, f"{gid}.html"), 'wb') as f:
+                    f.write(store.get(gid))
+        elif args.command == "compact":
+            print(f"Reclaimed {store.compact():,} bytes", file=sys.stderr)
+        if args.command in ("import", "stats", "compact"):
+            stats = store.stats()
+            print(f"{stats['games']} games, {stats['raw_bytes'] / 1e6:.1f} MB of pages in "
+                  f"{stats['pack_bytes'] / 1e6:.1f} MB", file=sys.stderr)
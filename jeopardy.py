@@ -1,8 +1,31 @@
-import pandas as pd
+import numpy as np
+import argparse
+import datetime
+import itertools
+import random
 import re
+import resource
+import sys
 import time
 import os
 
+import archive_format
+import clue_sampler
+import columnar_archive
+import game_index
+import sharded_archive
+
+ARCHIVE_CSV = 'jarchive.csv'
+ARCHIVE_COLUMNAR = 'jarchive.parquet'
+ARCHIVE_SHARDS = 'jarchive_shards'
+ARCHIVE_OFFSETS = 'jarchive_offsets.npy'
+ARCHIVE_GAMES = 'jarchive_games.npz'
+
+UNPLAYABLE_TEXT = archive_format.UNPLAYABLE_TEXT
+UNPLAYABLE_ANSWER = archive_format.UNPLAYABLE_ANSWER
+# Points for clues without a preset value (Final Jeopardy and missing values)
+DEFAULT_VALUE = 100
+
 ### https://gist.github.com/scotta/1063364
 ### based on: http://www.catalysoft.com/articles/StrikeAMatch.html
 ### similar projects: https://pypi.org/project/Fuzzy/
@@ -93,35 +116,149 @@ def compare_strings(string1, string2):
 
     return (2.0 * intersection_count) / (s1_size + s2_size)
     
+PARENTHETICAL_RE = re.compile(r"\([^()]*\)")
+PUNCTUATION_RE = re.compile(r"[^\w\s]")
+ARTICLE_RE = re.compile(r"^(the|a|an)\s+", re.I)
+
 def sanitize(string):
-    string = re.sub(r"/[^\w\s]/i", "", string)
-    string = re.sub(r"\([^()]*\)", "", string)
-    string = re.sub(r"/^(the|a|an) /i", "", string)
+    """Normalize a response or answer before comparing them.
+    >>> sanitize("(Mount) Everest")
+    'everest'
+    >>> sanitize("The Men\\'s Room!")
+    'mens room'
+    """
+    # Parentheticals go first, before their brackets are stripped as punctuation
+    string = PARENTHETICAL_RE.sub("", string)
+    string = PUNCTUATION_RE.sub("", string)
+    string = ARTICLE_RE.sub("", string.strip())
     string = string.strip().lower()
     return string
     
-def read_jarchive():
-    df = pd.read_csv('jarchive.csv', sep='\|\|', engine='python', names=['gid', 'airdate', 'rnd', 'category', 'value', 'text', 'answer'])
-    df = df[df.text != ' = ']
-    df = df[df.answer != ' = ']
-    df = df[df.text != ' ? ']
-    return df
+def _read_playable(csv_path, years=None):
+    """Return the columns of the playable clues of an archive file.
 
-def get_one_question(df):
-    row = df.sample(n=1)
-    category = row['category'].iloc[0]
-    value = row['value'].iloc[0]
+    gid, rnd and value come back as NumPy integer arrays, the rest as lists
+    of strings.
+    """
+    reader = archive_format.Reader(csv_path)
+    columns = {name: [] for name in archive_format.COLUMNS}
+    numbers = {}
+    for batch in reader.column_batches():
+        gids, airdates, rnds, categories, values, texts, answers = batch
+        if years is None:
+            keep = [text not in UNPLAYABLE_TEXT and answer not in UNPLAYABLE_ANSWER
+                    for text, answer in zip(texts, answers)]
+        else:
+            keep = [text not in UNPLAYABLE_TEXT and answer not in UNPLAYABLE_ANSWER
+                    and airdate[:4].isdigit() and int(airdate[:4]) in years
+                    for text, answer, airdate in zip(texts, answers, airdates)]
+        if not all(keep):
+            batch = [list(itertools.compress(column, keep)) for column in batch]
         
-    if (value == ''):
-        value = 100
+        for name, column in zip(archive_format.COLUMNS, batch):
+            if name in ('gid', 'rnd', 'value'):
+                # Few distinct strings, so each is converted once
+                for number in set(column).difference(numbers):
+                    numbers[number] = archive_format.parse_value(number)
+                columns[name].append(np.fromiter(map(numbers.__getitem__, column), np.int64, len(column)))
+            elif name in ('airdate', 'category'):
+                # Interning shares one string object per distinct airdate and category
+                columns[name].extend(map(sys.intern, column))
+            else:
+                columns[name].extend(column)
+    if reader.skipped:
+        print(f"Skipped {reader.skipped:,} malformed rows in {csv_path}", file=sys.stderr)
+    
+    for name, dtype in (('gid', np.int32), ('rnd', np.int8), ('value', np.int32)):
+        columns[name] = np.concatenate(columns[name]).astype(dtype) if columns[name] else np.zeros(0, dtype)
+    return columns
+
+def read_jarchive(csv_path=ARCHIVE_CSV, columnar_path=ARCHIVE_COLUMNAR, shard_dir=ARCHIVE_SHARDS,
+                  years=None, workers=None):
+    """Load the playable clues, optionally only those that aired in `years`.
+
+    gid, rnd and value are integers (value 0 meaning no preset value),
+    airdate is a datetime and category is categorical. Unplayable rows are
+    dropped while reading, so no filtered copies of the frame are made.
+    From year shards only the shards of `years` are read, `workers` at a
+    time in parallel (default: one per CPU), and rows come in shard order.
+    """
+    # pandas is imported here so that playing from the offset index starts without it
+    import pandas as pd
+
+    # Prefer the typed columnar copy when it is installed and up to date
+    if columnar_path and columnar_archive.available() and columnar_archive.is_fresh(columnar_path, csv_path):
+        filters = [('text', 'not in', UNPLAYABLE_TEXT), ('answer', 'not in', UNPLAYABLE_ANSWER)]
+        if years is not None:
+            filters = [filters + [('airdate', '>=', datetime.date(year, 1, 1)),
+                                  ('airdate', '<=', datetime.date(year, 12, 31))] for year in sorted(years)]
+        return columnar_archive.load(columnar_path, filters=filters)
+    
+    manifest = os.path.join(shard_dir, sharded_archive.MANIFEST) if shard_dir else None
+    if manifest and columnar_archive.is_fresh(manifest, csv_path):
+        paths = sharded_archive.shard_paths(shard_dir, years)
+        parts = sharded_archive.map_shards(_read_playable, paths, workers)
+        columns = {name: np.concatenate([part[name] for part in parts]) if parts and name in ('gid', 'rnd', 'value')
+                   else [value for part in parts for value in part[name]]
+                   for name in archive_format.COLUMNS}
     else:
-        value = value.replace(',','')
-        value = int(value)
-        
-    question = row['text'].iloc[0]
-    answer = row['answer'].iloc[0]
+        columns = _read_playable(csv_path, years)
+    
+    airdates = pd.Categorical(columns['airdate'])
+    return pd.DataFrame({
+        'gid': np.asarray(columns['gid'], dtype=np.int32),
+        'airdate': pd.to_datetime(airdates, format='%Y-%m-%d', errors='coerce'),
+        'rnd': np.asarray(columns['rnd'], dtype=np.int8),
+        'category': pd.Categorical(columns['category']),
+        'value': np.asarray(columns['value'], dtype=np.int32),
+        'text': columns['text'],
+        'answer': columns['answer'],
+    })
+
+def filter_clues(df, rnd=None, value=None, category=None):
+    """Return the clues of a round, value and category (any part of its name, ignoring case)."""
+    mask = np.ones(len(df), dtype=bool)
+    if rnd is not None:
+        mask &= df['rnd'].to_numpy() == rnd
+    if value is not None:
+        mask &= df['value'].to_numpy() == value
+    if category is not None:
+        mask &= df['category'].str.contains(category, case=False, regex=False).to_numpy()
+    return df if mask.all() else df[mask]
+
+def get_one_question(df):
+    i = random.randrange(len(df))
+    category = df['category'].iat[i]
+    value = int(df['value'].iat[i]) or DEFAULT_VALUE
+    question = df['text'].iat[i]
+    answer = df['answer'].iat[i]
     return category, question, answer, value
 
+def clue_question(fields):
+    """Return (category, question, answer, value) of an archive row."""
+    return fields[3], fields[5], fields[6], archive_format.parse_value(fields[4]) or DEFAULT_VALUE
+
+def benchmark(questions=10000, years=None):
+    """Report load time, peak memory and per-question latency."""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    df = read_jarchive(years=years)
+    load_time = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    latencies = []
+    for _ in range(questions):
+        start = time.perf_counter()
+        get_one_question(df)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    
+    print(f"Loaded {len(df):,} clues in {load_time:.2f}s")
+    print(f"Peak RSS {peak / 1024:.0f} MB ({(peak - baseline) / 1024:.0f} MB for the load), "
+          f"frame uses {df.memory_usage(deep=True).sum() / 1e6:.0f} MB")
+    print(f"get_one_question over {questions:,} draws: mean {sum(latencies) / questions * 1e6:.1f} us, "
+          f"p99 {latencies[int(questions * 0.99)] * 1e6:.1f} us")
+
 def new_question(category, question, answer, value, score):
         
     print(f"Question from category {category} for ${value}:\n {question}")
@@ -143,17 +280,92 @@ def new_question(category, question, answer, value, score):
     return score
              
 
-def main():
+def _row_labels(columns):
+    """Return the board value of each row: the most common value at that row across categories."""
+    labels = []
+    for row in range(max(len(clues) for _, clues in columns)):
+        values = [archive_format.parse_value(clues[row][4]) for _, clues in columns
+                  if row < len(clues) and clues[row] is not None]
+        labels.append(max(set(values), key=values.count, default=0) or DEFAULT_VALUE)
+    return labels
+
+def _print_board(columns, remaining, labels):
+    for column, (category, _) in enumerate(columns, 1):
+        print(f"  {column}. {category}")
+    print("     " + "".join(f"{column:>7}" for column in range(1, len(columns) + 1)))
+    for row, label in enumerate(labels):
+        cells = [f"${label}" if (column, row) in remaining else "" for column in range(len(columns))]
+        print(f"  {row + 1:>2} " + "".join(f"{cell:>7}" for cell in cells))
+
+def _playable(fields):
+    return fields is not None and fields[5] not in UNPLAYABLE_TEXT and fields[6] not in UNPLAYABLE_ANSWER
+
+def play_game(gid=None):
+    """Play the full board of one game (a random one by default), round by round."""
+    if not game_index.is_fresh(ARCHIVE_GAMES, ARCHIVE_CSV):
+        print(f"Updating the game index {ARCHIVE_GAMES}...", file=sys.stderr)
+        game_index.update(ARCHIVE_CSV, ARCHIVE_GAMES)
+    games = game_index.GameIndex(ARCHIVE_GAMES, ARCHIVE_CSV)
+    gid = gid or games.random_gid()
+    board = games.board(gid)
+    print(f"Game {gid}, aired {games.airdate(gid)}")
     
-    df = read_jarchive()
+    score = 0
+    for rnd, columns in sorted(board.items()):
+        if rnd >= 3:
+            # Final Jeopardy (and tiebreakers): wager, then one clue per category
+            for category, clues in columns:
+                clue = next(filter(_playable, clues), None)
+                if clue is None:
+                    continue
+                limit = max(score, 0)
+                wager = input(f"\nFinal Jeopardy! The category is {category}. Your wager (0-{limit}): ")
+                wager = min(int(wager), limit) if wager.strip().isdigit() else 0
+                score = new_question(category, clue[5], clue[6], wager, score)
+            continue
+        
+        print(f"\nRound {rnd}")
+        labels = _row_labels(columns)
+        # Clues that never aired (unrevealed or missing) stay blank on the board
+        remaining = {(column, row): clue for column, (_, clues) in enumerate(columns)
+                     for row, clue in enumerate(clues) if _playable(clue)}
+        while remaining:
+            _print_board(columns, remaining, labels)
+            pick = input("Pick a category and row, e.g. '2 3' (Enter: next clue, q: stop): ").split()
+            if pick and pick[0].lower() == 'q':
+                print(f"Your final score is {score}")
+                return score
+            if pick:
+                key = tuple(int(n) - 1 for n in pick[:2]) if len(pick) == 2 and all(n.isdigit() for n in pick) else None
+                if key not in remaining:
+                    print("That clue is not on the board.")
+                    continue
+            else:
+                # Row by row across the board, the order the clues were written in
+                key = min(remaining, key=lambda k: (k[1], k[0]))
+            fields = remaining.pop(key)
+            value = archive_format.parse_value(fields[4]) or DEFAULT_VALUE
+            score = new_question(columns[key[0]][0], fields[5], fields[6], value, score)
+    
+    print(f"End of game {gid}. Your final score is {score}")
+    return score
+
+def main(years=None, rnd=None, value=None, category=None):
+    
+    if clue_sampler.is_fresh(ARCHIVE_OFFSETS, ARCHIVE_CSV):
+        # Each clue is read from the archive as it is drawn, nothing is loaded up front
+        sampler = clue_sampler.ClueSampler(ARCHIVE_OFFSETS, ARCHIVE_CSV)
+        clues = map(clue_question, sampler.questions(rnd=rnd, value=value, category=category, years=years))
+    else:
+        df = filter_clues(read_jarchive(years=years), rnd, value, category)
+        clues = map(get_one_question, itertools.repeat(df)) if len(df) else iter(())
 
     score = 0
     count = 0
     next = "Y"
     
-    while (next.lower() != "n"):
+    for category, question, answer, value in clues:
         
-        category, question, answer, value = get_one_question(df)
         score = new_question(category, question, answer, value, score)
         count += 1
         
@@ -161,7 +373,28 @@ def main():
             next = input("\n Continue? ")
             if (next.lower() == 'n'):
                 print(f"Your final score is {score}")
+                break
+    else:
+        print(f"No more clues to play. Your final score is {score}")
     
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Play Jeopardy! with clues from jarchive.csv.")
+    parser.add_argument("--bench", type=int, nargs="?", const=10000, metavar="N",
+                        help="measure loading and N question draws instead of playing")
+    parser.add_argument("--years", type=sharded_archive.parse_years, metavar="YEARS",
+                        help="only play clues that aired in these years, e.g. 2004 or 1990-1999,2010")
+    parser.add_argument("--round", type=int, choices=(1, 2, 3), dest="rnd",
+                        help="only play clues of this round (3 = Final Jeopardy)")
+    parser.add_argument("--value", type=int, help="only play clues of this dollar value")
+    parser.add_argument("--category", help="only play categories whose name contains this text")
+    parser.add_argument("--game", type=int, nargs="?", const=0, metavar="GID",
+                        help="play the full board of one game (a random one without GID)")
+    args = parser.parse_args()
+    
+    if args.bench:
+        benchmark(args.bench, args.years)
+    elif args.game is not None:
+        play_game(args.game)
+    else:
+        main(args.years, args.rnd, args.value, args.category)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Merge newly parsed clues into jarchive.csv without rewriting it when possible
+
+If every new game ID is past last_episode.txt the new rows are appended to
+the archive. Otherwise the archive is streamed game by game and merged with
+the new rows into a temporary file that replaces it. Clues are deduplicated
+by (gid, rnd, category, position), where position counts the clues of a
+category within a game's round; a new clue replaces an old one with the same
+key. Only the new rows and one game of the archive are held in memory.
+Lines of the archive that are not valid rows are copied through unchanged,
+after the rows of the game they follow.
+"""
+
+import argparse
+import os
+import sys
+from itertools import groupby
+
+import metrics
+from archive_format import HEADER, MalformedRow, format_row, read_rows
+
+def row_gid(fields):
+    return int(fields[0]) if fields[0].isdigit() else 0
+
+def iter_games(rows):
+    """Group consecutive rows by game ID."""
+    for gid, game_rows in groupby(rows, key=row_gid):
+        yield gid, list(game_rows)
+
+def iter_games_keeping_malformed(rows):
+    """Group rows by game ID like `iter_games`; yield (gid, rows, malformed lines).
+
+    A `MalformedRow` stays with the game it follows (the first game, for
+    lines before any valid row).
+    """
+    gid, game_rows, malformed = None, [], []
+    for fields in rows:
+        if isinstance(fields, MalformedRow):
+            malformed.append(fields)
+            continue
+        current = row_gid(fields)
+        if gid is not None and current != gid:
+            yield gid, game_rows, malformed
+            game_rows, malformed = [], []
+        gid = current
+        game_rows.append(fields)
+    if game_rows or malformed:
+        yield (gid if gid is not None else 0), game_rows, malformed
+
+def clue_key(fields, counts):
+    """Return the (gid, rnd, category, position) key of a clue."""
+    prefix = (fields[0], fields[2], fields[3])
+    position = counts.get(prefix, 0)
+    counts[prefix] = position + 1
+    return prefix + (position,)
+
+def merge_game(old_rows, new_rows):
+    """Merge the clues of one game, new clues replacing old ones with the same key."""
+    merged = {}
+    for rows in (old_rows, new_rows):
+        counts = {}
+        for fields in rows:
+            merged[clue_key(fields, counts)] = fields
+    return list(merged.values())
+
+def load_new_games(new_path):
+    """Return the new clues as {gid: rows}, deduplicated within each game."""
+    games = {}
+    for fields in read_rows(new_path):
+        games.setdefault(row_gid(fields), []).append(fields)
+    return {gid: merge_game([], rows) for gid, rows in games.items()}
+
+def read_last_episode(path):
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (IOError, ValueError):
+        return None
+
+def open_for_append(archive_path):
+    """Open the archive for appending rows, writing the header if it is new."""
+    out = open(archive_path, 'a+', encoding='utf-8')
+    if out.tell() == 0:
+        out.write(HEADER)
+    else:
+        # Make sure the first appended row starts on its own line
+        out.seek(out.tell() - 1)
+        if out.read(1) != "\n":
+            out.write("\n")
+    return out
+
+def append_games(archive_path, new_games):
+    """Append new games to the end of the archive; return the number of rows written."""
+    written = 0
+    with open_for_append(archive_path) as out:
+        for gid in sorted(new_games):
+            for fields in new_games[gid]:
+                out.write(format_row(fields))
+                written += 1
+    return written
+
+def merge_games(archive_path, new_games, replace=False):
+    """Stream-merge new games into the archive.
+
+    With `replace`, each new game replaces all rows of that game instead of
+    being merged clue by clue. Returns the total rows and games written, the
+    number of old rows replaced by new ones, and the highest game ID.
+    Malformed lines of the archive are written back unchanged.
+    """
+    tmp_path = archive_path + '.tmp'
+    pending = sorted(new_games)
+    next_new = 0
+    total = games = replaced = max_gid = kept = 0
+
+    def write_game(out, gid, rows):
+        nonlocal total, games, max_gid
+        for fields in rows:
+            out.write(format_row(fields))
+        total += len(rows)
+        games += 1
+        max_gid = max(max_gid, gid)
+
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        out.write(HEADER)
+        rows = read_rows(archive_path, keep_malformed=True)
+        for gid, old_rows, malformed in iter_games_keeping_malformed(rows):
+            while next_new < len(pending) and pending[next_new] < gid:
+                write_game(out, pending[next_new], new_games[pending[next_new]])
+                next_new += 1
+            if old_rows and next_new < len(pending) and pending[next_new] == gid:
+                merged = new_games[gid] if replace else merge_game(old_rows, new_games[gid])
+                replaced += len(old_rows) + len(new_games[gid]) - len(merged)
+                write_game(out, gid, merged)
+                next_new += 1
+            elif old_rows:
+                write_game(out, gid, old_rows)
+            out.writelines(line + "\n" for line in malformed)
+            kept += len(malformed)
+        for gid in pending[next_new:]:
+            write_game(out, gid, new_games[gid])
+
+    os.replace(tmp_path, archive_path)
+    if kept:
+        print(f"Copied {kept:,} malformed lines of {archive_path} through unchanged; "
+              "see `python archive_format.py check`", file=sys.stderr)
+    return total, games, replaced, max_gid
+
+def merge(archive_path, new_path, last_episode_path):
+    """Merge the rows of `new_path` into the archive and update last_episode.txt."""
+    new_games = load_new_games(new_path)
+    if not new_games:
+        print("No new clues to merge")
+        return
+
+    new_count = sum(len(rows) for rows in new_games.values())
+    last_episode = read_last_episode(last_episode_path)
+    max_gid = max(new_games)
+
+    if last_episode is not None and min(new_games) > last_episode:
+        print(f"All {len(new_games)} new games are past episode {last_episode}; appending")
+        with metrics.span("merge", mode="append"):
+            written = append_games(archive_path, new_games)
+        metrics.count("rows_written_total", written, stage="merge")
+        print(f"Appended {written:,} new clues")
+    else:
+        print(f"New games overlap the archive (last episode {last_episode}); merging")
+        with metrics.span("merge", mode="merge"):
+            total, games, replaced, max_gid = merge_games(archive_path, new_games)
+        metrics.count("rows_written_total", total, stage="merge")
+        metrics.count("rows_replaced_total", replaced)
+        print(f"Added {new_count - replaced:,} new clues, replaced {replaced:,}")
+        print(f"Total clues: {total:,}")
+        print(f"Unique games: {games}")
+
+    print(f"Max game ID: {max_gid}")
+    with open(last_episode_path, 'w') as f:
+        f.write(str(max_gid))
+    print(f"Updated {os.path.basename(last_episode_path)} to {max_gid}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge new clues into jarchive.csv.")
+    parser.add_argument("archive", help="the archive CSV to update, e.g. jarchive.csv")
+    parser.add_argument("new_csv", help="the CSV of newly parsed clues")
+    parser.add_argument("-l", "--last-episode", default="last_episode.txt",
+                        help="file holding the highest game ID in the archive")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    with metrics.instrumented(args):
+        merge(args.archive, args.new_csv, args.last_episode)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Counters, histograms and timing spans for the update scripts
+
+The scripts record into the module-level registry with `count`, `observe`
+and `span`; running a script with `--metrics FILE` writes the registry on
+exit as JSON (any other extension) or as Prometheus text exposition format
+(`.prom`), and `--profile FILE` runs the script's main function under
+cProfile (or pyinstrument for `.html` files).
+
+Metric names and what they answer:
+
+* download_request_seconds, download_bytes_total, download_responses_total{status}:
+  network latency and volume
+* download_sleep_seconds_total, rate_limit_wait_seconds: time spent waiting on
+  the politeness delays rather than the network
+* parse_game_seconds, clues_per_game: parser cost per game
+* rows_written_total{stage}: output volume of the parse, merge and pipeline stages
+* spans: wall time of each stage (download, parse, merge, ...)
+"""
+
+import bisect
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 10, 20, 30, 40, 50, 55, 60, 62, 65, 70, 100)
+
+class Histogram:
+    """Bucketed observations plus the raw values for percentiles.
+
+    With `window`, only the last `window` values are kept, so a long-running
+    process has bounded memory and percentiles over its recent observations;
+    the buckets, count, sum, min and max still cover every observation.
+    """
+
+    def __init__(self, buckets=SECONDS_BUCKETS, window=None):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.values = [] if window is None else collections.deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values.append(value)
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        if not self.values:
+            return None
+        ordered = sorted(self.values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        count = self.count
+        return {"count": count, "sum": self.sum, "mean": self.sum / count if count else None,
+                "min": self.min, "max": self.max,
+                "p50": self.percentile(0.5), "p90": self.percentile(0.9), "p99": self.percentile(0.99),
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts))}
+
+class Registry:
+    """Thread-safe store of counters, gauges, histograms and spans."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.spans = []
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, window=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets, window)
+            histogram.observe(value)
+
+    def add_span(self, name, start, seconds, **attrs):
+        """Record a span that began at wall time `start` and lasted `seconds`."""
+        with self.lock:
+            self.spans.append({"name": name, "start": round(start - self.started, 6),
+                               "seconds": seconds, **attrs})
+        self.observe(f"{name}_seconds", seconds)
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """Time a block; the duration is kept as a span and a `<name>_seconds` histogram."""
+        start = time.time()
+        perf_start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.add_span(name, start, time.perf_counter() - perf_start, **attrs)
+
+    def to_dict(self):
+        def labelled(key):
+            name, labels = key
+            return name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else "")
+
+        with self.lock:
+            return {"started": self.started, "finished": time.time(), "argv": sys.argv,
+                    "counters": {labelled(k): v for k, v in self.counters.items()},
+                    "gauges": {labelled(k): v for k, v in self.gauges.items()},
+                    "histograms": {labelled(k): h.summary() for k, h in self.histograms.items()},
+                    "spans": list(self.spans)}
+
+    def to_prometheus(self, prefix="jarchive_"):
+        def labels(pairs, extra=()):
+            pairs = list(pairs) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        lines = []
+        with self.lock:
+            for (name, pairs), value in sorted(self.counters.items()):
+                lines.append(f"{prefix}{name}{labels(pairs)} {value}")
+            for (name, pairs), value in sorted(self.gauges.items()):
+                lines.append(f"{prefix}{name}{labels(pairs)} {value}")
+            for (name, pairs), histogram in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                cumulative = 0
+                for bound, count in zip([str(b) for b in histogram.buckets] + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{prefix}{name}_bucket{labels(pairs, [('le', bound)])} {cumulative}")
+                lines.append(f"{prefix}{name}_sum{labels(pairs)} {histogram.sum}")
+                lines.append(f"{prefix}{name}_count{labels(pairs)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the registry as Prometheus text (.prom) or JSON."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            if path.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=1)
+        os.replace(tmp_path, path)
+
+REGISTRY = Registry()
+count = REGISTRY.count
+gauge = REGISTRY.gauge
+observe = REGISTRY.observe
+add_span = REGISTRY.add_span
+span = REGISTRY.span
+
+def timed_call(func, *args, **kwargs):
+    """Call `func` and return (result, seconds); picklable for process pools."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def add_arguments(parser):
+    """Add the --metrics and --profile options to an argparse parser."""
+    parser.add_argument("--metrics", metavar="<file>",
+                        help="write counters, histograms and spans to this file on exit "
+                             "(Prometheus text for .prom, JSON otherwise)")
+    parser.add_argument("--profile", metavar="<file>",
+                        help="profile the run with cProfile (.prof) or pyinstrument (.html)")
+
+@contextlib.contextmanager
+def instrumented(args):
+    """Apply the --metrics and --profile options of `add_arguments` around a block."""
+    profiler = None
+    if args.profile and args.profile.endswith(".html"):
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+    elif args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield REGISTRY
+    finally:
+        if profiler is not None and args.profile.endswith(".html"):
+            profiler.stop()
+            with open(args.profile, 'w') as f:
+                f.write(profiler.output_html())
+        elif profiler is not None:
+            import pstats
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(15)
+        if args.metrics:
+            REGISTRY.write(args.metrics)
+            print(f"Wrote metrics to {args.metrics}", file=sys.stderr)
@@ -6,23 +6,66 @@ Parse downloaded Jeopardy games and create a CSV file compatible with jarchive_2
 
 from bs4 import BeautifulSoup
 from glob import glob
+from lxml import etree
+import archive_format
+import metrics
+from game_store import GameStore
+from parse_cache import ParseCache, file_digest, print_stats
+import argparse
+import collections
+import concurrent.futures as futures
+import functools
+import html
 import os
 import sys
 import re
+import time
 
-def parse_game(filepath):
-    """Parse a single game file and return all clues."""
-    clues = []
-    
+ENGINES = ("bs4", "lxml")
+# Bump whenever a change to the extractors alters their output, so cached
+# clues from older parsers are not reused
+PARSER_VERSION = "1"
+# Games submitted to the process pool per worker and not yet yielded
+JOBS_PER_WORKER = 4
+
+def parse_game(filepath, engine="bs4"):
+    """Parse a single game file and return all clues.
+
+    `engine` selects the extractor: "bs4" walks a BeautifulSoup tree and
+    "lxml" runs precompiled XPath queries over the raw lxml tree.
+    """
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            bsoup = BeautifulSoup(f, "lxml")
+        with open(filepath, 'rb') as f:
+            page = f.read()
     except Exception as e:
         print(f"Error reading {filepath}: {e}", file=sys.stderr)
-        return clues
+        return []
     
     # Extract game ID from filename
-    gid = int(os.path.basename(filepath).replace('.html', ''))
+    return parse_page(page, game_id(filepath), engine)
+
+def parse_stored_game(store_path, gid, engine="bs4"):
+    """Parse a game page held in a `GameStore` and return all clues."""
+    store = _open_stores.get(store_path)
+    if store is None:
+        store = _open_stores[store_path] = GameStore(store_path)
+    return parse_page(store.get(gid), gid, engine)
+
+# Stores opened by parse_stored_game, one per path and process
+_open_stores = {}
+
+def parse_page(page, gid, engine="bs4"):
+    """Parse the raw bytes of a game page and return all clues."""
+    if engine == "lxml":
+        return parse_page_lxml(page, gid)
+    
+    clues = []
+    
+    try:
+        bsoup = BeautifulSoup(page.decode('utf-8'), "lxml")
+    except Exception as e:
+        print(f"Error reading game {gid}: {e}", file=sys.stderr)
+        return clues
     
     # Extract airdate from title
     try:
@@ -119,45 +162,314 @@ def parse_final_jeopardy(bsoup, gid, airdate):
     
     return clues
 
+# Precompiled queries for the lxml engine. Class tests match a whole token
+# of the class attribute, like BeautifulSoup's `class_=` does.
+def _class_xpath(tag, name):
+    return etree.XPath(
+        f".//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {name} ')]")
+
+TITLE_XPATH = etree.XPath("(//title)[1]")
+ROUND_XPATH = etree.XPath("(//*[@id=$round_id])[1]")
+FINAL_ROUND_XPATH = etree.XPath("(//table[contains(concat(' ', normalize-space(@class), ' '), ' final_round ')])[1]")
+CATEGORY_NAME_XPATH = _class_xpath("td", "category_name")
+CLUE_XPATH = _class_xpath("td", "clue")
+CLUE_TEXT_XPATH = _class_xpath("td", "clue_text")
+# Matches clue_value as well as clue_value_daily_double
+CLUE_VALUE_XPATH = etree.XPath(".//td[contains(@class, 'clue_value')]")
+ONMOUSEOVER_XPATH = etree.XPath(".//div[@onmouseover]/@onmouseover")
+
+# The response lives in an HTML snippet inside the onmouseover attribute;
+# pull it out with a regex instead of parsing the snippet again.
+CORRECT_RESPONSE_RE = re.compile(
+    r"""<em\b[^>]*\bclass=(["']?)correct_response\1(?=[\s/>])[^>]*>(.*?)</em>""", re.I | re.S)
+FIRST_EM_RE = re.compile(r"<em\b[^>]*>(.*?)</em>", re.I | re.S)
+TAG_RE = re.compile(r"<[^>]*>")
+
+def _first(results):
+    return results[0] if results else None
+
+def _text(elem):
+    return elem.xpath("string()") if elem is not None else ""
+
+def _snippet_text(snippet):
+    """Return the text content of an HTML snippet without parsing it."""
+    return html.unescape(TAG_RE.sub("", snippet))
+
+def parse_page_lxml(page, gid):
+    """Parse the raw bytes of a game page with the lxml/XPath engine."""
+    clues = []
+    
+    try:
+        root = etree.HTML(page.decode('utf-8'))
+    except Exception as e:
+        print(f"Error reading game {gid}: {e}", file=sys.stderr)
+        return clues
+    
+    try:
+        airdate = _text(_first(TITLE_XPATH(root))).split()[-1]
+    except Exception:
+        print(f"Warning: Could not extract airdate for game {gid}", file=sys.stderr)
+        airdate = "UNKNOWN"
+    
+    clues.extend(parse_round_lxml(root, 1, gid, airdate))
+    clues.extend(parse_round_lxml(root, 2, gid, airdate))
+    clues.extend(parse_final_jeopardy_lxml(root, gid, airdate))
+    
+    return clues
+
+def parse_round_lxml(root, rnd, gid, airdate):
+    """Parse a regular Jeopardy round (1 or 2) from an lxml tree."""
+    clues = []
+    round_id = "jeopardy_round" if rnd == 1 else "double_jeopardy_round"
+    r = _first(ROUND_XPATH(root, round_id=round_id))
+    
+    if r is None:
+        return clues
+    
+    categories = [_text(c) for c in CATEGORY_NAME_XPATH(r)]
+    
+    x = 0
+    for a in CLUE_XPATH(r):
+        is_missing = not _text(a).strip()
+        
+        if not is_missing:
+            try:
+                value_elem = _first(CLUE_VALUE_XPATH(a))
+                value = _text(value_elem).lstrip("D: $").replace(',', '') if value_elem is not None else ""
+                
+                text = _text(_first(CLUE_TEXT_XPATH(a)))
+                
+                answer = ""
+                onmouseover = _first(ONMOUSEOVER_XPATH(a))
+                if onmouseover:
+                    match = CORRECT_RESPONSE_RE.search(onmouseover)
+                    if match:
+                        answer = _snippet_text(match.group(2))
+                
+                clues.append([gid, airdate, rnd, categories[x], value, text, answer])
+            except Exception as e:
+                print(f"Error parsing clue in game {gid}, round {rnd}: {e}", file=sys.stderr)
+        
+        x = 0 if x == 5 else x + 1
+    
+    return clues
+
+def parse_final_jeopardy_lxml(root, gid, airdate):
+    """Parse Final Jeopardy from an lxml tree."""
+    clues = []
+    r = _first(FINAL_ROUND_XPATH(root))
+    
+    if r is None:
+        return clues
+    
+    try:
+        category = _text(_first(CATEGORY_NAME_XPATH(r)))
+        text = _text(_first(CLUE_TEXT_XPATH(r)))
+        
+        answer = ""
+        onmouseover = _first(ONMOUSEOVER_XPATH(r))
+        if onmouseover:
+            match = FIRST_EM_RE.search(onmouseover)
+            if match:
+                answer = _snippet_text(match.group(1))
+        
+        clues.append([gid, airdate, 3, category, "False", text, answer])
+    except Exception as e:
+        print(f"Error parsing Final Jeopardy in game {gid}: {e}", file=sys.stderr)
+    
+    return clues
+
 def format_clue(clue):
-    """Format a clue as a CSV row with || separator."""
-    return " || ".join(str(field) for field in clue)
+    """Format a clue as a CSV row with || separator, escaping any | in its fields."""
+    return archive_format.join_fields(clue)
+
+def game_id(filepath):
+    """Return the game ID encoded in a `<gid>.html` filename."""
+    return int(os.path.basename(filepath).replace('.html', ''))
+
+def iter_parsed_games(html_files, workers=1, engine="bs4", cache=None, store=None):
+    """Yield the clues of each game file, in the order the files are given.
+
+    With more than one worker the games are parsed in a process pool and
+    the results are handed back in submission order, so the output is
+    identical to the single-process path. With a `ParseCache`,
+    unchanged games are served from the cache and only the rest are parsed.
+    With a `GameStore`, `html_files` are game IDs read from the store.
+    """
+    if store is None:
+        parse = functools.partial(parse_game, engine=engine)
+        gids = [game_id(filepath) for filepath in html_files]
+    else:
+        parse = functools.partial(parse_stored_game, store.path, engine=engine)
+        gids = list(html_files)
+    
+    if cache is None:
+        yield from _parse_all(parse, html_files, workers)
+        return
+
+    # Games are looked up one at a time and misses sent to the pool as they
+    # are found, keeping a bounded window of games not yet yielded
+    timed = functools.partial(metrics.timed_call, parse)
+    window = max(workers, 1) * JOBS_PER_WORKER
+    pending = collections.deque()
+    executor = futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def finish(gid, digest, clues, job):
+        if job is not None:
+            clues, seconds = job.result() if executor is not None else job
+            _record_parse(clues, seconds)
+            cache.store(gid, digest, clues)
+        return clues
+
+    try:
+        for source, gid in zip(html_files, gids):
+            digest = file_digest(source) if store is None else store.digest(gid)
+            clues = cache.lookup(gid, digest)
+            job = None
+            if clues is None:
+                job = executor.submit(timed, source) if executor is not None else timed(source)
+            pending.append((gid, digest, clues, job))
+            # A cached game at the front needs no waiting
+            while pending and (len(pending) >= window or pending[0][3] is None or executor is None):
+                yield finish(*pending.popleft())
+        while pending:
+            yield finish(*pending.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+def _record_parse(clues, seconds):
+    metrics.observe("parse_game_seconds", seconds)
+    metrics.observe("clues_per_game", len(clues), buckets=metrics.COUNT_BUCKETS)
+
+def _parse_all(parse, sources, workers):
+    # Each game is timed where it is parsed, then recorded here
+    timed = functools.partial(metrics.timed_call, parse)
+    for clues, seconds in _map(timed, sources, workers):
+        _record_parse(clues, seconds)
+        yield clues
+
+def _map(func, sources, workers):
+    if workers <= 1:
+        yield from map(func, sources)
+        return
 
-def main(input_dir, output_file):
-    """Parse all games in directory and write to CSV."""
-    html_files = sorted(glob(os.path.join(input_dir, "*.html")), 
-                       key=lambda x: int(os.path.basename(x).replace('.html', '')))
+    if not sources:
+        return
+
+    # Executor.map would submit every game up front and buffer the results,
+    # so keep a bounded window of jobs and yield them in submission order
+    pending = collections.deque()
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for source in sources:
+            pending.append(executor.submit(func, source))
+            if len(pending) >= workers * JOBS_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def find_game_files(input_dir):
+    """Return the `<gid>.html` files in a directory sorted by game ID."""
+    return sorted(glob(os.path.join(input_dir, "*.html")), key=game_id)
+
+def compare_engines(input_dir, max_diffs=5):
+    """Parse every game with both engines and report differing clues.
+
+    Returns the number of games whose clue lists differ.
+    """
+    html_files = find_game_files(input_dir)
+    mismatched = 0
+    clue_count = 0
+    
+    for filepath in html_files:
+        expected = parse_game(filepath, engine="bs4")
+        actual = parse_game(filepath, engine="lxml")
+        clue_count += len(expected)
+        if expected == actual:
+            continue
+        
+        mismatched += 1
+        print(f"Game {game_id(filepath)}: bs4 has {len(expected)} clues, lxml has {len(actual)}")
+        diffs = [(i, e, a) for i, (e, a) in enumerate(zip(expected, actual)) if e != a]
+        for i, e, a in diffs[:max_diffs]:
+            print(f"  clue {i}:")
+            print(f"    bs4:  {format_clue(e)}")
+            print(f"    lxml: {format_clue(a)}")
+        if len(diffs) > max_diffs:
+            print(f"  ... {len(diffs) - max_diffs} more")
+    
+    print(f"Compared {len(html_files)} games ({clue_count} clues): {mismatched} mismatched",
+          file=sys.stderr)
+    return mismatched
+
+def main(input_dir, output_file, workers=1, engine="bs4", cache_path=None, from_store=False):
+    """Parse all games in directory (or `GameStore` if `from_store`) and write to CSV."""
+    store = GameStore(input_dir) if from_store else None
+    html_files = store.gids() if store is not None else find_game_files(input_dir)
     
     if not html_files:
         print(f"No HTML files found in {input_dir}", file=sys.stderr)
         return
     
     print(f"Found {len(html_files)} game files to parse", file=sys.stderr)
-    print(f"Writing to {output_file}", file=sys.stderr)
+    print(f"Writing to {output_file} using {workers} worker(s), {engine} engine", file=sys.stderr)
     
-    with open(output_file, 'w', encoding='utf-8') as out:
+    cache = ParseCache(cache_path, f"{PARSER_VERSION}/{engine}") if cache_path else None
+    
+    start_time = time.perf_counter()
+    with metrics.span("parse", games=len(html_files), engine=engine, workers=workers), \
+            open(output_file, 'w', encoding='utf-8') as out:
         # Write header
         out.write("gid || airdate || rnd || category || value || text || answer\n")
         
         clue_count = 0
-        for i, filepath in enumerate(html_files, 1):
-            if i % 100 == 0:
-                print(f"Parsed {i}/{len(html_files)} games ({clue_count} clues so far)...", file=sys.stderr)
-            
-            clues = parse_game(filepath)
+        for i, clues in enumerate(iter_parsed_games(html_files, workers, engine, cache, store), 1):
             for clue in clues:
                 out.write(format_clue(clue) + "\n")
                 clue_count += 1
+            
+            if i % 100 == 0:
+                print(f"Parsed {i}/{len(html_files)} games ({clue_count} clues so far)...", file=sys.stderr)
         
+        metrics.count("rows_written_total", clue_count, stage="parse")
         print(f"Done! Parsed {len(html_files)} games with {clue_count} total clues", file=sys.stderr)
+    
+    elapsed = time.perf_counter() - start_time
+    if elapsed > 0:
+        print(f"Elapsed {elapsed:.1f}s: {len(html_files) / elapsed:.1f} games/sec, "
+              f"{clue_count / elapsed:.1f} clues/sec", file=sys.stderr)
+    
+    if cache is not None:
+        print_stats(cache.stats())
+        cache.close()
+    if store is not None:
+        store.close()
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python parse_and_create_csv.py <input_dir> <output_csv>")
-        print("Example: python parse_and_create_csv.py new_games_2024 jarchive_new.csv")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Parse downloaded J! Archive games into a || separated CSV.",
+        epilog="Example: python parse_and_create_csv.py new_games_2024 jarchive_new.csv")
+    parser.add_argument("input_dir", help="the directory containing the <gid>.html game files "
+                        "(or a game store with --store)")
+    parser.add_argument("output_csv", nargs="?", help="the CSV file to write")
+    parser.add_argument("-w", "--workers", type=int, default=1, metavar="N",
+                        help="number of parser processes (default: 1, 0 = one per CPU)")
+    parser.add_argument("-e", "--engine", choices=ENGINES, default="bs4",
+                        help="clue extractor to use (default: bs4)")
+    parser.add_argument("-c", "--cache", metavar="<file>",
+                        help="SQLite parse cache; unchanged games are not parsed again")
+    parser.add_argument("-s", "--store", action="store_true",
+                        help="read the pages from the game store named by input_dir")
+    parser.add_argument("--compare-engines", action="store_true",
+                        help="parse input_dir with both engines and report differences")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
     
-    input_dir = sys.argv[1]
-    output_file = sys.argv[2]
+    if args.compare_engines:
+        sys.exit(1 if compare_engines(args.input_dir) else 0)
+    if not args.output_csv:
+        parser.error("output_csv is required")
     
-    main(input_dir, output_file)
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    with metrics.instrumented(args):
+        main(args.input_dir, args.output_csv, workers, args.engine, args.cache, args.store)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of parsed clues, keyed by game file content hash
+
+Each entry maps (gid, sha256 of the <gid>.html file, parser version) to the
+clue rows extracted from it, so unchanged games are not parsed again.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    gid INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    version TEXT NOT NULL,
+    clues TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (gid, digest, version)
+)
+"""
+
+COMMIT_EVERY = 500
+
+def file_digest(filepath):
+    """Return the sha256 hex digest of a file's contents."""
+    with open(filepath, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class ParseCache:
+    """SQLite-backed store of parsed clues for a single parser version."""
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lookup(self, gid, digest):
+        """Return the cached clues for a game, or None on a miss."""
+        row = self.conn.execute(
+            "SELECT clues FROM games WHERE gid = ? AND digest = ? AND version = ?",
+            (gid, digest, self.version)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def store(self, gid, digest, clues):
+        """Record the clues parsed from a game file."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?)",
+            (gid, digest, self.version, json.dumps(clues, ensure_ascii=False), time.time()))
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.conn.commit()
+            self._pending = 0
+
+    def compact(self, live_gids=None):
+        """Evict stale entries and reclaim space.
+
+        Drops entries written by other parser versions, keeps only the newest
+        entry for each gid, and (if given) drops gids not in `live_gids`.
+        Returns the number of entries removed.
+        """
+        cur = self.conn.cursor()
+        before = cur.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+        cur.execute("DELETE FROM games WHERE version != ?", (self.version,))
+        cur.execute("""
+            DELETE FROM games WHERE rowid NOT IN (
+                SELECT rowid FROM games AS g WHERE created = (
+                    SELECT MAX(created) FROM games WHERE gid = g.gid))
+        """)
+        if live_gids is not None:
+            cur.execute("CREATE TEMP TABLE live (gid INTEGER PRIMARY KEY)")
+            cur.executemany("INSERT OR IGNORE INTO live VALUES (?)", ((g,) for g in live_gids))
+            cur.execute("DELETE FROM games WHERE gid NOT IN (SELECT gid FROM live)")
+            cur.execute("DROP TABLE live")
+        after = cur.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+        return before - after
+
+    def stats(self):
+        """Return a dict describing the cache contents and this session's hit rate."""
+        entries, games = self.conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT gid) FROM games").fetchone()
+        current = self.conn.execute(
+            "SELECT COUNT(*) FROM games WHERE version = ?", (self.version,)).fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "version": self.version,
+            "entries": entries,
+            "games": games,
+            "current_version_entries": current,
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+def print_stats(stats, file=sys.stderr):
+    print(f"Parse cache {stats['path']}: {stats['hits']} hits, {stats['misses']} misses "
+          f"({stats['hit_rate'] * 100:.1f}% hit rate), {stats['entries']} entries for "
+          f"{stats['games']} games, {stats['size_bytes'] / 1e6:.1f} MB", file=file)
+
+if __name__ == "__main__":
+    from parse_and_create_csv import PARSER_VERSION, find_game_files, game_id, ENGINES
+
+    parser = argparse.ArgumentParser(description="Inspect or compact the parse cache.")
+    parser.add_argument("command", choices=("stats", "compact"))
+    parser.add_argument("cache", help="the cache database file")
+    parser.add_argument("-e", "--engine", choices=ENGINES, default="bs4",
+                        help="parser engine whose entries are current (default: bs4)")
+    parser.add_argument("-d", "--dir", metavar="<folder>",
+                        help="when compacting, drop games that have no file in this directory")
+    args = parser.parse_args()
+
+    with ParseCache(args.cache, f"{PARSER_VERSION}/{args.engine}") as cache:
+        if args.command == "compact":
+            live = [game_id(f) for f in find_game_files(args.dir)] if args.dir else None
+            print(f"Removed {cache.compact(live)} stale entries", file=sys.stderr)
+        print_stats(cache.stats())
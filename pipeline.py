@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Streaming update: download -> parse -> append, without temporary directories
+
+Three stages run at once:
+
+* the asyncio downloader (`async_download.py`) runs in a background thread and
+  puts each page on a bounded queue; when the queue is full the downloader
+  waits, so memory stays bounded no matter how many games are fetched;
+* the main thread hands pages to a process pool of parser workers, keeping at
+  most a few games in flight per worker;
+* a single writer appends each game's clues to the archive in game ID order
+  as soon as every earlier game is resolved, and moves last_episode.txt along
+  with it, so an interrupted run can be resumed.
+
+Without a download journal nothing would retry a failed game, so the writer
+stops at the first one: last_episode.txt stays below it and the next run
+starts there again.
+
+With `auto` as the end ID, scheduling stops after MAX_GAP consecutive IDs
+that do not exist on the site (known untranscribed games do not count).
+With a download journal, failed games from earlier runs and due rechecks of
+known missing games are fetched first and merged into the archive at the end.
+"""
+
+import argparse
+import concurrent.futures as futures
+import os
+import queue
+import sys
+import threading
+import time
+
+import metrics
+from async_download import AsyncDownloader
+from download_new_episodes import (ERROR_MSG, GAME_URL, KNOWN_MISSING_GAMES, MAX_CONCURRENCY,
+                                   MAX_GAP, MAX_RETRIES, REQUESTS_PER_SECOND)
+from download_journal import DEFAULT_JOURNAL, DownloadJournal, print_summary
+from archive_format import normalize
+from merge_archive import merge_games, open_for_append, read_last_episode, HEADER
+from parse_and_create_csv import ENGINES, format_clue, parse_page
+
+QUEUE_SIZE = 32
+# Parse jobs kept in flight per worker process
+JOBS_PER_WORKER = 2
+REPORT_INTERVAL = 10.0
+
+# Queue item marking the end of the downloads
+DONE = None
+
+class PageQueue:
+    """Sink for `AsyncDownloader` that passes pages to the parse stage.
+
+    Behaves like a `GameStore` that never holds a game, so every game is
+    fetched, and `put` blocks while the queue is full. The downloader calls
+    `put` from an executor thread, so a slow parse stage holds back new
+    requests without stalling the event loop.
+    """
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.max_depth = 0
+        self.bytes = 0
+
+    def __contains__(self, gid):
+        return False
+
+    def put(self, gid, html):
+        self.queue.put((gid, html))
+        with self.lock:
+            self.bytes += len(html)
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def put_missing(self, gid):
+        self.queue.put((gid, None))
+
+class StageStats:
+    """Item count and active time of one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.first = None
+        self.last = None
+
+    def add(self):
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.items += 1
+
+    def rate(self, start):
+        elapsed = (self.last or start) - start
+        return self.items / elapsed if elapsed > 0 else 0.0
+
+def schedule(start_id, end_id, outcomes, sink, max_gap=MAX_GAP, earlier=()):
+    """Yield the game IDs to download, in order, after the `earlier` ones.
+
+    Without `end_id`, stop once `max_gap` consecutive IDs have come back
+    missing. Known missing games are passed straight to the writer.
+    """
+    yield from earlier
+    gid = start_id
+    while end_id is None or gid <= end_id:
+        if end_id is None and _gap_end(outcomes, gid, max_gap):
+            return
+        if gid in KNOWN_MISSING_GAMES:
+            outcomes[gid] = "missing"
+            sink.put_missing(gid)
+        else:
+            yield gid
+        gid += 1
+
+def _gap_end(outcomes, next_gid, max_gap):
+    """True if some run of `max_gap` IDs below `next_gid` were all missing."""
+    run = 0
+    for gid in range(next_gid - 1, max(next_gid - 1 - 4 * max_gap, 0), -1):
+        if gid in KNOWN_MISSING_GAMES:
+            continue
+        run = run + 1 if outcomes.get(gid) == "missing" else 0
+        if run >= max_gap:
+            return True
+    return False
+
+def download_stage(downloader, start_id, end_id, sink, stats, failed, earlier=()):
+    """Run the downloader to completion and close the queue; run in a thread."""
+    outcomes = {}
+
+    def on_result(gid, outcome):
+        outcomes[gid] = outcome
+        if outcome == "saved":
+            stats.add()
+        else:
+            if outcome == "failed":
+                failed.add(gid)
+            sink.put_missing(gid)
+
+    try:
+        downloader.download(schedule(start_id, end_id, outcomes, sink, earlier=earlier),
+                            None, on_result)
+    finally:
+        sink.queue.put(DONE)
+
+def run(start_id, end_id, archive_path, last_episode_path, new_csv_path=None, workers=1,
+        engine="lxml", rate=REQUESTS_PER_SECOND, concurrency=MAX_CONCURRENCY,
+        retries=MAX_RETRIES, url_template=GAME_URL, queue_size=QUEUE_SIZE, journal=None):
+    """Download, parse and append games `start_id .. end_id` (or up to the newest).
+
+    Returns the number of games and clues written and the IDs of the games
+    that failed to download.
+    """
+    earlier = []
+    if journal is not None:
+        earlier = sorted(set(journal.due_retries(before=start_id))
+                         | {gid for gid in journal.due_rechecks() if gid < start_id})
+        if earlier:
+            print(f"Retrying {len(earlier)} games from earlier runs: {earlier[:10]}", file=sys.stderr)
+    sink = PageQueue(queue_size)
+    downloaded = StageStats("download")
+    parsed = StageStats("parse")
+    written = StageStats("write")
+    failed = set()
+    # Without a journal, the first failed game at or past start_id
+    stopped_at = None
+
+    downloader = AsyncDownloader(url_template, rate=rate, concurrency=concurrency,
+                                 retries=retries, error_msg=ERROR_MSG, store=sink,
+                                 journal=journal)
+    thread = threading.Thread(target=download_stage, daemon=True,
+                              args=(downloader, start_id, end_id, sink, downloaded, failed, earlier))
+
+    started = time.time()
+    start = time.perf_counter()
+    thread.start()
+
+    out = open_for_append(archive_path)
+    new_out = None
+    if new_csv_path:
+        new_out = open(new_csv_path, 'w', encoding='utf-8')
+        new_out.write(HEADER)
+
+    results = {}
+    # Games below start_id, merged into the archive at the end
+    late_games = {}
+    in_flight = {}
+    next_gid = start_id
+    clue_count = 0
+    last_report = start
+    finished = False
+
+    def write_ready():
+        # Write every game whose predecessors are all resolved
+        nonlocal next_gid, clue_count, stopped_at
+        while next_gid in results and stopped_at is None:
+            if journal is None and next_gid in failed:
+                stopped_at = next_gid
+                print(f"Game {next_gid} failed and there is no journal to retry it; "
+                      "not writing it or any later game", file=sys.stderr)
+                results.clear()
+                break
+            clues = results.pop(next_gid)
+            if clues:
+                for clue in clues:
+                    row = format_clue(clue) + "\n"
+                    out.write(row)
+                    if new_out is not None:
+                        new_out.write(row)
+                out.flush()
+                if new_out is not None:
+                    new_out.flush()
+                with open(last_episode_path, 'w') as f:
+                    f.write(str(next_gid))
+                clue_count += len(clues)
+                written.add()
+                metrics.count("rows_written_total", len(clues), stage="pipeline")
+            next_gid += 1
+
+    def collect(done):
+        for future in done:
+            gid = in_flight.pop(future)
+            try:
+                clues, seconds = future.result()
+                metrics.observe("parse_game_seconds", seconds)
+                metrics.observe("clues_per_game", len(clues), buckets=metrics.COUNT_BUCKETS)
+            except Exception as e:
+                print(f"Exception parsing game {gid}: {e!r}", file=sys.stderr)
+                clues = []
+            parsed.add()
+            if gid < start_id:
+                if clues:
+                    late_games[gid] = clues
+            elif stopped_at is None:
+                results[gid] = clues
+
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            while not finished or in_flight:
+                if not finished:
+                    try:
+                        item = sink.queue.get(timeout=0.5)
+                    except queue.Empty:
+                        pass
+                    else:
+                        if item is DONE:
+                            finished = True
+                        elif item[1] is None:
+                            if item[0] >= start_id and stopped_at is None:
+                                results[item[0]] = []
+                        else:
+                            gid, html = item
+                            in_flight[executor.submit(metrics.timed_call, parse_page, html, gid, engine)] = gid
+
+                # Bound the parse jobs; wait for some when there are too many
+                limit = 0 if finished else workers * JOBS_PER_WORKER
+                if len(in_flight) > limit:
+                    done, _ = futures.wait(in_flight, return_when=futures.FIRST_COMPLETED)
+                else:
+                    done = [future for future in in_flight if future.done()]
+                collect(done)
+                write_ready()
+
+                metrics.gauge("queue_depth_max", sink.max_depth)
+                now = time.perf_counter()
+                if now - last_report >= REPORT_INTERVAL:
+                    last_report = now
+                    print(f"[{now - start:.0f}s] downloaded {downloaded.items}, parsed {parsed.items}, "
+                          f"written {written.items} games ({clue_count} clues); queue {sink.queue.qsize()}"
+                          f"/{queue_size}, parsing {len(in_flight)}, waiting to write {len(results)}",
+                          file=sys.stderr)
+
+            # Anything still held back by an ID that never resolved
+            for gid in sorted(results):
+                next_gid = gid
+                write_ready()
+            out.close()
+            if late_games:
+                rows = {gid: [normalize(clue) for clue in clues] for gid, clues in late_games.items()}
+                merge_games(archive_path, rows)
+                print(f"Merged {len(late_games)} earlier games into {archive_path}", file=sys.stderr)
+                for gid in sorted(late_games):
+                    clue_count += len(late_games[gid])
+                    written.add()
+                    if new_out is not None:
+                        new_out.writelines(format_clue(clue) + "\n" for clue in late_games[gid])
+        finally:
+            out.close()
+            if new_out is not None:
+                new_out.close()
+    thread.join()
+
+    elapsed = time.perf_counter() - start
+    print(f"Done in {elapsed:.1f}s: wrote {written.items} games with {clue_count} clues", file=sys.stderr)
+    for stage in (downloaded, parsed, written):
+        print(f"  {stage.name:8} {stage.items:6} games, {stage.rate(start):7.2f} games/sec", file=sys.stderr)
+    print(f"  downloaded {sink.bytes / 1e6:.1f} MB over {downloader.pool.connections_opened} "
+          f"connection(s); max queue depth {sink.max_depth}/{queue_size}", file=sys.stderr)
+    if failed:
+        print(f"Failed game IDs: {sorted(failed)}", file=sys.stderr)
+    if stopped_at is not None:
+        print(f"Stopped at failed game {stopped_at}; the next run starts there", file=sys.stderr)
+    # Stages overlap, so each span runs from the start to the stage's last game
+    for stage in (downloaded, parsed, written):
+        if stage.first is not None:
+            metrics.add_span(stage.name, started, stage.last - start, games=stage.items)
+    return written.items, clue_count, sorted(failed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download, parse and append new games to the archive in one streaming pass.",
+        epilog="Example: python pipeline.py 9303 auto")
+    parser.add_argument("start_id", type=int, nargs="?",
+                        help="first game ID (default: one past the last episode)")
+    parser.add_argument("end_id", nargs="?", default="auto",
+                        help="last game ID, or 'auto' to stop at the newest game (default)")
+    parser.add_argument("-a", "--archive", default="jarchive.csv", help="the archive CSV to append to")
+    parser.add_argument("-l", "--last-episode", default="last_episode.txt",
+                        help="file holding the highest game ID in the archive")
+    parser.add_argument("-o", "--new-csv", metavar="<file>",
+                        help="also write the new clues to this CSV (e.g. for the search index)")
+    parser.add_argument("-w", "--workers", type=int, default=1, metavar="N",
+                        help="number of parser processes (default: 1, 0 = one per CPU)")
+    parser.add_argument("-e", "--engine", choices=ENGINES, default="lxml",
+                        help="clue extractor to use (default: lxml)")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND,
+                        help="requests per second across all connections")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY,
+                        help="maximum concurrent requests")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES,
+                        help="retries for 5xx responses and timeouts")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="pages held between download and parse (default: %(default)s)")
+    parser.add_argument("--url-template", default=GAME_URL,
+                        help="game URL with a {game_id} placeholder (e.g. a local test server)")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL, metavar="<file>",
+                        help="download journal used to retry failed games (default: %(default)s)")
+    parser.add_argument("--no-journal", action="store_true", help="do not read or write a journal")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    last_episode = read_last_episode(args.last_episode)
+    start_id = args.start_id if args.start_id is not None else (last_episode or 0) + 1
+    if last_episode is not None and start_id <= last_episode:
+        parser.error(f"game {start_id} is not past the last episode ({last_episode}); "
+                     "use merge_archive.py to merge overlapping games")
+    end_id = None if args.end_id == "auto" else int(args.end_id)
+
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    journal = None if args.no_journal else DownloadJournal(args.journal, KNOWN_MISSING_GAMES)
+    with metrics.instrumented(args), metrics.span("pipeline"):
+        games, clues, failed = run(start_id, end_id, args.archive, args.last_episode, args.new_csv,
+                                   workers, args.engine, args.rate, args.concurrency, args.retries,
+                                   args.url_template, args.queue_size, journal)
+    if games == 0:
+        print("No new games found")
+    if journal is not None:
+        print_summary(journal)
+        journal.close()
+    elif failed:
+        # Nothing records these games for a retry, so make the failure visible
+        sys.exit(f"{len(failed)} game(s) failed to download")
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Quiz server: many players on one asyncio process sharing one loaded corpus
+
+`python jeopardy.py` loads the archive for a single player. The server loads
+the playable clues (`jeopardy.read_jarchive`) and the answer bigram profiles
+(`answer_matcher`) once, then plays an independent game on every connection,
+each with its own score, clue count, filters and random stream, like
+`jeopardy.main`. With near-duplicate clusters from `clue_dedup`, a session
+is not served two clues of the same cluster.
+
+The protocol is one command per line, answered by one JSON object per line:
+
+    CLUE                  draw a clue: {"category", "value", "question", "count"}
+    ANSWER <response>     grade the pending clue: {"correct", "answer", "similarity", "score"}
+    ROUND [1|2|3]         only play this round (no argument: any round)
+    VALUE [N]             only play clues of this value
+    CATEGORY [text]       only play categories whose name contains the text, ignoring case
+    SCORE                 {"score", "count"}
+    STATS                 server-wide counters, CPU time and grading latency
+    QUIT                  {"score", "count"} and close
+
+Errors come back as {"error": "..."}. `python quiz_server.py loadtest` opens
+many concurrent sessions against a running server and reports the round
+trip and server-side grading latency and sessions per CPU core.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import clue_dedup
+import metrics
+from answer_matcher import AnswerMatcher
+from columnar_archive import is_fresh
+from jeopardy import ARCHIVE_CSV, DEFAULT_VALUE, compare_strings, read_jarchive, sanitize
+from sharded_archive import parse_years
+
+DEFAULT_PORT = 8770
+ANSWER_PROFILES = "jarchive_answers.npz"
+# A response scoring at least this against the reference answer is correct
+CORRECT_SIMILARITY = 0.5
+# Distinct (round, value, category) selections kept by the corpus
+SELECTION_CACHE = 64
+# Draws per clue before a session accepts a repeat of a clue it has seen
+MAX_REDRAWS = 20
+# Latest grading times kept for the STATS percentiles
+GRADE_WINDOW = 4096
+
+class Corpus:
+    """The playable clues as arrays, shared read-only by every session."""
+
+    def __init__(self, df, matcher, clusters=None):
+        self.categories = df['category'].astype('category')
+        self.category_codes = self.categories.cat.codes.to_numpy()
+        self.category_names = [str(name) for name in self.categories.cat.categories]
+        self.rnd = df['rnd'].to_numpy()
+        self.value = df['value'].to_numpy()
+        self.text = df['text'].to_numpy()
+        self.answer = df['answer'].astype(str).str.strip().to_numpy()
+        self.matcher = matcher
+        # -1 marks answers missing from stale profiles; those are graded with compare_strings
+        self.answer_ids = np.fromiter((matcher.ids.get(answer, -1) for answer in self.answer),
+                                      np.int64, len(self.answer))
+        # {document key: cluster} of the clues that have near-duplicates
+        self.clusters = clusters or {}
+        self._selections = OrderedDict()
+
+    def __len__(self):
+        return len(self.text)
+
+    def select(self, rnd=None, value=None, category=None):
+        """Return the rows of a round, value and category (any part of its name, ignoring case)."""
+        key = (rnd, value, category.lower() if category else None)
+        rows = self._selections.get(key)
+        if rows is not None:
+            self._selections.move_to_end(key)
+            return rows
+
+        mask = np.ones(len(self), dtype=bool)
+        if rnd is not None:
+            mask &= self.rnd == rnd
+        if value is not None:
+            mask &= self.value == value
+        if category:
+            wanted = category.lower()
+            codes = [i for i, name in enumerate(self.category_names) if wanted in name.lower()]
+            mask &= np.isin(self.category_codes, codes)
+        rows = np.flatnonzero(mask)
+        self._selections[key] = rows
+        if len(self._selections) > SELECTION_CACHE:
+            self._selections.popitem(last=False)
+        return rows
+
+    def clue(self, row):
+        """Return (category, question, answer, value) of a row, like `jeopardy.get_one_question`."""
+        category = self.category_names[self.category_codes[row]]
+        return category, self.text[row], self.answer[row], int(self.value[row]) or DEFAULT_VALUE
+
+    def cluster(self, row):
+        """Return the near-duplicate cluster of a row, or None."""
+        if not self.clusters:
+            return None
+        return self.clusters.get(clue_dedup.document_key(clue_dedup.document(self.text[row], self.answer[row])))
+
+    def similarity(self, response, row):
+        """Return the similarity of a response to the answer of a row, 0.0 to 1.0."""
+        answer_id = self.answer_ids[row]
+        if answer_id >= 0:
+            return self.matcher.score(response, answer_id)
+        sresponse, sanswer = sanitize(response), sanitize(self.answer[row])
+        if sresponse == sanswer:
+            return 1.0 if sresponse else 0.0
+        try:
+            return compare_strings(sresponse, sanswer)
+        except ZeroDivisionError:
+            # Neither string has a character pair (one letter, or nothing left after sanitizing)
+            return 0.0
+
+def load_corpus(csv_path=ARCHIVE_CSV, profiles_path=ANSWER_PROFILES, years=None,
+                signatures_path=clue_dedup.DEFAULT_SIGNATURES, threshold=clue_dedup.THRESHOLD):
+    """Load the playable clues, their answer profiles and near-duplicate clusters.
+
+    Profiles are read from `profiles_path` when it is not older than the
+    archive, otherwise built from the loaded answers. Clusters are computed
+    from `signatures_path` when it exists.
+    """
+    df = read_jarchive(csv_path, years=years)
+    if profiles_path and is_fresh(profiles_path, csv_path):
+        matcher = AnswerMatcher.load(profiles_path)
+    else:
+        matcher = AnswerMatcher(df['answer'].astype(str).str.strip())
+    clusters = None
+    if signatures_path and os.path.exists(signatures_path):
+        clusters = clue_dedup.Signatures.load(signatures_path).document_clusters(threshold)
+    return Corpus(df, matcher, clusters)
+
+class Session:
+    """The game of one connection: score, clue count, filters, the pending clue
+    and the near-duplicate clusters already served."""
+
+    def __init__(self, corpus, seed=None):
+        self.corpus = corpus
+        self.rng = random.Random(seed)
+        self.score = 0
+        self.count = 0
+        self.rnd = None
+        self.value = None
+        self.category = None
+        self.pending = None
+        self.served = set()
+
+    def next_clue(self):
+        rows = self.corpus.select(self.rnd, self.value, self.category)
+        if not len(rows):
+            return {"error": "no clues match the filters"}
+        for _ in range(MAX_REDRAWS):
+            self.pending = int(rows[self.rng.randrange(len(rows))])
+            cluster = self.corpus.cluster(self.pending)
+            if cluster is None or cluster not in self.served:
+                break
+        if cluster is not None:
+            self.served.add(cluster)
+        category, question, answer, value = self.corpus.clue(self.pending)
+        return {"category": category, "value": value, "question": question, "count": self.count + 1}
+
+    def answer(self, response):
+        """Grade a response to the pending clue the way `jeopardy.new_question` does."""
+        if self.pending is None:
+            return {"error": "no clue to answer; send CLUE"}
+        row, self.pending = self.pending, None
+        category, question, answer, value = self.corpus.clue(row)
+        self.count += 1
+        if not response:
+            # An empty response passes on the clue without changing the score
+            return {"correct": False, "answer": answer, "similarity": 0.0, "score": self.score}
+
+        start = time.perf_counter()
+        similarity = self.corpus.similarity(response, row)
+        metrics.observe("quiz_grade_seconds", time.perf_counter() - start, window=GRADE_WINDOW)
+        correct = similarity >= CORRECT_SIMILARITY
+        self.score += value if correct else -value
+        metrics.count("quiz_answers_total", correct=str(correct).lower())
+        return {"correct": correct, "answer": answer, "similarity": round(similarity, 3), "score": self.score}
+
+    def set_filter(self, name, argument):
+        """Set or clear the round, value or category filter."""
+        if name == "category":
+            self.category = argument or None
+        elif not argument:
+            setattr(self, "rnd" if name == "round" else name, None)
+        elif argument.isdigit():
+            setattr(self, "rnd" if name == "round" else name, int(argument))
+        else:
+            return {"error": f"{name} must be a number"}
+        rows = self.corpus.select(self.rnd, self.value, self.category)
+        return {"round": self.rnd, "value": self.value, "category": self.category, "clues": len(rows)}
+
+def stats():
+    """Return the server-wide counters and grading latency."""
+    registry = metrics.REGISTRY.to_dict()
+    grade = registry["histograms"].get("quiz_grade_seconds", {})
+    return {"cpu_seconds": time.process_time(), "counters": registry["counters"],
+            "gauges": registry["gauges"],
+            "grade_seconds": {key: grade.get(key) for key in ("count", "mean", "p50", "p99", "max")}}
+
+class QuizServer:
+    """Line protocol front end; one `Session` per connection."""
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.active = 0
+
+    def handle(self, session, line):
+        """Return (reply, keep the connection open) for one command line."""
+        command, _, argument = line.strip().partition(" ")
+        command = command.upper()
+        argument = argument.strip()
+        if command == "CLUE":
+            return session.next_clue(), True
+        if command == "ANSWER":
+            return session.answer(argument), True
+        if command in ("ROUND", "VALUE", "CATEGORY"):
+            return session.set_filter(command.lower(), argument), True
+        if command == "SCORE":
+            return {"score": session.score, "count": session.count}, True
+        if command == "STATS":
+            return stats(), True
+        if command == "QUIT":
+            return {"score": session.score, "count": session.count}, False
+        return {"error": f"unknown command {command!r}; use CLUE, ANSWER, ROUND, VALUE, "
+                         f"CATEGORY, SCORE, STATS or QUIT"}, True
+
+    async def serve_client(self, reader, writer):
+        session = Session(self.corpus)
+        self.active += 1
+        metrics.count("quiz_sessions_total")
+        metrics.gauge("quiz_sessions_active", self.active)
+        try:
+            writer.write((json.dumps({"clues": len(self.corpus)}) + "\n").encode('utf-8'))
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply, keep_open = self.handle(session, line.decode('utf-8', errors='replace'))
+                except Exception as e:
+                    # One bad command must not end the session
+                    print(f"Error handling {line[:80]!r}: {e!r}", file=sys.stderr)
+                    reply, keep_open = {"error": "internal error"}, True
+                writer.write((json.dumps(reply) + "\n").encode('utf-8'))
+                await writer.drain()
+                if not keep_open:
+                    break
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            self.active -= 1
+            metrics.gauge("quiz_sessions_active", self.active)
+            writer.close()
+
+async def serve(corpus, host, port):
+    """Serve sessions until interrupted or sent SIGTERM."""
+    server = await asyncio.start_server(QuizServer(corpus).serve_client, host, port)
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    print(f"Serving {len(corpus):,} clues on {host}:{port}", file=sys.stderr)
+    async with server:
+        await stop.wait()
+
+async def _request(reader, writer, line):
+    writer.write((line + "\n").encode('utf-8'))
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+async def _play(host, port, clues, latencies, seed):
+    """Play one session of `clues` clues; append the ANSWER round trip times to `latencies`."""
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    await reader.readline()
+    if rng.random() < 0.25:
+        await _request(reader, writer, f"ROUND {rng.randint(1, 2)}")
+    response = "george washington"
+    for _ in range(clues):
+        clue = await _request(reader, writer, "CLUE")
+        if "error" in clue:
+            break
+        start = time.perf_counter()
+        result = await _request(reader, writer, f"ANSWER {response}")
+        latencies.append(time.perf_counter() - start)
+        # Half the time the next response is the reference answer just seen, which is mostly wrong
+        response = result["answer"] if rng.random() < 0.5 else rng.choice(("abraham lincoln", "paris", "x"))
+    await _request(reader, writer, "QUIT")
+    writer.close()
+
+async def load_test(host, port, sessions, concurrency, clues):
+    """Run `sessions` sessions, `concurrency` at a time; print latency and throughput."""
+    reader, writer = await asyncio.open_connection(host, port)
+    await reader.readline()
+    before = await _request(reader, writer, "STATS")
+
+    latencies = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def bounded(i):
+        async with limit:
+            await _play(host, port, clues, latencies, i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    after = await _request(reader, writer, "STATS")
+    await _request(reader, writer, "QUIT")
+    writer.close()
+
+    latencies.sort()
+    cpu = after["cpu_seconds"] - before["cpu_seconds"]
+    print(f"{sessions:,} sessions of {clues} clues, {concurrency} concurrent, in {elapsed:.2f}s "
+          f"({sessions / elapsed:,.0f} sessions/sec, {len(latencies) / elapsed:,.0f} answers/sec)")
+    if latencies:
+        print(f"ANSWER round trip: p50 {latencies[len(latencies) // 2] * 1e3:.2f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.2f} ms, max {latencies[-1] * 1e3:.2f} ms")
+    grade = after["grade_seconds"]
+    if grade["count"]:
+        print(f"Server grading: p50 {grade['p50'] * 1e6:.0f} us, p99 {grade['p99'] * 1e6:.0f} us "
+              f"over {grade['count']:,} answers since start")
+    if cpu > 0:
+        print(f"Server CPU {cpu:.2f}s: {sessions / cpu:,.0f} sessions and "
+              f"{len(latencies) / cpu:,.0f} answers per core-second")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the quiz to many players, or load-test a server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_cmd = commands.add_parser("serve", help="load the corpus once and serve sessions")
+    serve_cmd.add_argument("archive", nargs="?", default=ARCHIVE_CSV)
+    serve_cmd.add_argument("-p", "--profiles", default=ANSWER_PROFILES,
+                           help="answer profiles, built in memory when missing or stale (default: %(default)s)")
+    serve_cmd.add_argument("--years", type=parse_years, metavar="YEARS",
+                           help="only serve clues that aired in these years, e.g. 2004 or 1990-1999")
+    serve_cmd.add_argument("-s", "--signatures", default=clue_dedup.DEFAULT_SIGNATURES,
+                           help="clue signatures of clue_dedup.py; clues near-duplicating one a session "
+                                "has seen are not served again (default: %(default)s, when it exists)")
+    serve_cmd.add_argument("-t", "--threshold", type=float, default=clue_dedup.THRESHOLD,
+                           help="similarity of near-duplicate clues (default: %(default)s)")
+    metrics.add_arguments(serve_cmd)
+    load_cmd = commands.add_parser("loadtest", help="play many concurrent sessions against a server")
+    load_cmd.add_argument("-n", "--sessions", type=int, default=1000)
+    load_cmd.add_argument("-c", "--concurrency", type=int, default=100, help="sessions open at once")
+    load_cmd.add_argument("--clues", type=int, default=10, help="clues answered per session")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        with metrics.instrumented(args):
+            start = time.perf_counter()
+            corpus = load_corpus(args.archive, args.profiles, args.years, args.signatures, args.threshold)
+            print(f"Loaded {len(corpus):,} clues and {len(corpus.matcher):,} answer profiles "
+                  f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            try:
+                asyncio.run(serve(corpus, args.host, args.port))
+            except KeyboardInterrupt:
+                pass
+    else:
+        asyncio.run(load_test(args.host, args.port, args.sessions, args.concurrency, args.clues))
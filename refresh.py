@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Re-fetch archived games and patch the ones whose pages changed
+
+J! Archive pages are edited after they are first published (corrected
+responses, newly transcribed games). A refresh sweep requests each game with
+the validators of its last fetch (If-None-Match / If-Modified-Since) and
+gzip transfer encoding, so unchanged pages cost a 304 or a compressed body.
+A page whose sha256 matches the last fetch is not parsed at all; the rest
+are parsed, compared with the archive, and only games whose clues differ
+are replaced (whole game at a time) in one streaming pass over jarchive.csv.
+
+Validators are kept in a small SQLite database and only updated after the
+archive has been patched, so an interrupted sweep is simply repeated.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures as futures
+import gzip
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+from archive_format import normalize
+from async_download import AsyncDownloader
+from download_new_episodes import ERROR_MSG, GAME_URL, MAX_CONCURRENCY, MAX_RETRIES, REQUESTS_PER_SECOND
+from merge_archive import iter_games, merge_games, read_last_episode, read_rows
+from parse_and_create_csv import ENGINES, parse_page
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS validators (
+    gid INTEGER PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    digest TEXT NOT NULL,
+    checked REAL NOT NULL
+)
+"""
+
+class ValidatorStore:
+    """ETag, Last-Modified and content hash of the last fetch of each game."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load(self, game_ids):
+        """Return {gid: (etag, last_modified, digest)} for the given games."""
+        wanted = set(game_ids)
+        rows = self.conn.execute("SELECT gid, etag, last_modified, digest FROM validators")
+        return {gid: (etag, modified, digest) for gid, etag, modified, digest in rows if gid in wanted}
+
+    def save(self, validators):
+        """Store {gid: (etag, last_modified, digest)}."""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO validators (gid, etag, last_modified, digest, checked) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(gid, *values, now) for gid, values in validators.items()])
+
+    def close(self):
+        self.conn.close()
+
+class RefreshDownloader(AsyncDownloader):
+    """Conditional re-fetch of game pages; parses only pages that changed.
+
+    Outcomes are "unchanged" (304 or same hash), "changed", "missing" or
+    "failed". Parsed clues of changed pages end up in `changed`, their new
+    validators in `validators`. A changed page that parses to no clues (an
+    error or challenge page, or a layout the extractor misses) is "failed"
+    and keeps its old validators, so the archive is left alone and the game
+    is fetched again next time.
+    """
+
+    def __init__(self, url_template, known, executor, engine="lxml", **kwargs):
+        super().__init__(url_template, **kwargs)
+        self.known = known
+        self.executor = executor
+        self.engine = engine
+        self.changed = {}
+        self.validators = {}
+        self.not_modified = 0
+        self.bytes_received = 0
+
+    async def download_and_save(self, game_id, output_dir):
+        known = self.known.get(game_id)
+        headers = {"Accept-Encoding": "gzip"}
+        if known is not None:
+            etag, modified, digest = known
+            if etag:
+                headers["If-None-Match"] = etag
+            if modified:
+                headers["If-Modified-Since"] = modified
+
+        response = await self.fetch(game_id, headers)
+        if response is None:
+            return "failed"
+        self.bytes_received += len(response.body)
+        if response.status == 304:
+            self.not_modified += 1
+            return "unchanged"
+        if response.status != 200:
+            print(f"Invalid response for game {game_id}: HTTP {response.status}")
+            return "failed"
+
+        body = response.body
+        if response.headers.get("content-encoding", "").lower() == "gzip":
+            body = gzip.decompress(body)
+        if self.error_msg in body:
+            return "missing"
+
+        digest = hashlib.sha256(body).hexdigest()
+        self.validators[game_id] = (response.headers.get("etag"),
+                                    response.headers.get("last-modified"), digest)
+        if known is not None and known[2] == digest:
+            return "unchanged"
+
+        loop = asyncio.get_running_loop()
+        clues = await loop.run_in_executor(self.executor, parse_page, body, game_id, self.engine)
+        if not clues:
+            print(f"No clues parsed from game {game_id}; keeping the archived clues")
+            del self.validators[game_id]
+            return "failed"
+        self.changed[game_id] = clues
+        return "changed"
+
+def clue_rows(clues):
+    """Return the archive fields of parsed clues, as `merge_archive.read_rows` gives them."""
+    return [normalize(clue) for clue in clues]
+
+def find_differences(archive_path, games):
+    """Return the subset of {gid: rows} whose rows differ from the archive."""
+    differ = dict(games)
+    for gid, old_rows in iter_games(read_rows(archive_path)):
+        if gid in differ and differ[gid] == old_rows:
+            del differ[gid]
+    return differ
+
+def refresh(archive_path, validators_path, game_ids, workers=1, engine="lxml",
+            rate=REQUESTS_PER_SECOND, concurrency=MAX_CONCURRENCY, retries=MAX_RETRIES,
+            url_template=GAME_URL, dry_run=False):
+    """Re-fetch `game_ids` and patch changed games in the archive.
+
+    Returns the IDs of the games that were replaced.
+    """
+    start = time.perf_counter()
+    with ValidatorStore(validators_path) as store:
+        known = store.load(game_ids)
+        print(f"Refreshing {len(game_ids)} games ({len(known)} with validators) at {rate} requests/sec",
+              file=sys.stderr)
+
+        counts = {}
+        def on_result(game_id, outcome):
+            counts[outcome] = counts.get(outcome, 0) + 1
+            checked = sum(counts.values())
+            if checked % 100 == 0:
+                print(f"Checked {checked}/{len(game_ids)}: {counts}", file=sys.stderr)
+
+        with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            downloader = RefreshDownloader(url_template, known, executor, engine, rate=rate,
+                                           concurrency=concurrency, retries=retries, error_msg=ERROR_MSG)
+            downloader.download(game_ids, None, on_result)
+
+        fetched = time.perf_counter()
+        games = {gid: clue_rows(clues) for gid, clues in downloader.changed.items() if clues}
+        patches = find_differences(archive_path, games) if games else {}
+        print(f"Checked {len(game_ids)} games in {fetched - start:.1f}s: {counts}, "
+              f"{downloader.not_modified} not modified, {downloader.bytes_received / 1e6:.1f} MB received",
+              file=sys.stderr)
+        print(f"Parsed {len(games)} changed pages; {len(patches)} games have different clues",
+              file=sys.stderr)
+
+        if dry_run:
+            return sorted(patches)
+        if patches:
+            replaced = merge_games(archive_path, patches, replace=True)[2]
+            print(f"Replaced {len(patches)} games ({replaced:,} old clues) in {archive_path}: "
+                  f"{sorted(patches)[:10]}{'...' if len(patches) > 10 else ''}", file=sys.stderr)
+        # Only now that the archive holds the new clues can the validators move on
+        store.save(downloader.validators)
+    print(f"Done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return sorted(patches)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-fetch archived games and patch the ones that changed on J! Archive.",
+        epilog="Example: python refresh.py 9000 9302 --rate 2")
+    parser.add_argument("start_id", type=int, nargs="?", default=1, help="first game ID (default: 1)")
+    parser.add_argument("end_id", type=int, nargs="?", help="last game ID (default: the last episode)")
+    parser.add_argument("-a", "--archive", default="jarchive.csv", help="the archive CSV to patch")
+    parser.add_argument("-l", "--last-episode", default="last_episode.txt",
+                        help="file holding the highest game ID in the archive")
+    parser.add_argument("-v", "--validators", default="game_validators.db",
+                        help="SQLite file of per-game validators (default: %(default)s)")
+    parser.add_argument("-w", "--workers", type=int, default=1, metavar="N",
+                        help="number of parser processes (default: 1, 0 = one per CPU)")
+    parser.add_argument("-e", "--engine", choices=ENGINES, default="lxml",
+                        help="clue extractor to use (default: lxml)")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND,
+                        help="requests per second across all connections")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY,
+                        help="maximum concurrent requests")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES,
+                        help="retries for 5xx responses and timeouts")
+    parser.add_argument("--url-template", default=GAME_URL,
+                        help="game URL with a {game_id} placeholder (e.g. a local test server)")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="report the games that changed without patching the archive")
+    args = parser.parse_args()
+
+    end_id = args.end_id if args.end_id is not None else read_last_episode(args.last_episode)
+    if end_id is None:
+        parser.error(f"no end ID given and {args.last_episode} is unreadable")
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    refresh(args.archive, args.validators, list(range(args.start_id, end_id + 1)), workers,
+            args.engine, args.rate, args.concurrency, args.retries, args.url_template, args.dry_run)
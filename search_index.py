@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Full-text search over the clues of jarchive.csv
+
+Clues are stored in a SQLite database with an FTS5 index over text, answer
+and category. Queries use FTS5 syntax (keywords, "quoted phrases", AND/OR/NOT,
+prefix*) and are ranked with BM25; results can be filtered by round, airdate
+range and value. `update` replaces the clues of the games in a newly parsed
+CSV, so the index can follow the weekly update without a rebuild.
+"""
+
+import argparse
+import sqlite3
+import sys
+import time
+from itertools import groupby
+
+from archive_format import parse_value
+from merge_archive import read_rows, row_gid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clues (
+    id INTEGER PRIMARY KEY,
+    gid INTEGER NOT NULL,
+    airdate TEXT NOT NULL,
+    rnd INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    answer TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clues_gid ON clues (gid);
+CREATE VIRTUAL TABLE IF NOT EXISTS clues_fts USING fts5 (
+    text, answer, category, content='clues', content_rowid='id',
+    tokenize='porter unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS clues_ai AFTER INSERT ON clues BEGIN
+    INSERT INTO clues_fts (rowid, text, answer, category)
+    VALUES (new.id, new.text, new.answer, new.category);
+END;
+CREATE TRIGGER IF NOT EXISTS clues_ad AFTER DELETE ON clues BEGIN
+    INSERT INTO clues_fts (clues_fts, rowid, text, answer, category)
+    VALUES ('delete', old.id, old.text, old.answer, old.category);
+END;
+"""
+
+# BM25 column weights for text, answer and category
+RANK_WEIGHTS = (1.0, 2.0, 0.5)
+
+INSERT_SQL = """
+INSERT INTO clues (gid, airdate, rnd, category, value, text, answer)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _clue_row(fields):
+    rnd = int(fields[2]) if fields[2].isdigit() else 0
+    return (row_gid(fields), fields[1], rnd, fields[3], parse_value(fields[4]),
+            fields[5], fields[6])
+
+class SearchIndex:
+    """SQLite FTS5 index of archive clues."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def build(self, archive_path):
+        """Index every clue of the archive, replacing any existing contents."""
+        with self.conn:
+            self.conn.execute("DELETE FROM clues")
+            self.conn.execute("INSERT INTO clues_fts (clues_fts) VALUES ('delete-all')")
+            self.conn.executemany(INSERT_SQL, (_clue_row(fields) for fields in read_rows(archive_path)))
+        self.optimize()
+        return self.count()
+
+    def update(self, new_csv_path):
+        """Replace the clues of every game in `new_csv_path`; return (games, clues)."""
+        games = clues = 0
+        with self.conn:
+            for gid, rows in groupby(read_rows(new_csv_path), key=row_gid):
+                rows = [_clue_row(fields) for fields in rows]
+                self.conn.execute("DELETE FROM clues WHERE gid = ?", (gid,))
+                self.conn.executemany(INSERT_SQL, rows)
+                games += 1
+                clues += len(rows)
+        return games, clues
+
+    def optimize(self):
+        """Merge the FTS index segments for faster queries."""
+        with self.conn:
+            self.conn.execute("INSERT INTO clues_fts (clues_fts) VALUES ('optimize')")
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM clues").fetchone()[0]
+
+    def search(self, query, rnd=None, since=None, until=None, min_value=None,
+               max_value=None, limit=20, phrase=False):
+        """Return the best matching clues as a list of dicts, best first.
+
+        `since` and `until` are inclusive YYYY-MM-DD airdates. With `phrase`
+        the whole query is matched as one phrase instead of FTS5 syntax.
+        """
+        if phrase:
+            query = '"' + query.replace('"', '""') + '"'
+        sql = [f"""
+            SELECT c.gid, c.airdate, c.rnd, c.category, c.value, c.text, c.answer,
+                   bm25(clues_fts, {', '.join(map(str, RANK_WEIGHTS))}) AS score
+            FROM clues_fts JOIN clues AS c ON c.id = clues_fts.rowid
+            WHERE clues_fts MATCH ?"""]
+        params = [query]
+        for clause, value in (("c.rnd = ?", rnd), ("c.airdate >= ?", since),
+                              ("c.airdate <= ?", until), ("c.value >= ?", min_value),
+                              ("c.value <= ?", max_value)):
+            if value is not None:
+                sql.append(f"AND {clause}")
+                params.append(value)
+        sql.append("ORDER BY score LIMIT ?")
+        params.append(limit)
+        return [dict(row) for row in self.conn.execute(" ".join(sql), params)]
+
+    def close(self):
+        self.conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, update or query the clue search index.")
+    parser.add_argument("-i", "--index", default="jarchive_search.db", help="the index database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_cmd = commands.add_parser("build", help="index a whole archive CSV")
+    build_cmd.add_argument("archive", nargs="?", default="jarchive.csv")
+
+    update_cmd = commands.add_parser("update", help="re-index the games in a new clues CSV")
+    update_cmd.add_argument("new_csv")
+
+    query_cmd = commands.add_parser("query", help="search the index")
+    query_cmd.add_argument("query", help="FTS5 query, e.g. 'hamlet' or '\"prince of denmark\"'")
+    query_cmd.add_argument("-p", "--phrase", action="store_true", help="match the query as one phrase")
+    query_cmd.add_argument("-r", "--round", type=int, choices=(1, 2, 3), dest="rnd")
+    query_cmd.add_argument("--from", dest="since", metavar="YYYY-MM-DD", help="earliest airdate")
+    query_cmd.add_argument("--to", dest="until", metavar="YYYY-MM-DD", help="latest airdate")
+    query_cmd.add_argument("--min-value", type=int)
+    query_cmd.add_argument("--max-value", type=int)
+    query_cmd.add_argument("-n", "--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    with SearchIndex(args.index) as index:
+        start = time.perf_counter()
+        if args.command == "build":
+            print(f"Indexed {index.build(args.archive):,} clues in {time.perf_counter() - start:.1f}s",
+                  file=sys.stderr)
+        elif args.command == "update":
+            games, clues = index.update(args.new_csv)
+            print(f"Re-indexed {clues:,} clues from {games} games in {time.perf_counter() - start:.1f}s",
+                  file=sys.stderr)
+        else:
+            results = index.search(args.query, args.rnd, args.since, args.until,
+                                   args.min_value, args.max_value, args.limit, args.phrase)
+            for r in results:
+                print(f"{r['gid']} || {r['airdate']} || {r['rnd']} || {r['category']} || "
+                      f"{r['value']} || {r['text']} || {r['answer']}")
+            print(f"{len(results)} results in {(time.perf_counter() - start) * 1000:.1f} ms",
+                  file=sys.stderr)
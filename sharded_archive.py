@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Split jarchive.csv into one shard per air year, described by a manifest
+
+A shard is an ordinary || separated archive file (same header, games in game
+ID order) holding every game that aired in one calendar year; games with an
+unreadable airdate go to an "undated" shard. manifest.json lists, for each
+shard, its file, game ID and airdate ranges, game and row counts, size and
+sha256, so a loader can pick the shards a query needs without opening the
+others and check that what it reads is what the manifest describes.
+
+Game IDs are assigned as games are transcribed, not in air order, so the game
+ID ranges of different years overlap; looking a game up by ID reads every
+shard whose range contains it.
+
+A weekly update only touches the shards of the years its games aired in,
+normally just the newest one.
+
+The shards and manifest are the copy of the archive kept in git, since every
+shard stays far below GitHub's 100 MB file limit; jarchive.csv is rebuilt
+from them with `join` for the tools that read a single file. Lines that are
+not valid rows are carried through `build` and `join` unchanged.
+"""
+
+import argparse
+import concurrent.futures as futures
+import hashlib
+import heapq
+import json
+import os
+import sys
+import time
+
+from merge_archive import (HEADER, append_games, format_row, iter_games_keeping_malformed, load_new_games,
+                           merge_games, read_rows)
+
+DEFAULT_SHARD_DIR = "jarchive_shards"
+MANIFEST = "manifest.json"
+UNDATED = "undated"
+
+def shard_key(airdate):
+    """Return the shard of a game from its airdate, e.g. '2004' for 2004-12-31."""
+    year = airdate[:4]
+    return year if len(airdate) == 10 and year.isdigit() else UNDATED
+
+def shard_file(key):
+    return f"jarchive_{key}.csv"
+
+def describe(path):
+    """Return the manifest entry of a shard file by reading it."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    gids = set()
+    airdates = []
+    rows = 0
+    for fields in read_rows(path):
+        gids.add(int(fields[0]) if fields[0].isdigit() else 0)
+        airdates.append(fields[1])
+        rows += 1
+    return {"file": os.path.basename(path), "min_gid": min(gids, default=None),
+            "max_gid": max(gids, default=None), "first_airdate": min(airdates, default=None),
+            "last_airdate": max(airdates, default=None), "games": len(gids), "rows": rows,
+            "bytes": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+def read_manifest(shard_dir):
+    """Return {shard key: entry} from the manifest of `shard_dir`."""
+    with open(os.path.join(shard_dir, MANIFEST), 'r', encoding='utf-8') as f:
+        return json.load(f)["shards"]
+
+def write_manifest(shard_dir, shards):
+    path = os.path.join(shard_dir, MANIFEST)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"format": 1, "partition": "year", "updated": round(time.time()),
+                   "shards": dict(sorted(shards.items()))}, f, indent=1)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+def build(archive_path, shard_dir):
+    """Split an archive into year shards in one pass; return the manifest entries."""
+    os.makedirs(shard_dir, exist_ok=True)
+    outputs = {}
+    try:
+        for gid, rows, malformed in iter_games_keeping_malformed(read_rows(archive_path, keep_malformed=True)):
+            key = shard_key(rows[0][1]) if rows else UNDATED
+            out = outputs.get(key)
+            if out is None:
+                out = outputs[key] = open(os.path.join(shard_dir, shard_file(key) + ".tmp"), 'w',
+                                          encoding='utf-8')
+                out.write(HEADER)
+            out.writelines(format_row(fields) for fields in rows)
+            out.writelines(line + "\n" for line in malformed)
+    finally:
+        for out in outputs.values():
+            out.close()
+
+    shards = {}
+    for key in outputs:
+        path = os.path.join(shard_dir, shard_file(key))
+        os.replace(path + ".tmp", path)
+        shards[key] = describe(path)
+    # Shards of an earlier build that no longer have any games
+    if os.path.exists(os.path.join(shard_dir, MANIFEST)):
+        for key, entry in read_manifest(shard_dir).items():
+            if key not in shards and os.path.exists(os.path.join(shard_dir, entry["file"])):
+                os.remove(os.path.join(shard_dir, entry["file"]))
+    write_manifest(shard_dir, shards)
+    return shards
+
+def update(shard_dir, new_csv_path):
+    """Merge newly parsed clues into the shards of their air years.
+
+    A shard whose games all precede the new ones is appended to; otherwise
+    it is stream-merged like `merge_archive.merge_games`. Returns the keys
+    of the shards that were written.
+    """
+    shards = read_manifest(shard_dir)
+    by_shard = {}
+    for gid, rows in load_new_games(new_csv_path).items():
+        by_shard.setdefault(shard_key(rows[0][1]), {})[gid] = rows
+
+    for key, games in sorted(by_shard.items()):
+        entry = shards.get(key)
+        path = os.path.join(shard_dir, shard_file(key))
+        if entry is None or entry["max_gid"] is None or min(games) > entry["max_gid"]:
+            append_games(path, games)
+        else:
+            merge_games(path, games)
+        shards[key] = describe(path)
+        print(f"Updated shard {key}: {len(games)} new games, {shards[key]['rows']:,} rows in all", file=sys.stderr)
+    write_manifest(shard_dir, shards)
+    return sorted(by_shard)
+
+def verify(shard_dir):
+    """Return the keys of shards whose file does not match the manifest."""
+    bad = []
+    for key, entry in read_manifest(shard_dir).items():
+        path = os.path.join(shard_dir, entry["file"])
+        if not os.path.exists(path) or describe(path) != entry:
+            bad.append(key)
+    return bad
+
+def parse_years(text):
+    """Parse a year selection such as '2004', '2001-2004' or '1984,2001-2003'."""
+    years = set()
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        years.update(range(int(first), int(last or first) + 1))
+    return years
+
+def select(shards, years=None, gids=None):
+    """Return the shard keys needed for the given air years and game IDs (all by default)."""
+    keys = []
+    for key, entry in sorted(shards.items()):
+        if years is not None and (key == UNDATED or int(key) not in years):
+            continue
+        if gids is not None and not any(entry["min_gid"] is not None and
+                                        entry["min_gid"] <= gid <= entry["max_gid"] for gid in gids):
+            continue
+        keys.append(key)
+    return keys
+
+def shard_paths(shard_dir, years=None, gids=None):
+    """Return the files of the shards needed for a query, in shard order."""
+    shards = read_manifest(shard_dir)
+    return [os.path.join(shard_dir, shards[key]["file"]) for key in select(shards, years, gids)]
+
+def map_shards(func, paths, workers=None):
+    """Apply `func` to each shard path, in parallel processes; results are in path order."""
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        return [func(path) for path in paths]
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, paths))
+
+def join(shard_dir, archive_path):
+    """Rebuild a single archive file from the shards; return the row count.
+
+    Each shard is in game ID order, so the shards are merged one game at a
+    time rather than loaded whole.
+    """
+    shards = [iter_games_keeping_malformed(read_rows(path, keep_malformed=True))
+              for path in shard_paths(shard_dir)]
+    rows_written = 0
+    tmp_path = archive_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        out.write(HEADER)
+        for gid, rows, malformed in heapq.merge(*shards, key=lambda game: game[0]):
+            out.writelines(format_row(fields) for fields in rows)
+            out.writelines(line + "\n" for line in malformed)
+            rows_written += len(rows)
+    os.replace(tmp_path, archive_path)
+    return rows_written
+
+def print_shards(shards):
+    for key, entry in sorted(shards.items()):
+        print(f"{key:8} {entry['file']:24} games {entry['min_gid']}-{entry['max_gid']} "
+              f"{entry['first_airdate']}..{entry['last_airdate']} {entry['games']:5} games "
+              f"{entry['rows']:7,} rows {entry['bytes'] / 1e6:6.1f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, update and check the year shards of the archive.")
+    parser.add_argument("-d", "--shard-dir", default=DEFAULT_SHARD_DIR,
+                        help="directory of the shards and manifest.json (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_cmd = commands.add_parser("build", help="split an archive into year shards")
+    build_cmd.add_argument("archive", nargs="?", default="jarchive.csv")
+    update_cmd = commands.add_parser("update", help="merge newly parsed clues into their shards")
+    update_cmd.add_argument("new_csv")
+    commands.add_parser("list", help="print the manifest")
+    commands.add_parser("verify", help="check the shard files against the manifest")
+    join_cmd = commands.add_parser("join", help="rebuild a single archive file from the shards")
+    join_cmd.add_argument("archive")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "build":
+        shards = build(args.archive, args.shard_dir)
+        print_shards(shards)
+        print(f"Wrote {len(shards)} shards to {args.shard_dir} in {time.perf_counter() - start:.1f}s",
+              file=sys.stderr)
+    elif args.command == "update":
+        update(args.shard_dir, args.new_csv)
+    elif args.command == "list":
+        print_shards(read_manifest(args.shard_dir))
+    elif args.command == "verify":
+        bad = verify(args.shard_dir)
+        if bad:
+            print(f"Shards that do not match the manifest: {', '.join(bad)}", file=sys.stderr)
+            sys.exit(1)
+        print("All shards match the manifest", file=sys.stderr)
+    else:
+        rows = join(args.shard_dir, args.archive)
+        print(f"Wrote {rows:,} rows to {args.archive}", file=sys.stderr)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Aggregate statistics of jarchive.csv, kept in SQLite and updated game by game
+
+The cube table holds one row per (air year, month, round, value, category)
+with the number of clues, playable clues, Daily Doubles and the sum of their
+wagers; answer counts are kept per (sanitized answer, year) and games per
+game ID with their airdate. Queries group and sum these rows, so they never
+read the archive.
+
+The archive has no Daily Double flag: a clue of round 1 or 2 counts as one
+when its value is not one of the round's board values, taken as the values
+at least three clues of that round share (Daily Double wagers rarely repeat).
+A wager equal to a board value is missed.
+
+Seasons start in September; season 1 began in September 1984.
+
+`update` adds the games of a newly parsed CSV. Games already counted are
+skipped, since their old rows are not kept; `build` recounts everything.
+"""
+
+import argparse
+import sqlite3
+import sys
+import time
+from collections import Counter
+
+from archive_format import UNPLAYABLE_ANSWER, UNPLAYABLE_TEXT, parse_value
+from jeopardy import sanitize
+from merge_archive import iter_games, read_rows
+
+DEFAULT_DB = "jarchive_stats.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS cube (
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    rnd INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    category_id INTEGER NOT NULL REFERENCES categories (id),
+    clues INTEGER NOT NULL,
+    playable INTEGER NOT NULL,
+    daily_doubles INTEGER NOT NULL,
+    wagers INTEGER NOT NULL,
+    PRIMARY KEY (year, month, rnd, value, category_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cube_category ON cube (category_id);
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    answer TEXT NOT NULL,
+    clues INTEGER NOT NULL,
+    PRIMARY KEY (key, year)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS games (
+    gid INTEGER PRIMARY KEY,
+    airdate TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    clues INTEGER NOT NULL
+);
+"""
+
+UPSERT_CUBE = """
+INSERT INTO cube (year, month, rnd, value, category_id, clues, playable, daily_doubles, wagers)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (year, month, rnd, value, category_id) DO UPDATE SET
+    clues = clues + excluded.clues, playable = playable + excluded.playable,
+    daily_doubles = daily_doubles + excluded.daily_doubles, wagers = wagers + excluded.wagers
+"""
+
+UPSERT_ANSWER = """
+INSERT INTO answers (key, year, answer, clues) VALUES (?, ?, ?, ?)
+ON CONFLICT (key, year) DO UPDATE SET clues = clues + excluded.clues
+"""
+
+MEASURES = ("clues", "playable", "daily_doubles", "average_wager")
+# Group-by dimensions of `StatsCube.rollup` and their SQL over the cube table
+DIMENSIONS = {
+    "year": "c.year",
+    "month": "c.year * 100 + c.month",
+    "season": "c.year - 1984 + (c.month >= 9)",
+    "round": "c.rnd",
+    "value": "c.value",
+    "category": "k.name",
+}
+
+def airdate_parts(airdate):
+    """Return (year, month) of a YYYY-MM-DD airdate, (0, 0) if it is not one."""
+    if len(airdate) == 10 and airdate[:4].isdigit() and airdate[5:7].isdigit():
+        return int(airdate[:4]), int(airdate[5:7])
+    return 0, 0
+
+def daily_doubles(rows):
+    """Return the indices of the rows that look like Daily Doubles (see the module docstring)."""
+    found = []
+    for rnd in ("1", "2"):
+        values = [(i, parse_value(fields[4])) for i, fields in enumerate(rows) if fields[2] == rnd]
+        counts = Counter(value for _, value in values)
+        found.extend(i for i, value in values if value and counts[value] < 3)
+    return found
+
+class StatsCube:
+    """Aggregate counts of archive clues in a SQLite database."""
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self._category_ids = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _category_id(self, name):
+        if self._category_ids is None:
+            self._category_ids = {row["name"]: row["id"] for row in self.conn.execute("SELECT id, name FROM categories")}
+        category_id = self._category_ids.get(name)
+        if category_id is None:
+            category_id = self.conn.execute("INSERT INTO categories (name) VALUES (?)", (name,)).lastrowid
+            self._category_ids[name] = category_id
+        return category_id
+
+    def _add(self, games):
+        """Count (gid, rows) games that are not counted yet; return (games added, games skipped)."""
+        counted = {row[0] for row in self.conn.execute("SELECT gid FROM games")}
+        cells = {}
+        answers = Counter()
+        spellings = {}
+        new_games = []
+        skipped = 0
+        for gid, rows in games:
+            if gid in counted:
+                skipped += 1
+                continue
+            counted.add(gid)
+            year, month = airdate_parts(rows[0][1])
+            new_games.append((gid, rows[0][1], year, month, len(rows)))
+            doubles = set(daily_doubles(rows))
+            for i, (_, _, rnd, category, value, text, answer) in enumerate(rows):
+                playable = text not in UNPLAYABLE_TEXT and answer not in UNPLAYABLE_ANSWER
+                value = parse_value(value)
+                key = (year, month, int(rnd) if rnd.isdigit() else 0, value, self._category_id(category))
+                # clues, playable, daily_doubles, wagers
+                cell = cells.setdefault(key, [0, 0, 0, 0])
+                cell[0] += 1
+                if playable:
+                    cell[1] += 1
+                    answer_key = sanitize(answer)
+                    answers[answer_key, year] += 1
+                    spellings.setdefault(answer_key, answer)
+                if i in doubles:
+                    cell[2] += 1
+                    cell[3] += value
+
+        self.conn.executemany(UPSERT_CUBE, (key + tuple(cell) for key, cell in cells.items()))
+        self.conn.executemany(UPSERT_ANSWER, ((key, year, spellings[key], count)
+                                              for (key, year), count in answers.items()))
+        self.conn.executemany("INSERT INTO games (gid, airdate, year, month, clues) VALUES (?, ?, ?, ?, ?)",
+                              new_games)
+        return len(new_games), skipped
+
+    def build(self, archive_path):
+        """Count every game of the archive, replacing any existing contents; return the games counted."""
+        with self.conn:
+            for table in ("cube", "answers", "games", "categories"):
+                self.conn.execute(f"DELETE FROM {table}")
+            self._category_ids = None
+            added, _ = self._add(iter_games(read_rows(archive_path)))
+        return added
+
+    def update(self, new_csv_path):
+        """Count the games of a newly parsed CSV; return (games added, games already counted)."""
+        with self.conn:
+            return self._add(iter_games(read_rows(new_csv_path)))
+
+    def rollup(self, by=("year",), rnd=None, value=None, category=None, years=None, order="clues", limit=None):
+        """Return the cube summed over everything but the `by` dimensions, as a list of dicts.
+
+        `by` names dimensions of DIMENSIONS; `category` matches any category
+        containing it, ignoring case; `years` is a (first, last) range. Each
+        row has the dimensions plus clues, playable, daily_doubles and
+        average_wager. Rows come in decreasing `order`, or by the dimensions
+        when `order` is None.
+        """
+        if order is not None and order not in MEASURES:
+            raise ValueError(f"cannot order by {order!r}; use one of {', '.join(MEASURES)}")
+        columns = [f"{DIMENSIONS[name]} AS {name}" for name in by]
+        sql = [f"""
+            SELECT {', '.join(columns + [''])} SUM(c.clues) AS clues, SUM(c.playable) AS playable,
+                   SUM(c.daily_doubles) AS daily_doubles,
+                   ROUND(1.0 * SUM(c.wagers) / NULLIF(SUM(c.daily_doubles), 0)) AS average_wager
+            FROM cube AS c JOIN categories AS k ON k.id = c.category_id WHERE 1"""]
+        params = []
+        for clause, param in (("c.rnd = ?", rnd), ("c.value = ?", value),
+                              ("k.name LIKE ?", f"%{category}%" if category else None),
+                              ("c.year >= ?", years[0] if years else None),
+                              ("c.year <= ?", years[1] if years else None)):
+            if param is not None:
+                sql.append(f"AND {clause}")
+                params.append(param)
+        if by:
+            sql.append(f"GROUP BY {', '.join(by)}")
+        sql.append(f"ORDER BY {order} DESC" if order else f"ORDER BY {', '.join(by)}" if by else "")
+        if limit:
+            sql.append("LIMIT ?")
+            params.append(limit)
+        return [dict(row) for row in self.conn.execute(" ".join(sql), params)]
+
+    def top_answers(self, years=None, limit=20):
+        """Return the most frequent answers as [(answer, clues)], `years` being a (first, last) range."""
+        sql = "SELECT MIN(answer) AS answer, SUM(clues) AS clues FROM answers"
+        params = []
+        if years:
+            sql += " WHERE year BETWEEN ? AND ?"
+            params.extend(years)
+        sql += " GROUP BY key ORDER BY clues DESC, key LIMIT ?"
+        return [(row["answer"], row["clues"]) for row in self.conn.execute(sql, params + [limit])]
+
+    def games_per_month(self, years=None):
+        """Return [(YYYY-MM, games, clues)] in month order."""
+        sql = "SELECT printf('%04d-%02d', year, month) AS month, COUNT(*) AS games, SUM(clues) AS clues FROM games"
+        params = []
+        if years:
+            sql += " WHERE year BETWEEN ? AND ?"
+            params.extend(years)
+        sql += " GROUP BY year, month ORDER BY year, month"
+        return [tuple(row) for row in self.conn.execute(sql, params)]
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*), SUM(clues) FROM games").fetchone()
+
+    def close(self):
+        self.conn.close()
+
+def parse_year_range(text):
+    """Parse '2004' or '2001-2004' into an inclusive (first, last) range."""
+    first, _, last = text.partition('-')
+    return int(first), int(last or first)
+
+def print_table(rows):
+    if not rows:
+        print("No clues match")
+        return
+    names = list(rows[0])
+    widths = [max(len(name), *(len(str(row[name])) for row in rows)) for name in names]
+    print("  ".join(name.rjust(width) for name, width in zip(names, widths)))
+    for row in rows:
+        print("  ".join(str(row[name]).rjust(width) for name, width in zip(names, widths)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, update or query the aggregate statistics of the archive.")
+    parser.add_argument("-d", "--db", default=DEFAULT_DB, help="the statistics database (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_cmd = commands.add_parser("build", help="count every game of an archive")
+    build_cmd.add_argument("archive", nargs="?", default="jarchive.csv")
+    update_cmd = commands.add_parser("update", help="count the games of a newly parsed CSV")
+    update_cmd.add_argument("new_csv")
+
+    query_cmd = commands.add_parser("rollup", help="sum the cube by some dimensions, e.g. --by category year")
+    query_cmd.add_argument("--by", nargs="*", default=["year"], choices=sorted(DIMENSIONS))
+    query_cmd.add_argument("--sort", choices=MEASURES,
+                           help="sort by a measure, largest first (default: by the dimensions)")
+    answers_cmd = commands.add_parser("answers", help="most frequent answers")
+    months_cmd = commands.add_parser("months", help="games per month")
+    for cmd in (query_cmd, answers_cmd, months_cmd):
+        cmd.add_argument("--years", type=parse_year_range, metavar="YEAR[-YEAR]")
+    for cmd in (query_cmd, answers_cmd):
+        cmd.add_argument("-n", "--limit", type=int)
+    query_cmd.add_argument("-r", "--round", type=int, dest="rnd")
+    query_cmd.add_argument("--value", type=int)
+    query_cmd.add_argument("--category", help="part of the category name, ignoring case")
+    args = parser.parse_args()
+
+    with StatsCube(args.db) as cube:
+        start = time.perf_counter()
+        if args.command == "build":
+            games = cube.build(args.archive)
+            print(f"Counted {games:,} games in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+        elif args.command == "update":
+            added, skipped = cube.update(args.new_csv)
+            print(f"Counted {added:,} new games in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            if skipped:
+                print(f"Skipped {skipped:,} games that were already counted; run `build` to recount "
+                      f"games that changed", file=sys.stderr)
+        elif args.command == "rollup":
+            print_table(cube.rollup(args.by, args.rnd, args.value, args.category, args.years,
+                                    args.sort, args.limit))
+        elif args.command == "answers":
+            for answer, clues in cube.top_answers(args.years, args.limit or 20):
+                print(f"{clues:6,}  {answer}")
+        else:
+            for month, games, clues in cube.games_per_month(args.years):
+                print(f"{month}  {games:3} games  {clues:5,} clues")
+        if args.command not in ("build", "update"):
+            print(f"Answered in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
@@ -0,0 +1,35 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive_format import HEADER, format_row
+from clue_sampler import ClueSampler, build
+
+
+def write_archive(path, texts):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(HEADER)
+        for i, text in enumerate(texts):
+            f.write(format_row([str(i + 1), "2020-01-01", "1", "CATEGORY", "$200", text, "answer"]))
+
+
+def open_sampler(tmp_path, texts):
+    archive = str(tmp_path / "jarchive.csv")
+    index = str(tmp_path / "jarchive_offsets.npy")
+    write_archive(archive, texts)
+    build(archive, index)
+    return ClueSampler(index, archive, seed=0)
+
+
+def test_sample_without_playable_rows_returns_nothing(tmp_path):
+    with open_sampler(tmp_path, ["="] * 40) as sampler:
+        assert sampler.sample() == []
+        assert sampler.sample(5) == []
+        assert len(sampler.sample(5, playable=False)) == 5
+
+
+def test_sample_with_few_playable_rows_finds_them(tmp_path):
+    with open_sampler(tmp_path, ["="] * 39 + ["the only clue"]) as sampler:
+        for _ in range(5):
+            assert [clue[5] for clue in sampler.sample()] == ["the only clue"]
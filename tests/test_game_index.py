@@ -0,0 +1,55 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import game_index
+from archive_format import HEADER, format_row
+
+CATEGORIES = ["CAT 1-0", "CAT 1-1", "CAT 1-2", "CAT 1-3", "CAT 1-4", "CAT 1-5"]
+VALUES = [200, 400, 600, 800, 1000]
+
+
+def write_game(path, missing, wagers=None):
+    """Write one game, row by row across the board like the parser, leaving out `missing` cells."""
+    wagers = wagers or {}
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(HEADER)
+        for row, value in enumerate(VALUES):
+            for column, category in enumerate(CATEGORIES):
+                if (column, row) not in missing:
+                    value = wagers.get((column, row), VALUES[row])
+                    f.write(format_row([7, "2020-01-01", 1, category, value,
+                                        f"clue {column} {row}", f"answer {column} {row}"]))
+        f.write(format_row([7, "2020-01-01", 3, "FINAL", "False", "final clue", "final answer"]))
+
+
+def load_board(tmp_path, missing, wagers=None):
+    archive = str(tmp_path / "jarchive.csv")
+    index = str(tmp_path / "jarchive_games.npz")
+    write_game(archive, missing, wagers)
+    game_index.build(archive, index)
+    return game_index.GameIndex(index, archive).board(7)
+
+
+def test_board_with_missing_clues(tmp_path):
+    # The first clue of the first category and a middle clue of another never aired
+    board = load_board(tmp_path, {(0, 0), (3, 2)}, wagers={(1, 3): 1500})
+
+    columns = board[1]
+    assert [category for category, _ in columns] == CATEGORIES
+    for column, (_, cells) in enumerate(columns):
+        assert len(cells) == len(VALUES)
+        for row, cell in enumerate(cells):
+            if (column, row) in {(0, 0), (3, 2)}:
+                assert cell is None
+            else:
+                assert cell[5] == f"clue {column} {row}"
+    assert [category for category, _ in board[3]] == ["FINAL"]
+
+
+def test_board_with_missing_bottom_row(tmp_path):
+    board = load_board(tmp_path, {(column, 4) for column in range(6)})
+
+    assert [category for category, _ in board[1]] == CATEGORIES
+    assert all(cells[4] is None and cells[3] is not None for _, cells in board[1])
@@ -0,0 +1,44 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive_format import HEADER, format_row
+from merge_archive import merge_games
+
+
+def write_archive(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(HEADER)
+        f.writelines(line + "\n" for line in lines)
+
+
+def clue(gid, text):
+    return [str(gid), "2020-01-01", "1", "CATEGORY", "$200", text, "answer"]
+
+
+def test_merge_keeps_malformed_rows(tmp_path):
+    archive = str(tmp_path / "jarchive.csv")
+    malformed = "2 || 2020-01-02 || 1 || CATEGORY || $200 || a stray || in a clue || answer"
+    write_archive(archive, [format_row(clue(1, "first")).rstrip("\n"), malformed,
+                            format_row(clue(3, "third")).rstrip("\n")])
+
+    total, games, replaced, max_gid = merge_games(archive, {2: [clue(2, "second")]})
+
+    with open(archive, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert malformed in lines
+    assert (total, games, replaced, max_gid) == (3, 3, 0, 3)
+    assert [line.split(" || ")[5] for line in lines[1:] if line != malformed] == ["first", "second", "third"]
+
+
+def test_replace_keeps_malformed_rows(tmp_path):
+    archive = str(tmp_path / "jarchive.csv")
+    malformed = "1 || only four || fields || here"
+    write_archive(archive, [format_row(clue(1, "old")).rstrip("\n"), malformed])
+
+    merge_games(archive, {1: [clue(1, "new")]}, replace=True)
+
+    with open(archive, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert lines[1:] == [format_row(clue(1, "new")).rstrip("\n"), malformed]
@@ -0,0 +1,30 @@
+import glob
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import parse_and_create_csv as pac
+
+FIXTURES = sorted(glob.glob(os.path.join(ROOT, "benchmarks", "fixtures", "*.html")) +
+                  glob.glob(os.path.join(ROOT, "benchmarks", "fixtures", "recorded", "*.html")))
+
+
+@pytest.mark.parametrize("filepath", FIXTURES, ids=os.path.basename)
+def test_engines_agree(filepath):
+    clues = pac.parse_game(filepath, engine="bs4")
+    assert clues
+    assert pac.parse_game(filepath, engine="lxml") == clues
+
+
+def test_markup_fixture_is_unescaped():
+    clues = pac.parse_game(os.path.join(ROOT, "benchmarks", "fixtures", "5117.html"), engine="lxml")
+    texts = {clue[5] for clue in clues}
+    answers = {clue[6] for clue in clues}
+    assert "This unofficial anthem begins “O beautiful for spacious skies”" in texts
+    assert "René Descartes" in answers
+    assert "5 < 6" in answers
+    assert not any("<" in text and "2 < 3" not in text for text in texts)
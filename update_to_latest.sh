@@ -1,18 +1,22 @@
 #!/bin/bash
 set -e
 
-START=7291
-END=9425
-
 cd "$(dirname "$0")"
 
-for ((ep=$START; ep<=$END; ep++)); do
-    echo "Processing episode $ep"
-    python3 download.py new_games $ep
-    python3 parser.py -d new_games > jarchive_tmp.csv
-    cat jarchive_tmp.csv >> jarchive.csv
-    echo $ep > last_episode.txt
-    rm -f new_games/*.html jarchive_tmp.csv
-done
+# A fresh checkout has only the year shards; rebuild the single archive file
+if [ ! -f jarchive.csv ]; then
+    python3 sharded_archive.py join jarchive.csv
+fi
+
+# One streaming pass from the game after last_episode.txt to the newest one:
+# pages go straight from the downloader to the parser and each game is
+# appended as soon as it is parsed
+START=$(( $(cat last_episode.txt) + 1 ))
+python3 pipeline.py "$START" auto --archive jarchive.csv --last-episode last_episode.txt
+
+# Re-split into the committed year shards; years without new games come out unchanged
+if [ -f jarchive_shards/manifest.json ]; then
+    python3 sharded_archive.py build jarchive.csv
+fi
 
-echo "Update complete. Last episode: $END"
+echo "Update complete. Last episode: $(cat last_episode.txt)"
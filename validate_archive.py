@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Integrity check of jarchive.csv: every row against the schema, every game
+against its invariants, and the game ID sequence for gaps
+
+The file is split into byte ranges that end on line breaks and checked in a
+process pool. Each worker checks its rows and summarises the runs of rows of
+each game it sees; the runs are then joined in file order, so a game split
+between two ranges is checked whole.
+
+Row checks: seven fields (a stray "||" in a clue makes more), a numeric game
+ID, a YYYY-MM-DD airdate, round 1 to 3, a numeric value in rounds 1 and 2,
+no empty category, text or answer.
+
+Game checks: rows of a game are together (a game ID found in two places is
+reported as a duplicate) and in game ID order, one airdate,
+at most 30 clues and 6 categories per round and 61 in all, exactly one Final
+Jeopardy, no repeated rows, and at least --min-clues clues.
+
+Games missing between the first and last game ID are reported as gaps,
+separated from the games known to be untranscribed (KNOWN_MISSING_GAMES and
+games the download journal records as missing) and the games whose last
+download failed (retried by later runs).
+
+The report is JSON; the exit status is 1 when any check of severity "error"
+fails (or any check at all with --strict), so it can gate a commit. With
+--since, only anomalies in games from that ID on (and malformed rows after
+the first of them) count for the exit status; older ones are still reported,
+so one legacy anomaly does not block every later update.
+"""
+
+import argparse
+import concurrent.futures as futures
+import datetime
+import json
+import mmap
+import os
+import sys
+import time
+import zlib
+
+from archive_format import COLUMNS, HEADER, SEPARATOR, parse_line
+from download_journal import DEFAULT_JOURNAL
+from download_new_episodes import KNOWN_MISSING_GAMES
+
+# Bytes of the file per parallel task
+CHUNK_BYTES = 8 << 20
+MAX_CLUES = 61
+MAX_ROUND_CLUES = 30
+MAX_CATEGORIES = 6
+# Fewer clues than this is reported; unrevealed clues make many older games short
+MIN_CLUES = 30
+# Anomalies listed per check in the report (all are counted)
+MAX_LISTED = 100
+
+SEVERITY = {
+    "header": "error",
+    "field_count": "error",
+    "bad_gid": "error",
+    "bad_airdate": "error",
+    "bad_round": "error",
+    "bad_value": "warning",
+    "empty_field": "warning",
+    "duplicate_gid": "error",
+    "gid_order": "error",
+    "airdate_mismatch": "error",
+    "too_many_clues": "error",
+    "round_overflow": "error",
+    "too_many_categories": "warning",
+    "final_jeopardy": "warning",
+    "duplicate_row": "error",
+    "few_clues": "warning",
+}
+
+def _valid_airdate(airdate, cache={}):
+    valid = cache.get(airdate)
+    if valid is None:
+        try:
+            valid = len(airdate) == 10 and datetime.date.fromisoformat(airdate) is not None
+        except ValueError:
+            valid = False
+        cache[airdate] = valid
+    return valid
+
+def _valid_value(value):
+    value = value.replace(',', '').replace('$', '')
+    return value.isdigit()
+
+def chunk_ranges(path, chunk_bytes=CHUNK_BYTES):
+    """Return (start, end) byte ranges of a file that end on line breaks."""
+    ranges = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return ranges
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < size:
+                end = mm.find(b"\n", min(start + chunk_bytes, size - 1))
+                end = size if end < 0 else end + 1
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+def check_chunk(path, start, end):
+    """Check the rows in bytes [start, end) of an archive file.
+
+    Returns (lines, anomalies, runs): the number of lines, row anomalies as
+    (check, line index within the chunk, gid, detail) and, in order, one run
+    per stretch of consecutive rows of a game, as a dict of what the game
+    checks need (row checksums map to line indices within the chunk).
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).decode('utf-8', errors='replace').split("\n")
+    if lines[-1] == "":
+        lines.pop()
+
+    anomalies = []
+    runs = []
+    run = None
+    for i, line in enumerate(lines):
+        if start == 0 and i == 0:
+            if line.replace(" ", "") != HEADER.replace(" ", "").strip():
+                anomalies.append(("header", i, None, line[:80]))
+            continue
+        if not line.strip():
+            continue
+        fields = parse_line(line)
+        if fields is None:
+            count = len(line.split("||"))
+            if count != len(COLUMNS):
+                anomalies.append(("field_count", i, None, f"{count} fields: {line[:80]}"))
+            else:
+                anomalies.append(("bad_gid", i, None, line[:80]))
+            continue
+
+        gid, airdate, rnd, category, value, text, answer = fields
+        gid = int(gid)
+        if not _valid_airdate(airdate):
+            anomalies.append(("bad_airdate", i, gid, airdate))
+        if rnd not in ("1", "2", "3"):
+            anomalies.append(("bad_round", i, gid, rnd))
+        elif rnd != "3" and not _valid_value(value):
+            anomalies.append(("bad_value", i, gid, value))
+        if not (category and text and answer):
+            anomalies.append(("empty_field", i, gid, SEPARATOR.join(fields)[:80]))
+
+        if run is None or run["gid"] != gid:
+            run = {"gid": gid, "line": i, "rows": 0, "airdates": set(), "rounds": {},
+                   "categories": {}, "rows_seen": {}, "duplicates": []}
+            runs.append(run)
+        run["rows"] += 1
+        run["airdates"].add(airdate)
+        run["rounds"][rnd] = run["rounds"].get(rnd, 0) + 1
+        run["categories"].setdefault(rnd, set()).add(category)
+        key = zlib.crc32(line.encode('utf-8'))
+        if key in run["rows_seen"]:
+            run["duplicates"].append(i)
+        else:
+            run["rows_seen"][key] = i
+    return len(lines), anomalies, runs
+
+def _merge_run(game, run):
+    """Add the rows of a later run of a game to the game."""
+    game["rows"] += run["rows"]
+    game["airdates"] |= run["airdates"]
+    for rnd, count in run["rounds"].items():
+        game["rounds"][rnd] = game["rounds"].get(rnd, 0) + count
+    for rnd, names in run["categories"].items():
+        game["categories"].setdefault(rnd, set()).update(names)
+    game["duplicates"] += run["duplicates"]
+    for key, i in run["rows_seen"].items():
+        if key in game["rows_seen"]:
+            game["duplicates"].append(run["base"] + i)
+        else:
+            game["rows_seen"][key] = i - game["base"] + run["base"]
+
+def _join_runs(runs):
+    """Join consecutive runs of the same game (split between chunks)."""
+    games = []
+    for run in runs:
+        if games and games[-1]["gid"] == run["gid"]:
+            _merge_run(games[-1], run)
+        else:
+            games.append(run)
+    return games
+
+def check_games(games, min_clues=MIN_CLUES):
+    """Yield (check, line, gid, detail) for the game invariants.
+
+    Rows of a game found in more than one place are reported, then checked
+    together.
+    """
+    by_gid = {}
+    previous = None
+    for game in games:
+        gid, line = game["gid"], game["line"]
+        first = by_gid.get(gid)
+        if first is not None:
+            yield "duplicate_gid", line, gid, f"rows also start at line {first['line']}"
+            _merge_run(first, game)
+        else:
+            by_gid[gid] = game
+            if previous is not None and gid < previous:
+                yield "gid_order", line, gid, f"after game {previous}"
+        previous = gid
+
+    for gid, game in by_gid.items():
+        line = game["line"]
+        if len(game["airdates"]) > 1:
+            yield "airdate_mismatch", line, gid, ", ".join(sorted(game["airdates"]))
+        if game["rows"] > MAX_CLUES:
+            yield "too_many_clues", line, gid, f"{game['rows']} clues"
+        for rnd in ("1", "2"):
+            if game["rounds"].get(rnd, 0) > MAX_ROUND_CLUES:
+                yield "round_overflow", line, gid, f"{game['rounds'][rnd]} clues in round {rnd}"
+            if len(game["categories"].get(rnd, ())) > MAX_CATEGORIES:
+                yield "too_many_categories", line, gid, f"{len(game['categories'][rnd])} categories in round {rnd}"
+        if game["rounds"].get("3", 0) != 1:
+            yield "final_jeopardy", line, gid, f"{game['rounds'].get('3', 0)} Final Jeopardy clues"
+        for duplicate in game["duplicates"]:
+            yield "duplicate_row", duplicate, gid, "same row earlier in the game"
+        if game["rows"] < min_clues:
+            yield "few_clues", line, gid, f"{game['rows']} clues"
+
+def _ranges(numbers):
+    """Compress sorted integers into [first, last] ranges."""
+    ranges = []
+    for n in numbers:
+        if ranges and n == ranges[-1][1] + 1:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    return ranges
+
+def journal_status(journal_path):
+    """Return {gid: status} of the latest download journal entry of each game."""
+    latest = {}
+    if journal_path and os.path.exists(journal_path):
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                latest[entry["gid"]] = entry["status"]
+    return latest
+
+def validate(path, workers=None, min_clues=MIN_CLUES, journal_path=DEFAULT_JOURNAL,
+             chunk_bytes=CHUNK_BYTES, since=None):
+    """Check an archive file; return the report as a dict.
+
+    `new_errors` and `new_warnings` count the anomalies in games from
+    `since` on, or all of them without `since`.
+    """
+    start = time.perf_counter()
+    ranges = chunk_ranges(path, chunk_bytes)
+    workers = min(workers or os.cpu_count() or 1, max(len(ranges), 1))
+    if workers <= 1:
+        results = [check_chunk(path, a, b) for a, b in ranges]
+    else:
+        with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(check_chunk, [path] * len(ranges), *zip(*ranges)))
+
+    # Chunk-local line indices become 1-based line numbers of the file
+    anomalies = []
+    runs = []
+    line_base = 1
+    for lines, chunk_anomalies, chunk_runs in results:
+        anomalies.extend((check, line_base + i, gid, detail) for check, i, gid, detail in chunk_anomalies)
+        for run in chunk_runs:
+            run["base"] = line_base
+            run["line"] += line_base
+            run["duplicates"] = [line_base + i for i in run["duplicates"]]
+        runs.extend(chunk_runs)
+        line_base += lines
+    games = _join_runs(runs)
+    anomalies.extend(check_games(games, min_clues))
+
+    gids = sorted({game["gid"] for game in games})
+    present = set(gids)
+    absent = [gid for gid in range(gids[0], gids[-1] + 1) if gid not in present] if gids else []
+    journal = journal_status(journal_path)
+    known = KNOWN_MISSING_GAMES | {gid for gid, status in journal.items() if status == "missing"}
+    failed = {gid for gid, status in journal.items() if status == "failed"}
+
+    # Malformed rows have no game ID; they are new if they follow the first new game
+    new_lines = [game["line"] for game in games if since is not None and game["gid"] >= since]
+    since_line = min(new_lines) if new_lines else None
+
+    def is_new(line, gid):
+        if since is None:
+            return True
+        if gid is not None:
+            return gid >= since
+        return since_line is not None and line >= since_line
+
+    counts = {}
+    new_counts = {}
+    listed = {}
+    for check, line, gid, detail in sorted(anomalies, key=lambda a: a[1]):
+        counts[check] = counts.get(check, 0) + 1
+        if is_new(line, gid):
+            new_counts[check] = new_counts.get(check, 0) + 1
+        if counts[check] <= MAX_LISTED:
+            listed.setdefault(check, []).append({"line": line, "gid": gid, "detail": detail})
+    errors = sum(count for check, count in counts.items() if SEVERITY[check] == "error")
+    new_errors = sum(count for check, count in new_counts.items() if SEVERITY[check] == "error")
+    return {
+        "archive": path,
+        "bytes": os.path.getsize(path),
+        "lines": line_base - 1,
+        "rows": sum(game["rows"] for game in games),
+        "games": len(gids),
+        "first_gid": gids[0] if gids else None,
+        "last_gid": gids[-1] if gids else None,
+        "errors": errors,
+        "warnings": sum(counts.values()) - errors,
+        "since": since,
+        "new_errors": new_errors,
+        "new_warnings": sum(new_counts.values()) - new_errors,
+        "counts": {check: {"severity": SEVERITY[check], "count": count, "new": new_counts.get(check, 0)}
+                   for check, count in sorted(counts.items())},
+        "gaps": _ranges([gid for gid in absent if gid not in known and gid not in failed]),
+        "known_missing": [gid for gid in absent if gid in known],
+        "failed_downloads": [gid for gid in absent if gid in failed and gid not in known],
+        "anomalies": listed,
+        "chunks": len(ranges),
+        "workers": workers,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+def print_summary(report):
+    print(f"{report['archive']}: {report['rows']:,} rows in {report['games']:,} games "
+          f"({report['first_gid']}-{report['last_gid']}), checked in {report['seconds']:.2f}s "
+          f"with {report['workers']} workers", file=sys.stderr)
+    for check, entry in report["counts"].items():
+        new = f" ({entry['new']:,} from game {report['since']})" if report["since"] is not None else ""
+        print(f"  {entry['severity']:7} {check:20} {entry['count']:7,}{new}", file=sys.stderr)
+    gaps = ", ".join(f"{a}" if a == b else f"{a}-{b}" for a, b in report["gaps"][:20])
+    print(f"  gaps: {gaps or 'none'}{' ...' if len(report['gaps']) > 20 else ''}; "
+          f"known missing: {report['known_missing'] or 'none'}; "
+          f"failed downloads: {report['failed_downloads'] or 'none'}", file=sys.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the archive's rows and games and report gaps and anomalies.")
+    parser.add_argument("archive", nargs="?", default="jarchive.csv")
+    parser.add_argument("-o", "--report", help="write the JSON report here (default: stdout)")
+    parser.add_argument("-w", "--workers", type=int, help="checking processes (default: one per CPU)")
+    parser.add_argument("--min-clues", type=int, default=MIN_CLUES,
+                        help="report games with fewer clues (default: %(default)s)")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL,
+                        help="download journal whose missing and failed games are not gaps (default: %(default)s)")
+    parser.add_argument("--since", type=int, metavar="GID",
+                        help="fail only on anomalies in games from this ID on; report the rest")
+    parser.add_argument("--strict", action="store_true", help="fail on warnings too")
+    args = parser.parse_args()
+
+    report = validate(args.archive, args.workers, args.min_clues, args.journal, since=args.since)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    print_summary(report)
+    failed = report["new_errors"] + (report["new_warnings"] if args.strict else 0)
+    sys.exit(1 if failed else 0)